@@ -52,12 +52,18 @@ Notes:
 # 4) Run the automatic annealer which will attempt to choose reasonable values
 # for maximum and minimum temperatures and then anneal for the allotted time.
 
-import copy, math, sys, time
+import copy, math, os, sys, time
 try:
     from numpy import random
 except ImportError:
     import random
 
+# Reasons for annealing to stop, left in Annealer.stop_reason.
+STOP_STEPS = 'steps'                # ran the requested number of steps
+STOP_TIME = 'time_budget'           # ran out of time
+STOP_TARGET = 'target_energy'       # reached the target energy
+STOP_STAGNATION = 'no_improvement'  # the best energy stopped improving
+
 def round_figures(x, n):
     """Returns x rounded to n significant figures."""
     return round(x, int(n - math.ceil(math.log10(abs(x)))))
@@ -69,29 +75,254 @@ def time_string(seconds):
     m, s = divmod(s, 60)     # split remainder into minutes and seconds
     return '%4i:%02i:%02i' % (h, m, s)
 
+class RandomStream:
+    """Hands out random numbers from its own numpy RandomState in blocks.
+    
+    Scalar calls into numpy are slow, so uniform draws are taken block_size
+    at a time and served from a list, and the Metropolis tests draw whole
+    blocks of exponential variates at once.  A stream made or seeded with
+    the same seed hands out the same numbers; seeding drops the numbers
+    already drawn."""
+    def __init__(self, seed=None, block_size=4096):
+        self.block_size = block_size
+        self.rng = random.RandomState(seed)
+        self.buffer = []          # uniform draws not handed out yet
+        self.pos = 0              # index of the next draw in buffer
+    
+    def seed(self, seed):
+        """Reseeds the stream and empties the buffer."""
+        self.rng.seed(seed)
+        self.buffer, self.pos = [], 0
+    
+    def seeds(self, n):
+        """Returns n seeds for the streams of other processes, so that a
+        seeded stream also fixes the streams derived from it."""
+        return [int(k) for k in self.rng.randint(0, 2**31 - 1, size=n)]
+    
+    def random(self):
+        """Returns a uniform random number in [0, 1)."""
+        if self.pos == len(self.buffer):
+            self.buffer, self.pos = self.rng.random_sample(self.block_size).tolist(), 0
+        u = self.buffer[self.pos]
+        self.pos += 1
+        return u
+    
+    def index(self, n):
+        """Returns a random integer in [0, n - 1]."""
+        return min(int(self.random() * n), n - 1)
+    
+    def shuffle(self, lst):
+        """Shuffles lst in place."""
+        for i in range(len(lst) - 1, 0, -1):
+            j = self.index(i + 1)
+            lst[i], lst[j] = lst[j], lst[i]
+    
+    def exponentials(self, n):
+        """Returns n draws of -log(1 - u) for uniform u, as a list.
+        
+        A move that raises the energy by dE at temperature T passes the
+        Metropolis test exp(-dE/T) >= u exactly when dE <= T * -log(1 - u),
+        so a block of these replaces a random number and an exponential
+        per step."""
+        return self.rng.standard_exponential(n).tolist()
+    
+    def get_state(self):
+        """Returns the state of the RandomState and the uniform draws not
+        handed out yet."""
+        return self.rng.get_state(), self.buffer[self.pos:]
+    
+    def set_state(self, state):
+        """Puts back a state returned by get_state."""
+        rngState, remainder = state
+        self.rng.set_state(rngState)
+        self.buffer, self.pos = [float(u) for u in remainder], 0
+
 class Annealer:
     """Performs simulated annealing by calling functions to calculate
     energy and make moves on a state.  The temperature schedule for
     annealing may be provided manually or estimated automatically.
     """
-    def __init__(self, energy, move):
-        self.energy = energy  # function to calculate energy of a state
-        self.move = move      # function to make a random change to a state
+    def __init__(self, energy, move, undo=None, snapshot=None, restore=None,
+                 delta=None, pack=None, unpack=None, stream=None):
+        self.energy = energy      # function to calculate energy of a state
+        self.move = move          # function to make a random change to a state
+        self.undo = undo          # function to revert a move given its undo record
+        self.snapshot = snapshot  # function to take a compact copy of a state
+        self.restore = restore    # function to write a snapshot back into a state
+        self.delta = delta        # function to calculate the energy change of a move
+        self.pack = pack          # function to encode a saved state as numpy arrays
+        self.unpack = unpack      # function to decode packed arrays into a saved state
+        if stream is None:
+            stream = RandomStream()
+        self.stream = stream      # random numbers shared with the move function
+        self.stop_reason = None   # why the last run stopped (a STOP_ constant)
+        self.steps_taken = 0      # the number of steps of the last run
+
+    def move_energy(self, state, prevEnergy):
+        """Makes a move and returns its undo record and the new energy.
+
+        Uses the delta function if one was given, so that only the part of
+        the state touched by the move is re-evaluated."""
+        record = self.move(state)
+        if self.delta is None:
+            return record, self.energy(state)
+        return record, prevEnergy + self.delta(state, record)
+
+    def accepted_energy(self, state, E, dE):
+        """Returns the energy of state after an accepted move of energy E.
+
+        A delta that cancels most of the previous energy (e.g. a move off a
+        heavily penalized state) leaves E with the rounding error of the
+        larger value, so in that case the energy is recomputed in full."""
+        if self.delta is not None and abs(dE) > abs(E):
+            return self.energy(state)
+        return E
+
+    def stop_check(self, step, bestEnergy, lastImprovement, deadline,
+                   target_energy, stop_after):
+        """Returns the reason to stop a run after step, or None to go on.
+
+        The clock is only read every 100 steps."""
+        if target_energy is not None and bestEnergy <= target_energy:
+            return STOP_TARGET
+        if stop_after is not None and step - lastImprovement >= stop_after:
+            return STOP_STAGNATION
+        if deadline is not None and step % 100 == 0 and time.time() > deadline:
+            return STOP_TIME
+        return None
+
+    def save_state(self, state):
+        """Returns a copy of state that load_state can later restore.
+
+        Uses the snapshot function if one was given, and falls back to a
+        deep copy of the whole state otherwise."""
+        if self.snapshot is None:
+            return copy.deepcopy(state)
+        return self.snapshot(state)
+
+    def load_state(self, state, saved):
+        """Returns state with the copy taken by save_state written back."""
+        if self.restore is None:
+            return saved
+        return self.restore(state, saved)
+
+    def write_checkpoint(self, path, state, bestState, info):
+        """Writes the current state, the best state (as returned by
+        save_state), the numbers and arrays in info and the state of the
+        stream to path, as a compressed numpy archive.
+
+        pack(state, saved) must return a dict of numpy arrays describing a
+        saved state.  The file is replaced atomically, so an interrupted
+        write leaves the previous checkpoint in place."""
+        import numpy
+        if self.pack is None or self.unpack is None:
+            raise ValueError('Checkpoints require pack and unpack functions.')
+        arrays = {}
+        for prefix, saved in (('current_', self.save_state(state)),
+                              ('best_', bestState)):
+            for name, value in self.pack(state, saved).items():
+                arrays[prefix + name] = value
+        for name, value in info.items():
+            arrays['info_' + name] = numpy.array(value)
+        rngState, remainder = self.stream.get_state()
+        kind, keys, pos, has_gauss, cached_gaussian = rngState
+        arrays['rng_keys'] = keys
+        arrays['rng_extra'] = numpy.array([pos, has_gauss, cached_gaussian])
+        arrays['stream_buffer'] = numpy.array(remainder, dtype=float)
+        temp = path + '.tmp'
+        f = open(temp, 'wb')
+        try:
+            numpy.savez_compressed(f, **arrays)
+        finally:
+            f.close()
+        os.rename(temp, path)
+
+    def read_checkpoint(self, path, state):
+        """Reads a checkpoint written by write_checkpoint, writes its current
+        state back into state and restores the stream.
+
+        Returns the state, the best state (as returned by save_state) and
+        the info dict."""
+        import numpy
+        if self.pack is None or self.unpack is None:
+            raise ValueError('Checkpoints require pack and unpack functions.')
+        archive = numpy.load(path)
+        try:
+            arrays = dict((name, archive[name]) for name in archive.files)
+        finally:
+            archive.close()
+        parts = {'current_': {}, 'best_': {}, 'info_': {}}
+        for name, value in arrays.items():
+            for prefix in parts:
+                if name.startswith(prefix):
+                    parts[prefix][name[len(prefix):]] = value
+        state = self.load_state(state, self.unpack(state, parts['current_']))
+        bestState = self.unpack(state, parts['best_'])
+        pos, has_gauss, cached_gaussian = arrays['rng_extra']
+        self.stream.set_state((('MT19937', arrays['rng_keys'], int(pos),
+                                int(has_gauss), float(cached_gaussian)),
+                               arrays['stream_buffer']))
+        return state, bestState, parts['info_']
     
-    def anneal(self, state, Tmax, Tmin, steps, updates=0):
+    def anneal(self, state, Tmax, Tmin, steps=None, updates=0,
+               time_budget_seconds=None, target_energy=None, stop_after=None,
+               warmup_steps=1000, checkpoint_file=None, checkpoint_every=10000,
+               resume=False, block_size=1024):
         """Minimizes the energy of a system by simulated annealing.
         
         Keyword arguments:
         state -- an initial arrangement of the system
         Tmax -- maximum temperature (in units of energy)
         Tmin -- minimum temperature (must be greater than zero)
-        steps -- the number of steps requested
+        steps -- the number of steps requested (with a time budget, the
+            most steps to make; may be None)
         updates -- the number of updates to print during annealing
+        time_budget_seconds -- the number of seconds to anneal for
+        target_energy -- stop once the best energy is at or below this
+        stop_after -- stop once the best energy has not improved for this
+            many steps
+        warmup_steps -- with a time budget, the number of steps made at Tmax
+            to measure the speed of the system
+        checkpoint_file -- a file to write checkpoints to (see
+            write_checkpoint), or None
+        checkpoint_every -- the number of steps between checkpoints
+        resume -- continue the run saved in checkpoint_file, which must have
+            been started with the same arguments, instead of starting afresh
+        block_size -- the number of steps to precompute temperatures and
+            Metropolis thresholds for at a time
         
-        Returns the best state and energy found."""
+        With a time budget, the first warmup_steps steps are made at Tmax,
+        and the cooling from Tmax to Tmin is then spread over as many steps
+        as the measured speed allows in the remaining time.  The run also
+        stops once the budget is spent.
+        
+        A checkpoint holds the current and best states, the step, the
+        temperature, the energies and the state of the stream, so a resumed
+        run makes the same moves as an uninterrupted one would have.  A last checkpoint is written when the run stops.
         
+        The temperatures of the schedule and the draws of the Metropolis
+        tests are computed block_size steps at a time (see
+        RandomStream.exponentials), so that a step makes no call into numpy
+        and no call to exp.
+        
+        If the annealer was given an undo function, then move must return an
+        undo record, and rejected moves are reverted by passing that record
+        to undo instead of deep-copying the whole state on every step.
+        If it was also given a delta function, then delta(state, record)
+        supplies the energy change of each move in place of a full call to
+        energy.
+        
+        Returns the best state and energy found.  Why the run stopped is
+        left in stop_reason, and the number of steps made in steps_taken."""
+        
+        import numpy
         step = 0
         start = time.time()
+        if steps is None and time_budget_seconds is None:
+            print 'Annealing requires a number of steps or a time budget.'
+            sys.exit()
+        if resume and checkpoint_file is None:
+            raise ValueError('Resuming requires the checkpoint_file to resume from.')
         
         def update(T, E, acceptance, improvement):
             """Prints the current temperature, energy, acceptance rate,
@@ -123,39 +354,104 @@ class Annealer:
                     (T, E, 100.0*acceptance, 100.0*improvement,
                         time_string(elapsed), time_string(remain))
         
+        def checkpoint():
+            """Writes the run so far to checkpoint_file."""
+            self.write_checkpoint(checkpoint_file, state, bestState,
+                {'step': step, 'steps': steps, 'cool_from': coolFrom,
+                 'energy': prevEnergy, 'best_energy': bestEnergy,
+                 'last_improvement': lastImprovement, 'temperature': T,
+                 'elapsed': time.time() - start, 'block_start': blockStart,
+                 'exponentials': exponentials})
+        
+        def thresholds(first, count):
+            """Returns the temperatures of steps first+1 to first+count, and
+            the largest energy rise each of those steps accepts."""
+            ks = numpy.arange(first + 1, first + count + 1)
+            if steps > coolFrom:
+                temps = Tmax * numpy.exp(Tfactor * numpy.maximum(ks - coolFrom, 0)
+                                         / float(steps - coolFrom))
+            else:
+                temps = numpy.empty(count)
+                temps.fill(Tmax)
+            return temps.tolist(), (temps * exponentials).tolist()
+        
         # Precompute factor for exponential cooling from Tmax to Tmin
         if Tmin <= 0.0:
             print 'Exponential cooling requires a minimum temperature greater than zero.'
             sys.exit()
         Tfactor = -math.log( float(Tmax) / Tmin )
         
+        # With a time budget, the cooling starts after the warm-up, once the
+        # number of steps that fit in the budget is known.
+        deadline = None
+        coolFrom = 0
+        maxSteps = None
+        if time_budget_seconds is not None:
+            deadline = start + time_budget_seconds
+            maxSteps = steps
+            coolFrom = warmup_steps if steps is None else min(warmup_steps, steps)
+            steps = coolFrom
+        
         # Note initial state
         T = Tmax
+        if resume:
+            state, resumedBest, info = self.read_checkpoint(checkpoint_file, state)
 
         # Keeps track of the current energy. 
         E = self.energy(state)
-        prevState = copy.deepcopy(state)
-        #prevState = state[:]
+        if self.undo is None:
+            prevState = copy.deepcopy(state)
+            #prevState = state[:]
         prevEnergy = E
 
         # Best state and energy are the initial.
-        bestState = copy.deepcopy(state)
-        #bestState = state[:]
+        bestState = self.save_state(state)
         bestEnergy = E
         trials, accepts, improves = 0, 0, 0
+        lastImprovement = 0
+        reason = None
+        
+        # The steps blockStart+1 to blockStart+len(exponentials) use the
+        # current block of draws.
+        blockStart, exponentials = 0, []
+        
+        # Pick up a checkpointed run where it left off.
+        if resume:
+            bestState = resumedBest
+            step, steps = int(info['step']), int(info['steps'])
+            coolFrom = int(info['cool_from'])
+            E = prevEnergy = float(info['energy'])
+            bestEnergy = float(info['best_energy'])
+            lastImprovement = int(info['last_improvement'])
+            T = float(info['temperature'])
+            start = time.time() - float(info['elapsed'])
+            if deadline is not None:
+                deadline = start + time_budget_seconds
+            blockStart = int(info['block_start'])
+            exponentials = info['exponentials']
+        exponentials = numpy.array(exponentials, dtype=float)
+        temps, limits = thresholds(blockStart, len(exponentials))
+        
         if updates > 0:
-            updateWavelength = float(steps) / updates
-            update(T, E, None, None)
+            if deadline is None or step >= coolFrom:
+                updateWavelength = float(steps) / updates
+            else:
+                updateWavelength = float('inf')
+            if step == 0:
+                update(T, E, None, None)
+            else:
+                print 'Resuming at step %i of %i.' % (step, steps)
         
         # Attempt moves to new states
         while step < steps:
             step += 1
-            T = Tmax * math.exp( Tfactor * step / steps )
-            # Make a new move.
-            self.move(state)
-
-            # Calculate the energy of the new state.
-            E = self.energy(state)
+            if step > blockStart + len(limits):
+                blockStart = step - 1
+                exponentials = numpy.array(self.stream.exponentials(block_size))
+                temps, limits = thresholds(blockStart, block_size)
+            T = temps[step - blockStart - 1]
+            # Make a new move and calculate the energy of the new state.
+            record, E = self.move_energy(state, prevEnergy)
             #print "Best energy: " + str(bestEnergy)
             #print "Current energy: " + str(E)
 
@@ -164,10 +460,13 @@ class Annealer:
             trials += 1
 
             # If it increases energy and we decide to accept it:
-            if dE > 0.0 and math.exp(-dE/T) < random.random():
+            if dE > limits[step - blockStart - 1]:
                 # Restore previous state
-                state = copy.deepcopy(prevState)
-                #state = prevState[:]
+                if self.undo is None:
+                    state = copy.deepcopy(prevState)
+                    #state = prevState[:]
+                else:
+                    self.undo(state, record)
                 E = prevEnergy
 
             # If it decreases energy (we always accept it):
@@ -176,22 +475,180 @@ class Annealer:
                 accepts += 1
                 if dE < 0.0:
                     improves += 1
-                prevState = copy.deepcopy(state)
-                #prevState = state[:]
+                if self.undo is None:
+                    prevState = copy.deepcopy(state)
+                    #prevState = state[:]
+                E = self.accepted_energy(state, E, dE)
                 prevEnergy = E
                 if E < bestEnergy:
-                    bestState = copy.deepcopy(state)
-                    #bestState = state[:]
+                    bestState = self.save_state(state)
                     bestEnergy = E
+                    lastImprovement = step
             if updates > 1:
                 if step // updateWavelength > (step-1) // updateWavelength:
                     update(T, E, float(accepts)/trials, float(improves)/trials)
                     print "Best energy: " + str(bestEnergy)
                     print "Current energy: " + str(E)
                     trials, accepts, improves = 0, 0, 0
+            
+            # At the end of the warm-up, fit the cooling into the time left.
+            if deadline is not None and step == coolFrom:
+                now = time.time()
+                rate = step / max(now - start, 1e-6)
+                steps = step + max(1, int(0.95 * rate * (deadline - now)))
+                if maxSteps is not None:
+                    steps = min(steps, maxSteps)
+                if updates > 0:
+                    updateWavelength = float(steps) / updates
+                temps, limits = thresholds(blockStart, len(exponentials))
+            
+            reason = self.stop_check(step, bestEnergy, lastImprovement,
+                                     deadline, target_energy, stop_after)
+            if reason is not None:
+                break
+            if checkpoint_file is not None and step % checkpoint_every == 0:
+                checkpoint()
         
+        if checkpoint_file is not None:
+            checkpoint()
+        # Running out of the steps estimated to fit in the budget is running
+        # out of time, unless the requested number of steps was reached.
+        if reason is None and deadline is not None and \
+                (maxSteps is None or step < maxSteps):
+            reason = STOP_TIME
+        self.stop_reason = STOP_STEPS if reason is None else reason
+        self.steps_taken = step
         # Return best state and energy
-        return bestState, bestEnergy
+        return self.load_state(state, bestState), bestEnergy
+    
+    def adaptive_anneal(self, state, Tmax, Tmin, steps, window=500,
+                        accept_start=0.5, accept_end=0.001, reheat_after=None,
+                        reheat_factor=10.0, stop_after=None, updates=0,
+                        time_budget_seconds=None, target_energy=None):
+        """Minimizes the energy of a system by simulated annealing with an
+        adaptive temperature schedule.
+        
+        Instead of following a fixed cooling curve, the temperature is
+        adjusted every window steps so that the acceptance rate over the last
+        window steps follows a target that falls geometrically from
+        accept_start to accept_end over the run.  When the best energy has
+        not improved for reheat_after steps, the temperature is multiplied by
+        reheat_factor (up to Tmax); when it has not improved for stop_after
+        steps, the run stops early.
+        
+        Keyword arguments:
+        state -- an initial arrangement of the system
+        Tmax -- maximum (and initial) temperature
+        Tmin -- minimum temperature (must be greater than zero)
+        steps -- the maximum number of steps
+        window -- the number of steps the acceptance rate is measured over
+        accept_start -- the target acceptance rate at the first step
+        accept_end -- the target acceptance rate at the last step
+        reheat_after -- steps without improvement before reheating
+            (defaults to a tenth of steps)
+        reheat_factor -- the factor the temperature is raised by on reheating
+        stop_after -- steps without improvement before stopping (defaults
+            to never stopping early)
+        updates -- the number of updates to print during annealing
+        time_budget_seconds -- the number of seconds to anneal for; the
+            target acceptance rate then falls with the elapsed time or the
+            steps, whichever is further along
+        target_energy -- stop once the best energy is at or below this
+        
+        The undo, snapshot, restore and delta functions are used as in anneal,
+        and the Metropolis draws are taken window steps at a time.
+        
+        Returns the best state and energy found, with stop_reason and
+        steps_taken set as in anneal."""
+        
+        if Tmin <= 0.0:
+            print 'Adaptive annealing requires a minimum temperature greater than zero.'
+            sys.exit()
+        if reheat_after is None:
+            reheat_after = max(window, steps // 10)
+        start = time.time()
+        deadline = None
+        if time_budget_seconds is not None:
+            deadline = start + time_budget_seconds
+        
+        T = float(Tmax)
+        E = self.energy(state)
+        if self.undo is None:
+            prevState = copy.deepcopy(state)
+        prevEnergy = E
+        bestState = self.save_state(state)
+        bestEnergy = E
+        
+        # Acceptances of the last window steps, as a ring buffer.
+        accepted = [0] * window
+        windowAccepts = 0
+        lastImprovement, lastReheat, reheats = 0, 0, 0
+        reason = None
+        if updates > 0:
+            updateWavelength = float(steps) / updates
+            print ' Temperature        Energy    Accept   Reheats     Elapsed'
+        
+        step = 0
+        exponentials, drawn = [], 0
+        while step < steps:
+            step += 1
+            if drawn == len(exponentials):
+                exponentials, drawn = self.stream.exponentials(window), 0
+            record, E = self.move_energy(state, prevEnergy)
+            dE = E - prevEnergy
+            drawn += 1
+            if dE > T * exponentials[drawn - 1]:
+                if self.undo is None:
+                    state = copy.deepcopy(prevState)
+                else:
+                    self.undo(state, record)
+                E = prevEnergy
+                accept = 0
+            else:
+                accept = 1
+                if self.undo is None:
+                    prevState = copy.deepcopy(state)
+                E = self.accepted_energy(state, E, dE)
+                prevEnergy = E
+                if E < bestEnergy:
+                    bestState = self.save_state(state)
+                    bestEnergy = E
+                    lastImprovement = step
+            slot = step % window
+            windowAccepts += accept - accepted[slot]
+            accepted[slot] = accept
+            
+            # Steer the acceptance rate towards the target.
+            if slot == 0:
+                progress = float(step) / steps
+                if deadline is not None:
+                    progress = max(progress, (time.time() - start) / time_budget_seconds)
+                target = accept_start * (float(accept_end) / accept_start) ** min(1.0, progress)
+                rate = float(windowAccepts) / window
+                factor = (target + accept_end) / (rate + accept_end)
+                T = min(Tmax, max(Tmin, T * min(2.0, max(0.5, factor))))
+            
+            # Reheat on stagnation, and stop once it has gone on too long.
+            reason = self.stop_check(step, bestEnergy, lastImprovement,
+                                     deadline, target_energy, stop_after)
+            if reason is not None:
+                break
+            if step - max(lastImprovement, lastReheat) >= reheat_after:
+                T = min(Tmax, T * reheat_factor)
+                lastReheat = step
+                reheats += 1
+            
+            if updates > 1:
+                if step // updateWavelength > (step-1) // updateWavelength:
+                    print '%12.2f  %12.2f  %7.2f%%  %8i  %s' % \
+                        (T, E, 100.0*windowAccepts/min(step, window), reheats,
+                            time_string(time.time() - start))
+        
+        self.stop_reason = STOP_STEPS if reason is None else reason
+        self.steps_taken = step
+        if updates > 0:
+            print 'Stopped after %i steps with %i reheats.' % (step, reheats)
+        return self.load_state(state, bestState), bestEnergy
     
     def auto(self, state, minutes, steps=2000):
         """Minimizes the energy of a system by simulated annealing with
@@ -208,24 +665,30 @@ class Annealer:
             """Anneals a system at constant temperature and returns the state,
             energy, rate of acceptance, and rate of improvement."""
             E = self.energy(state)
-            prevState = copy.deepcopy(state)
-            #prevState = state[:]
+            if self.undo is None:
+                prevState = copy.deepcopy(state)
+                #prevState = state[:]
             prevEnergy = E
             accepts, improves = 0, 0
+            exponentials = self.stream.exponentials(steps)
             for step in range(steps):
-                self.move(state)
-                E = self.energy(state)
+                record, E = self.move_energy(state, prevEnergy)
                 dE = E - prevEnergy
-                if dE > 0.0 and math.exp(-dE/T) < random.random():
-                    state = copy.deepcopy(prevState)
-                    #state = prevState[:]
+                if dE > T * exponentials[step]:
+                    if self.undo is None:
+                        state = copy.deepcopy(prevState)
+                        #state = prevState[:]
+                    else:
+                        self.undo(state, record)
                     E = prevEnergy
                 else:
                     accepts += 1
                     if dE < 0.0:
                         improves += 1
-                    prevState = copy.deepcopy(state)
-                    #prevState = state[:]
+                    if self.undo is None:
+                        prevState = copy.deepcopy(state)
+                        #prevState = state[:]
+                    E = self.accepted_energy(state, E, dE)
                     prevEnergy = E
             return state, E, float(accepts)/steps, float(improves)/steps
         
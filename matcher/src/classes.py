@@ -27,6 +27,21 @@ alg_number_project_rankings = None
 
 duplicate_rankings = None
 
+# How the diversity of a team is measured: the sum over pairs of teammates
+# of their Mahalanobis distance, or of its square.
+diversity_metrics = ["mahalanobis", "squared_mahalanobis"]
+diversity_metric = "mahalanobis"
+
+# The team composition constraints of the [constraints] section, as
+# (name, column, values, min_count, max_count, weight) tuples, or None to
+# use penalties.default_rules.
+constraint_columns = ["degree", "business", "coding", "work_experience"]
+constraints = None
+
+# The share of the swaps of perry_geo_annealing.move that are drawn by
+# perry_geo_annealing.targeted_swap instead of uniformly.
+targeted_swap_probability = 0.5
+
 def init_classes(config):
         global max_business_ability
         global vals_business_ability
@@ -40,6 +55,9 @@ def init_classes(config):
         global number_project_rankings 
         global alg_number_project_rankings 
         global duplicate_rankings
+        global diversity_metric
+        global constraints
+        global targeted_swap_probability
 
         configFilePath = config.encode('string-escape')
         configParser.read(configFilePath)
@@ -91,6 +109,71 @@ def init_classes(config):
         else :
                 vals_valid_projects = range(1, num_valid_projects + 1)
 
+        try:
+                diversity_metric = configParser.get('valid_values', 'diversity_metric')
+        except (ConfigParser.Error):
+                diversity_metric = "mahalanobis"
+        if (not(diversity_metric in diversity_metrics)):
+                raise FieldError("diversity_metric must be one of " + str(diversity_metrics) + ".")
+
+        try:
+                targeted_swap_probability = configParser.getfloat('annealing', 'targeted_swap_probability')
+        except (ConfigParser.Error):
+                targeted_swap_probability = 0.5
+        if (not(0 <= targeted_swap_probability <= 1)):
+                raise FieldError("targeted_swap_probability must be between 0 and 1.")
+
+        if (configParser.has_section('constraints')):
+                constraints = [parse_constraint(name, value)
+                               for (name, value) in configParser.items('constraints')]
+        else:
+                constraints = None
+
+def parse_constraint(name, value):
+        '''
+                Parses one line of the [constraints] section of the config.
+
+                Parameters
+                ----------
+                name: the name of the constraint (string).
+                value: "column values min_count max_count weight", where column
+                    is one of constraint_columns, values is a comma separated
+                    list of values (degrees may be given by name) or a
+                    threshold such as >=3 or <=1, and max_count is - for no
+                    maximum (string).
+
+                Returns
+                -------
+                (name, column, values, min_count, max_count, weight), with
+                max_count None for no maximum.
+        '''
+        fields = value.split()
+        if (len(fields) != 5):
+                raise FieldError("Constraint " + name + " must be given as: column values min_count max_count weight.")
+        (column, values, min_count, max_count, weight) = fields
+        if (not(column in constraint_columns)):
+                raise FieldError("Constraint " + name + " must test one of " + str(constraint_columns) + ".")
+        valid = {"degree" : vals_degree_pursuing.keys(), "business" : vals_business_ability,
+                 "coding" : vals_coding_ability, "work_experience" : vals_work_experience}[column]
+        try:
+                if (values.startswith(">=")):
+                        values = [v for v in valid if v >= int(values[2:])]
+                elif (values.startswith("<=")):
+                        values = [v for v in valid if v <= int(values[2:])]
+                else:
+                        degree_codes = dict((degree, code) for (code, degree) in vals_degree_pursuing.items())
+                        values = [degree_codes[v] if (column == "degree" and v in degree_codes) else int(v)
+                                  for v in values.split(",")]
+                min_count = int(min_count)
+                max_count = None if (max_count == "-") else int(max_count)
+                weight = float(weight)
+        except (ValueError):
+                raise FieldError("Invalid values, counts or weight for constraint " + name + ".")
+        for v in values:
+                if (not(v in valid)):
+                        raise FieldError("Invalid value " + str(v) + " for constraint " + name + ".")
+        return (name, column, values, min_count, max_count, weight)
+
 
 existing_student_IDs = []
 existing_team_IDs = []
@@ -108,248 +191,327 @@ class CompError(Exception):
 	def __str__(self):
 		return repr(self.val)
 
-class Student(object):
+class StudentTable(object):
+	'''
+		Columnar storage for the data of every student: one numpy array per
+		attribute, where row i holds the student whose index is i.
+		Student objects are thin views over one row of the table.
 
-	global vals_cs_ug
-	global vals_yrs_work_experience
-	global vals_coding_ability
-	global vals_valid_projects
-	global number_project_rankings
-        global alg_number_project_rankings
-        global duplicate_rankings
+		The table is never modified once it is built, so it is shared rather
+		than copied when students (or states holding them) are deep-copied.
+	'''
+
+	def __init__(self, IDs, names, degrees, business_abilities, coding_abilities,
+				 work_experiences, project_rankings, bin_fields):
+		'''
+			Checks and stores the data for all students. Each parameter is a
+			list with one entry per student, in index order.
 
-	def __init__ (self, name, ID, degree_pursuing, bus_abil, cod_abil, num_yrs_work_exp,
-				   project_rnks, bin_field = 0, is_normalized=False, rankings_can_be_empty = False):
-		''' 
 			Parameters
 			----------
-			name  = student's name (string).
-			ID 	  = student's ID (int).
-			degree_pursuing =  student's degree (string or int).
+			IDs = students' IDs (int list).
+			names = students' names (string list).
+			degrees = students' degrees (string or int list).
 			    0 for MBA, 1 for MEng, 2 for HT, 3 for CM
-			bus_abil  = student's business ability (int). From 0 to 4, inclusive.
-			cod_abil  = student's coding ability (int). From 0 to 4, inclusive.
-			num_yrs_work_exp  = student's years of professional work experience (int).
-			    From 0 to 4, inclusive. 4 indicates 4 or more years of experience.
-			project_rnks = a list of project IDs (int list).
-			    Ints are the project IDs. There are number_project_rankings IDs.
-			    Ranked in order of preference.
-                        binary_field = any binary field you wish. Possible examples:
-                           Local/not-local, male/female, was a CS undergrad/was not, etc. 
-			is_normalized = indicates if values are normalized (bool).
-			rankings_can_be_empty = indicates if the ranking list can be empty (bool).
-			    (This allows us to construct students step by step.)
+			business_abilities = students' business abilities (int list).
+			coding_abilities = students' coding abilities (int list).
+			work_experiences = students' years of professional work experience (int list).
+			project_rankings = for each student, a list of project IDs
+			    ranked in order of preference (list of int lists).
+			    There are number_project_rankings IDs per student.
+			bin_fields = students' binary fields, 0 or 1 (int list).
 
-		    Returns
-		    -------
-		    Student object with given parameters as attributes.
+			Returns
+			-------
+			StudentTable holding the given data. Raises a FieldError if any
+			value is invalid.
 
 		'''
-                self._name = name
-		self._ID = ID
-		self.set_bin_field(bin_field)
-
-		if (not(is_normalized)):
-			self.set_valid_properties(degree_pursuing, cod_abil, bus_abil, 
-										num_yrs_work_exp, project_rnks, rankings_can_be_empty)
+		num_students = len(IDs)
+		self.IDs = np.array(IDs)
+		self.names = list(names)
+		self.degrees = np.zeros(num_students, dtype = np.int64)
+		self.business_abilities = np.zeros(num_students, dtype = np.int64)
+		self.coding_abilities = np.zeros(num_students, dtype = np.int64)
+		self.work_experiences = np.zeros(num_students, dtype = np.int64)
+		self.bin_fields = np.zeros(num_students, dtype = np.int64)
+		self.project_rankings = np.zeros((num_students, alg_number_project_rankings), dtype = np.int64)
+
+		for i in range(num_students):
+			ID = IDs[i]
+			self.degrees[i] = self.check_degree_pursuing(ID, degrees[i])
+			self.check_valid(ID, coding_abilities[i], vals_coding_ability, s = " coding ability")
+			self.coding_abilities[i] = coding_abilities[i]
+			self.check_valid(ID, business_abilities[i], vals_business_ability, s = " business ability")
+			self.business_abilities[i] = business_abilities[i]
+			self.check_valid(ID, work_experiences[i], vals_work_experience, s = " num yrs. work experience")
+			self.work_experiences[i] = work_experiences[i]
+			self.project_rankings[i] = self.check_valid_project_rankings(ID, project_rankings[i])
+			if not(bin_fields[i] in [0,1]):
+				raise FieldError("Binary field must be either 0 or 1.")
+			self.bin_fields[i] = bin_fields[i]
+
+		# Columns are (degree, business, coding, work experience, binary field),
+		# in the order of Student.get_numerical_student_properties.
+		self.numerical_properties = np.column_stack((self.degrees, self.business_abilities,
+			self.coding_abilities, self.work_experiences, self.bin_fields))
+		self.create_rank_cost_matrices()
+		self.create_interest_index()
+
+	def __deepcopy__(self, memo):
+		return self
+
+	def __len__(self):
+		return len(self.IDs)
+
+	def check_valid(self, ID, val, lst, s=""):
+		'''
+			If val is not included in lst, then we raise a FieldError.
+			ID is the ID of the student that val belongs to.
+		'''
+		if (not (val in lst)):
+		 	error = "Invalid input " + str(val) + " for student " + str(ID)
+		 	error +=  " for field" + s + "."
+		 	raise FieldError(error)
 
-		# If the data is already normalized, then we don't want to check membership with the above lists. 
-		else:
-			self._degree_pursuing = degree_pursuing
-			self._coding_ability = cod_abil
-			self._business_ability= bus_abil
-			self._work_experience = num_yrs_work_exp
-			self._project_rankings = np.asarray(list(itertools.chain.from_iterable((e,e+num_valid_projects) for e in project_rnks)))
+	def check_degree_pursuing(self, ID, val):
+		'''
+			Checks the degree (either the string or the int) and returns its
+			int code (see vals_degree_pursuing).
+		'''
+		for (code, degree) in vals_degree_pursuing.items():
+			if (val == degree):
+				return code
+		self.check_valid(ID, val, vals_degree_pursuing, s = " degree pursuing")
+		return val
 
-	# Defining properties for Student attributes.
-	def get_name(self):
-		return self._name
+	def check_valid_project_rankings(self, ID, val):
+		'''
+			Checks that the project rankings of a student are
+			1) unique
+			2) valid values (as specified by vals_valid_projects).
+			If duplicate_rankings is set, each project is followed by its
+			duplicate (project ID + num_valid_projects) before checking.
 
-	def set_name(self, val):
-		self._name = val
+			Returns
+			-------
+			The rankings as the algorithm uses them (int list).
+			Raises a FieldError if they are not valid.
+		'''
+		try:
+			if duplicate_rankings:
+				val = list(itertools.chain.from_iterable((e,e+num_valid_projects) for e in val))
+			if (not (len(val) == alg_number_project_rankings)):
+				error = "There must be " + str(number_project_rankings)
+				error += " project rankings."
+				raise FieldError(error)
+		except TypeError:
+			raise FieldError("Project rankings must be inputted as a list.")
 
-	name = property(get_name, set_name, doc = "Get and set name.")
+		past = []
+		for elm in val:
+			self.check_valid(ID, elm, vals_valid_projects, s = " project ID")
+			if (elm in past):
+				error = "Student " + str(ID) + " entered project "
+				error += str(elm) + " twice."
+				raise FieldError(error)
+			past.append(elm)
+		return val
 
-	def get_ID(self):
-		return self._ID
+	def create_rank_cost_matrices(self):
+		'''
+			Builds the rank and cost of every student for every project ID once,
+			so that ranking lookups in the hot loops are integer indexing instead
+			of list searches.
+
+			rank_matrix and cost_matrix are 2d numpy arrays of ints with one row
+			per student and one column per project ID (column 0 is unused),
+			covering every ID in vals_valid_projects. rank_matrix holds the rank
+			that the student gave the project (100 if unranked), and cost_matrix
+			holds the cost of that rank (see Student.get_cost_from_ranking).
+		'''
+		num_columns = max(vals_valid_projects) + 1
+		self.rank_matrix = np.empty((len(self.IDs), num_columns), dtype = np.int64)
+		self.rank_matrix.fill(100)
+		for i in range(len(self.IDs)):
+			for (position, project_id) in enumerate(self.project_rankings[i]):
+				self.rank_matrix[i, project_id] = position + 1
+
+		# Ranks run from 1 to 100, so the costs can be looked up per rank.
+		costs_by_rank = np.array([Student.get_cost_from_ranking(rank) for rank in range(101)], dtype = np.int64)
+		self.cost_matrix = costs_by_rank[self.rank_matrix]
+
+	def create_interest_index(self):
+		'''
+			Builds an inverted index of the rankings in one pass: for every
+			project ID, the students who ranked it and the ranks they gave it.
+
+			interested_students and interested_ranks are 1d numpy arrays of
+			ints, grouped by project ID and sorted by rank (then student index)
+			within a project. The entries of project ID p run from
+			interest_starts[p] to interest_starts[p + 1].
+			degree_counts is a 2d numpy array of ints with one row per project
+			ID and one column per degree code, counting the students of each
+			degree who ranked the project.
+		'''
+		num_columns = self.rank_matrix.shape[1]
+		(num_students, num_rankings) = self.project_rankings.shape
+		IDs = self.project_rankings.ravel()
+		students = np.repeat(np.arange(num_students), num_rankings)
+		ranks = np.tile(np.arange(1, num_rankings + 1), num_students)
 
-	def set_ID(self, val):
-		self._ID = val
+		order = np.lexsort((students, ranks, IDs))
+		self.interested_students = students[order]
+		self.interested_ranks = ranks[order]
+		self.interest_starts = np.searchsorted(IDs[order], np.arange(num_columns + 1))
 
-	ID = property(get_ID, set_ID, doc = "Get and set student ID.")
+		self.degree_counts = np.zeros((num_columns, len(vals_degree_pursuing)), dtype = np.int64)
+		np.add.at(self.degree_counts, (IDs, self.degrees[students]), 1)
 
-        def get_bin_field(self):
-                return self.bin_field
+	def get_interested(self, ID):
+		'''
+			Returns the indices of the students who ranked project ID, and the
+			ranks they gave it, best rank first (two numpy arrays).
+		'''
+		if (ID < 0 or ID + 1 >= len(self.interest_starts)):
+			empty = np.zeros(0, dtype = np.int64)
+			return (empty, empty)
+		start = self.interest_starts[ID]
+		end = self.interest_starts[ID + 1]
+		return (self.interested_students[start:end], self.interested_ranks[start:end])
+
+	def get_num_ranked(self, ID):
+		'''
+			Returns the number of students who ranked project ID (int).
+		'''
+		if (ID < 0 or ID + 1 >= len(self.interest_starts)):
+			return 0
+		return int(self.interest_starts[ID + 1] - self.interest_starts[ID])
 
-        def set_bin_field(self, val):
-                if not(val in [0,1]):
-                        raise FieldError("Binary field must be either 0 or 1.")
-                self._bin_field = val
+	def create_students(self):
+		'''
+			Returns one Student view per row of the table, in index order.
+		'''
+		return [Student(self, i) for i in range(len(self.IDs))]
 
-        bin_field = property(get_name, set_name, doc = "Get and set the binary field.")
+class Student(object):
+	'''
+		A thin view over one row of a StudentTable. Every attribute is read
+		from the table, so the arrays can be used directly wherever it is
+		easier to work with student indices than with Student objects.
+	'''
+	__slots__ = ['_table', '_index']
+
+	def __init__ (self, table, index):
+		''' 
+			Parameters
+			----------
+			table = the table holding the student's data (StudentTable).
+			index = the student's row in the table (int).
 
-	def get_degree_pursuing(self):
-		return self._degree_pursuing
+		    Returns
+		    -------
+		    Student object with the given row's values as attributes.
 
-	# NOTE: this sets the degree pursuing as a string, not 0 or 1.
-	def set_degree_pursuing(self, val):
-		'''
-			Checks if the input value is valid before setting it.
 		'''
-		# Checks if the user is passing in the string value for degree pursuing.
-		# If not, check if the int they're passing in is included in our dict.
-		if (not(val in vals_degree_pursuing.values())):
-			self.check_valid(val, vals_degree_pursuing, 
-						s = " degree pursuing")
-			self._degree_pursuing = vals_degree_pursuing[val]
-		# If they are passing in a string, set the degree pursuing
-		else:
-			self._degree_pursuing = val
+		self._table = table
+		self._index = index
 
-	degree_pursuing = property(get_degree_pursuing, set_degree_pursuing,
-					doc = "Get and set degree pursuing.")
+	def __getstate__(self):
+		return (self._table, self._index)
 
-	def get_coding_ability(self):
-		return self._coding_ability
+	def __setstate__(self, state):
+		(self._table, self._index) = state
 
-	def set_coding_ability(self, val):
-		'''
-			Checks if the input value is valid before setting it.
-		'''
-		self.check_valid(val, vals_coding_ability, s = " coding ability")
-		self._coding_ability = val
+	# Defining properties for Student attributes.
+	def get_table(self):
+		return self._table
 
-	coding_ability = property(get_coding_ability, set_coding_ability,
-					 doc = "Get and set coding ability.")
+	table = property(get_table, doc = "Get the table holding this student's data.")
 
-	def get_business_ability(self):
-		return self._business_ability
+	def get_index(self):
+		return self._index
 
-	def set_business_ability(self, val):
-		'''
-			Checks if the input value is valid before setting it.
-		'''
-		self.check_valid(val, vals_business_ability, s = " business ability")
-		self._business_ability = val
+	index = property(get_index, doc = "Get the student's row in the table (0, 1, ...).")
 
-	business_ability = property(get_business_ability, set_business_ability,
-				doc = "Get and set business ability.")
+	def get_name(self):
+		return self._table.names[self._index]
 
-	def get_work_experience(self):
-		return self._work_experience
+	name = property(get_name, doc = "Get name.")
 
-	def set_work_experience(self, val):
-		'''
-			Checks if the input value is valid before setting it.
-		'''
-		self.check_valid(val, vals_work_experience, s = " num yrs. work experience")
-		self._work_experience = val
+	def get_ID(self):
+		return self._table.IDs[self._index]
 
-	work_experience = property(get_work_experience, set_work_experience,
-					  doc = "Get and set the num. yrs. of work experience.")
+	ID = property(get_ID, doc = "Get student ID.")
 
-	def get_project_rankings(self):
-		return self._project_rankings
+	def get_bin_field(self):
+		return self._table.bin_fields[self._index]
 
-	def set_project_rankings(self, val, rankings_can_be_empty = False):
-		'''
-			Checks if the input value is valid before setting it.
-		'''
-                if duplicate_rankings:
-                        alg_project_rnk = np.asarray(list(itertools.chain.from_iterable((e,e+num_valid_projects) for e in val)))
-                else:
-                        alg_project_rnk = val
-		self.check_valid_project_rankings(alg_project_rnk, rankings_can_be_empty)
-		self._project_rankings = alg_project_rnk
+	bin_field = property(get_bin_field, doc = "Get the binary field.")
 
-	project_rankings = property(get_project_rankings, set_project_rankings,
-					  doc = "Get and set the project rankings.")
+	def get_degree_pursuing(self):
+		return vals_degree_pursuing[self._table.degrees[self._index]]
 
-	def set_valid_properties(self, degree_pursuing, cod_abil, bus_abil, num_yrs_work_exp, 
-							project_lst, rankings_can_be_empty = False):
-		'''
-			Checks if all input values are valid before setting them.
-			Called from the Student constructor.
-		'''
-		self.set_degree_pursuing(degree_pursuing)
-		self.set_coding_ability(cod_abil)
-		self.set_business_ability(bus_abil)
-		self.set_work_experience(num_yrs_work_exp)
-		self.set_project_rankings(project_lst, rankings_can_be_empty)
+	degree_pursuing = property(get_degree_pursuing,
+					doc = "Get degree pursuing (as a string, e.g. \"MBA\").")
 
-	def check_valid(self, val, lst, s=""):
-		'''
-			If val is not included in lst, then we raise a FieldError.
+	def get_coding_ability(self):
+		return self._table.coding_abilities[self._index]
 
-			Parameters
-			----------
-			val: the value that is being passed into the Student constructor.
-			lst: the list of valid values to check against.
+	coding_ability = property(get_coding_ability, doc = "Get coding ability.")
 
-			Returns
-			-------
-			If val is in lst, returns nothing. Otherwise, raises a FieldError.
+	def get_business_ability(self):
+		return self._table.business_abilities[self._index]
 
-		'''
-		if (not (val in lst)):
-		 	error = "Invalid input " + str(val) + " for student " + str(self._ID)
-		 	error +=  " for field" + s + "."
-		 	raise FieldError(error)
-		else:
-		 	pass
+	business_ability = property(get_business_ability, doc = "Get business ability.")
+
+	def get_work_experience(self):
+		return self._table.work_experiences[self._index]
+
+	work_experience = property(get_work_experience,
+					  doc = "Get the num. yrs. of work experience.")
+
+	def get_project_rankings(self):
+		return self._table.project_rankings[self._index]
+
+	project_rankings = property(get_project_rankings, doc = "Get the project rankings.")
 
 	def get_student_properties(self):
 		'''
 			Returns a list of the Student's properties.
 		'''
 		lst = []
-		lst.append(self._name)
-		lst.append(self._ID)
-		lst.append(self._degree_pursuing)
-		lst.append(self._business_ability)
-		lst.append(self._coding_ability)
-		lst.append(self._work_experience)
-		lst.append(self._project_rankings)
-                lst.append(self._bin_field)
+		lst.append(self.name)
+		lst.append(self.ID)
+		lst.append(self.degree_pursuing)
+		lst.append(self.business_ability)
+		lst.append(self.coding_ability)
+		lst.append(self.work_experience)
+		lst.append(self.project_rankings)
+                lst.append(self.bin_field)
 		return lst
 
 	def get_numerical_student_properties(self):
 		'''
-			Returns a list of the Student's properties.
-			If degree_pursuing was stored as a string, this function will convert
-			the string to an int ("MBA" = 0, "MEng" = 1).
+			Returns a list of the Student's numerical properties:
+			degree ("MBA" = 0, "MEng" = 1, "HT" = 2, "CM" = 3), business ability,
+			coding ability, work experience and binary field.
 		'''
-		lst = []
-		if (self._degree_pursuing == 0 or self._degree_pursuing == "MBA"):
-			lst.append(0)
-		elif (self._degree_pursuing == 1 or self._degree_pursuing == "MEng"):
-			lst.append(1)
-                elif (self._degree_pursuing == 2 or self._degree_pursuing == "HT"):
-                        lst.append(2)
-                elif (self._degree_pursuing == 3 or self._degree_pursuing == "CM"):
-                        lst.append(3)
-		else:
-			raise ValueError("What kind of program is the student pursuing?")
-		lst.append(self._business_ability)
-		lst.append(self._coding_ability)
-                lst.append(self._work_experience)
-                lst.append(self._bin_field)
-		return lst
+		return list(self._table.numerical_properties[self._index])
 
 	def get_ranking(self, project_id): 
 		'''
 			Get the number that this student ranked this project. 
 			Returns 100 if the student did not rank the project.
 		'''
-		try:
-			rankings = self._project_rankings.tolist()
-			ind = rankings.index(project_id)
-			return (ind + 1)
-		except(ValueError):
-			# Student did not rank this project.
-			return 100
-
-	def get_cost_from_ranking(self, rank):
+		rank_matrix = self._table.rank_matrix
+		if (0 <= project_id < rank_matrix.shape[1]):
+			return rank_matrix[self._index, project_id]
+		# Student did not rank this project.
+		return 100
+
+	@staticmethod
+	def get_cost_from_ranking(rank):
 		'''
 			Get the cost of assigning a student to a given project rank.
 			
@@ -379,41 +541,15 @@ class Student(object):
 		else:
 			return (rank * rank)
 
-	def check_valid_project_rankings(self, val, rankings_can_be_empty = False):
+	def get_cost(self, project_id):
 		'''
-	   		Iterates through the list of project rankings to check that they are
-	  	 	1) unique
-     		2) valid values (as specified by vals_valid_projects). 
-
-			Parameters
-			----------
-			val: list of rankings, each represented by a project ID (int list).
-
-			Returns
-			-------
-			Nothing, if val conforms to constraints 1) and 2) above.
-			If not, this function will raise a FieldError.
-	
+			Get the cost of assigning this student to this project.
+			Same as get_cost_from_ranking(get_ranking(project_id)).
 		'''
-
-		try:
-			if (len(val) == 0 and rankings_can_be_empty):
-				self._project_rankings = val
-			elif (not (len(val) == alg_number_project_rankings)):
-				error = "There must be " + str(number_project_rankings)
-				error += " project rankings."
-				raise FieldError(error)
-		except TypeError:
-			raise FieldError("Project rankings must be inputted as a list.")
-
-		past = []
-		for elm in val:
-			self.check_valid(elm, vals_valid_projects, s = " project ID")
-			if (elm in past):
-				error = "Student " + str(self._ID) + " entered project "
-				error += str(elm) + " twice."
-				raise FieldError(error)
-			past.append(elm)
+		cost_matrix = self._table.cost_matrix
+		if (0 <= project_id < cost_matrix.shape[1]):
+			return cost_matrix[self._index, project_id]
+		return Student.get_cost_from_ranking(100)
 
 class Project(object):
 	def __init__(self, ID, capacity, capacity_w):
@@ -469,6 +605,14 @@ class Project(object):
                 '''
                 self._ID = val
 
+        def force_students(self, students, remaining_spots):
+                '''
+                    Force the students and the remaining spots of this project.
+                    Used to revert a move without going through add_student.
+                '''
+                self._students = students
+                self._remaining_spots = remaining_spots
+
 	ID = property(get_ID, set_ID,
 				  doc = "Get and set the team's ID, if not in the existing IDs.")
         
@@ -642,12 +786,22 @@ class Project(object):
 
 			Parameters
 			----------
-			tup: a tuple of the form (inv_cov_mat, dict_key_vals).
+			tup: a tuple of the form (inv_cov_mat, dict_key_vals) or
+			 (inv_cov_mat, dict_key_vals, distance_matrix, whitened_data),
+			 as returned by distance.create_inv_cov_mat_from_data.
 				 inv_cov_mat is the inverse of the covariance matrix of
 				 the numerical attributes of the Students.
 				 This is used for the Mahalanobis distance of all pairs
 				 of students in the team.
 				 dict_key_vals: a dictionary of student IDs and attributes.
+				 distance_matrix: the precomputed Mahalanobis distances
+				 between all students, indexed by Student.index. If it is
+				 given, the diversity is summed from this matrix.
+				 whitened_data: the students' attributes in whitened
+				 coordinates, indexed by Student.index, or None. If it
+				 is not None and diversity_metric is squared_mahalanobis, the
+				 diversity is computed from the team's sums (see
+				 squared_diversity), without going over the pairs.
 
 			Returns
 			-------
@@ -663,6 +817,17 @@ class Project(object):
 			error += str([s.ID for s in self.students]) + ". This project is not full."
 			error += " Cannot calculate diversity."
 			raise ValueError(error)
+		elif (diversity_metric == "squared_mahalanobis" and len(tup) > 2 and tup[3] is not None):
+			indices = [student.index for student in self._students]
+			diversity = squared_diversity(team_sums(tup[3], indices))
+		elif (len(tup) > 2):
+			distance_matrix = tup[2]
+			indices = [student.index for student in self._students]
+			# Each pair appears twice in the submatrix, and the diagonal is zero.
+			submatrix = distance_matrix[np.ix_(indices, indices)]
+			if (diversity_metric == "squared_mahalanobis"):
+				submatrix = submatrix ** 2
+			diversity = submatrix.sum() / 2.0
 		else:
 			attributes = []
                         for student in self._students:
@@ -679,8 +844,205 @@ class Project(object):
 				snd_properties = attributes[snd]
 				d = distance.do_python_distance_data(fst_properties,
 					snd_properties, inv_cov_mat)
+				if (diversity_metric == "squared_mahalanobis"):
+					d = d ** 2
 				diversity += d
 	 	return diversity
 
+def team_sums(whitened_data, indices):
+	'''
+		Parameters
+		----------
+		whitened_data: the students' attributes in whitened coordinates,
+		               indexed by Student.index (2d numpy array of floats).
+		indices: the indices of a team's students (int list).
+
+		Returns
+		-------
+		(vector_sum, squared_norm_sum, count): the sum of the team's whitened
+		rows, the sum of their squared norms, and the number of students.
+	'''
+	rows = whitened_data[indices]
+	return (rows.sum(axis = 0), float((rows ** 2).sum()), len(indices))
+
+def swap_team_sums(sums, row_in, row_out):
+	'''
+		Returns the team_sums of a team after the student with whitened row
+		row_out was replaced by the one with row_in, in O(d).
+	'''
+	(vector_sum, squared_norm_sum, count) = sums
+	return (vector_sum + (row_in - row_out),
+		squared_norm_sum + float(np.dot(row_in, row_in) - np.dot(row_out, row_out)),
+		count)
+
+def squared_diversity(sums):
+	'''
+		The sum over pairs of teammates of their squared Mahalanobis distance,
+		from the team_sums of the team: for whitened rows z_1, ..., z_k,
+		sum over i < j of |z_i - z_j|^2 = k * sum |z_i|^2 - |sum z_i|^2.
+	'''
+	(vector_sum, squared_norm_sum, count) = sums
+	return max(count * squared_norm_sum - float(np.dot(vector_sum, vector_sum)), 0.0)
+
+class Assignment(object):
+	'''
+		Array encoding of which students are on which teams, as an
+		alternative to a list of Project objects holding Student lists.
+		Copying, snapshotting and comparing an Assignment only copies or
+		compares a few small int arrays.
+
+		student_teams[i] is the team slot of the student with index i
+		(-1 if the student is not on a team), team_IDs[t] is the project ID
+		of team slot t and team_counts[t] is the number of students on it.
+
+		Use util.projects_to_assignment and util.assignment_to_projects to
+		convert to and from a list of Projects.
+	'''
+	__slots__ = ['student_teams', 'team_IDs', 'team_counts']
+
+	def __init__(self, student_teams, team_IDs, team_counts = None):
+		'''
+			Parameters
+			----------
+			student_teams: team slot of each student, or -1 (int list or numpy array).
+			team_IDs: project ID of each team slot (int list or numpy array).
+			team_counts: number of students on each team slot (int list or numpy array).
+			    Counted from student_teams if not given.
+		'''
+		self.student_teams = np.array(student_teams, dtype = np.int64)
+		self.team_IDs = np.array(team_IDs, dtype = np.int64)
+		if (team_counts is None):
+			matched = self.student_teams[self.student_teams >= 0]
+			team_counts = np.bincount(matched, minlength = len(self.team_IDs))
+		self.team_counts = np.array(team_counts, dtype = np.int64)
+
+	def __getstate__(self):
+		return (self.student_teams, self.team_IDs, self.team_counts)
+
+	def __setstate__(self, state):
+		(self.student_teams, self.team_IDs, self.team_counts) = state
+
+	def __eq__(self, other):
+		return (isinstance(other, Assignment)
+			and np.array_equal(self.student_teams, other.student_teams)
+			and np.array_equal(self.team_IDs, other.team_IDs)
+			and np.array_equal(self.team_counts, other.team_counts))
+
+	def __ne__(self, other):
+		return not(self == other)
+
+	def copy(self):
+		'''
+			Returns an independent copy of this assignment.
+		'''
+		return Assignment(self.student_teams.copy(), self.team_IDs.copy(), self.team_counts.copy())
+
+	def copy_from(self, other):
+		'''
+			Overwrites this assignment with other, in place. Both must have
+			the same number of students and team slots.
+		'''
+		self.student_teams[:] = other.student_teams
+		self.team_IDs[:] = other.team_IDs
+		self.team_counts[:] = other.team_counts
+
+	def get_num_teams(self):
+		return len(self.team_IDs)
 
+	num_teams = property(get_num_teams, doc = "Get the number of team slots.")
 
+	def get_student_project_IDs(self):
+		'''
+			Returns the project ID of each student's team, or -1 if the
+			student is not on a team (numpy array). Two assignments that
+			only differ in the order of their team slots give the same array.
+		'''
+		IDs = np.empty(len(self.student_teams), dtype = np.int64)
+		IDs.fill(-1)
+		matched = self.student_teams >= 0
+		IDs[matched] = self.team_IDs[self.student_teams[matched]]
+		return IDs
+
+	def get_members(self, team):
+		'''
+			Returns the indices of the students on a team slot (numpy array).
+		'''
+		return np.flatnonzero(self.student_teams == team)
+
+	def move_student(self, student, team):
+		'''
+			Moves a student (by index) to a team slot (-1 to unmatch the student).
+		'''
+		old_team = self.student_teams[student]
+		if (old_team >= 0):
+			self.team_counts[old_team] -= 1
+		if (team >= 0):
+			self.team_counts[team] += 1
+		self.student_teams[student] = team
+
+	def swap_students(self, student_one, student_two):
+		'''
+			Exchanges the team slots of two students (by index).
+		'''
+		teams = self.student_teams
+		teams[student_one], teams[student_two] = teams[student_two], teams[student_one]
+
+class IDIndex(object):
+	'''
+		Maps the IDs of a list of objects (Projects or Students) to the
+		objects and to their contiguous positions in the list, so that an ID
+		is looked up in constant time instead of by a scan of the list.
+
+		Looking up an ID that is not in the list, or that more than one
+		object in the list has, raises a FieldError.
+	'''
+	def __init__(self, items):
+		'''
+			Parameters
+			----------
+			items: the objects to index, each with an ID field (list).
+		'''
+		self.items = list(items)
+		self.positions = {}
+		self.duplicate_IDs = set()
+		for (i, item) in enumerate(self.items):
+			if (item.ID in self.positions):
+				self.duplicate_IDs.add(item.ID)
+			else:
+				self.positions[item.ID] = i
+
+	def __len__(self):
+		return len(self.items)
+
+	def __contains__(self, ID):
+		return ID in self.positions
+
+	def get_index(self, ID):
+		'''
+			Returns the position in the list of the object whose ID is ID (int).
+		'''
+		if (not(ID in self.positions)):
+			error = "ID " + str(ID) + " does not match to a valid project."
+			raise FieldError(error)
+		if (ID in self.duplicate_IDs):
+			error = "There is more than one matching project. Problem!"
+			raise FieldError(error)
+		return self.positions[ID]
+
+	def get(self, ID):
+		'''
+			Returns the object whose ID is ID.
+		'''
+		return self.items[self.get_index(ID)]
+
+class ProjectIndex(IDIndex):
+	'''
+		ID index of a list of Projects. See IDIndex.
+	'''
+	pass
+
+class StudentIndex(IDIndex):
+	'''
+		ID index of a list of Students. See IDIndex.
+	'''
+	pass
@@ -3,6 +3,27 @@ import numpy as np
 from scipy import linalg
 from scipy import spatial
 import clustering
+import hashlib
+import os
+
+# The directory that create_inv_cov_mat_from_data keeps its results in
+# (None to turn the cache off), and the number of entries to keep there.
+cache_dir = '.distance_cache'
+cache_entries = 16
+
+# Bump when a change to the computation invalidates cached results.
+cache_version = 2
+
+# Indicates if distances are computed in whitened coordinates (see
+# whitening_matrix) rather than with the pseudoinverse of the covariance.
+use_whitening = True
+
+# Eigenvalues of the covariance matrix below this fraction of the largest
+# are treated as zero when whitening.
+whitening_rcond = 1e-10
+
+# Results already loaded or computed by this process, by cache key.
+memory_cache = {}
 
 class DistanceError(Exception):
 	def __init__(self, value):
@@ -14,6 +35,8 @@ def is_positive_semidefinite(cov_matrix, verbose = False):
 	'''
 		Checks if the input matrix is positive semidefinite.
 		(If there are negative eigenvalues of the matrix, returns false.)
+		The matrix must be symmetric, as a covariance matrix is, so its
+		eigenvalues are real and found with the symmetric eigensolver.
 
 		Parameters
 		----------
@@ -25,7 +48,7 @@ def is_positive_semidefinite(cov_matrix, verbose = False):
 		                          semidefinite (bool).
 
 	'''
-	(eigenvalues, eigenvectors) = linalg.eig(cov_matrix)
+	eigenvalues = linalg.eigvalsh(cov_matrix)
 	res = []
 	for e in eigenvalues:
  		if (e < 0):
@@ -35,7 +58,24 @@ def is_positive_semidefinite(cov_matrix, verbose = False):
 		print res
 	return len(res) == 0
 
-def create_covariance_matrix(use_file, students, file, verbose = False):
+def read_data(use_file, students, file):
+	'''
+		Reads the numerical data of the students (if we need to fix how the
+		data is read, change clustering init.)
+
+		Returns
+		-------
+		(data_array, IDs): the data, one row per student, and the students' IDs.
+	'''
+	if (use_file):
+		return clustering.__init__(file)
+	# Take the data from the students themselves.
+	table = students[0].table
+	IDs = [s.ID for s in students]
+	data_array = table.numerical_properties[[s.index for s in students]]
+	return (data_array, IDs)
+
+def create_covariance_matrix(use_file, students, file, verbose = False, data_array_tup = None):
 	'''
 		Reads the data from the file (if we need to fix how the data is read, change clustering init.)
 		Preprocesses data with one hot encoding (changes categorical variables into numerical.)
@@ -47,25 +87,17 @@ def create_covariance_matrix(use_file, students, file, verbose = False):
 	    use_file: indicates if we want to use the input from the file (bool).
 	    students: students to include in calculation (Student list).
 	    file: file to use (if use_file = True).
+	    data_array_tup: the result of read_data, if it was already called.
 
 	    Returns
 	    --------
 	    covariance_matrix: the covariance matrix of the data (either from file or students).
 	
 	'''
-	if (use_file):
-		data_array_tup = clustering.__init__(file)
-	# Create covariance matrix from students themselves.
-	else:
-		multi_array = []
-		for student in students:
- 			attributes = student.get_numerical_student_properties()
- 			multi_array.append(attributes)
- 		IDs = [s.ID for s in students]
- 		data_array = np.array(multi_array)
- 		if (verbose):
-	 		print "Multi array is " + str(data_array)
- 		data_array_tup = (data_array, IDs)
+	if (data_array_tup is None):
+		data_array_tup = read_data(use_file, students, file)
+	if (verbose):
+		print "Multi array is " + str(data_array_tup[0])
 
 	data_array = data_array_tup[0]
 	one_hot_data_preprocessed_tup = clustering.do_preprocessing(data_array_tup)
@@ -161,6 +193,33 @@ def inverse_matrix(matrix, use_pseudo_inv = True, verbose = False):
 			print "(Pseudo) inverse of the input matrix is: "
 	return cov_inverse
 
+def whitening_matrix(cov_matrix, rcond = None):
+	'''
+		Calculates a matrix W such that the Mahalanobis distance between two
+		rows x and y of the data is the Euclidean distance between xW and yW.
+		W = V diag(1 / sqrt(l)) over the eigenpairs (l, V) of the covariance
+		matrix, leaving out the eigenvalues below rcond times the largest
+		(directions the data does not vary in, such as constant one-hot
+		columns), so W W^T is the pseudoinverse of the covariance matrix.
+
+		Parameters
+		----------
+		cov_matrix: the covariance matrix of the data (2d numpy array of floats).
+		rcond: the cutoff for small eigenvalues (float). Defaults to
+		       whitening_rcond.
+
+		Returns
+		-------
+		whitening_matrix: a matrix with one row per variable and one column
+		                  per kept eigenvalue (2d numpy array of floats).
+
+	'''
+	if (rcond is None):
+		rcond = whitening_rcond
+	(eigenvalues, eigenvectors) = linalg.eigh(cov_matrix)
+	keep = eigenvalues > rcond * max(eigenvalues.max(), 0.0)
+	return eigenvectors[:, keep] / np.sqrt(eigenvalues[keep])
+
 def do_python_distance_data(student_one, student_two, inv_cov_mat):
 	'''
 		Parameters
@@ -177,12 +236,147 @@ def do_python_distance_data(student_one, student_two, inv_cov_mat):
 	'''
 	return spatial.distance.mahalanobis(student_one, student_two, inv_cov_mat)
 
+def create_distance_matrix(data, inv_cov_mat):
+	'''
+		Calculates the Mahalanobis distance between every pair of rows of data
+		in one vectorized pass.
+
+		Parameters
+		----------
+		data: numerical data for the students, one row per student
+		      (2d numpy array of floats).
+		inv_cov_mat: the inverse covariance matrix of the given data
+		             (2d numpy array of floats).
+
+		Returns
+		-------
+		distance_matrix: a symmetric matrix whose entry [i, j] is the distance
+		                 between rows i and j of data (2d numpy array of floats).
+
+	'''
+	condensed = spatial.distance.pdist(data, 'mahalanobis', VI = inv_cov_mat)
+	return spatial.distance.squareform(condensed)
+
+def cache_key(data_array_tup, ordered_IDs):
+	'''
+		Returns the hex digest that identifies the results of
+		create_inv_cov_mat_from_data for this data and student order (string).
+	'''
+	(data_array, IDs) = data_array_tup
+	digest = hashlib.sha1()
+	digest.update(str(cache_version))
+	digest.update(str(use_whitening) + str(whitening_rcond))
+	data = np.ascontiguousarray(np.array(data_array, dtype = np.float64))
+	digest.update(str(data.shape))
+	digest.update(data.tostring())
+	digest.update(repr([str(ID) for ID in IDs]))
+	digest.update(repr([str(ID) for ID in ordered_IDs]))
+	return digest.hexdigest()
+
+def load_cached(key):
+	'''
+		Returns the arrays stored under key (dict), or None if there are none.
+		Marks the entry as used, so that it is evicted last.
+	'''
+	if (key in memory_cache):
+		return memory_cache[key]
+	if (cache_dir is None):
+		return None
+	path = os.path.join(cache_dir, key + '.npz')
+	try:
+		archive = np.load(path)
+		try:
+			arrays = dict((name, archive[name]) for name in archive.files)
+		finally:
+			archive.close()
+		os.utime(path, None)
+	except (IOError, OSError, ValueError):
+		# Missing, evicted by another run, or unreadable: compute it again.
+		return None
+	memory_cache[key] = arrays
+	return arrays
+
+def store_cached(key, arrays):
+	'''
+		Stores arrays under key, and evicts the least recently used entries
+		beyond cache_entries. Failing to write the cache is not an error.
+	'''
+	memory_cache[key] = arrays
+	if (cache_dir is None):
+		return
+	try:
+		if (not(os.path.isdir(cache_dir))):
+			os.makedirs(cache_dir)
+		path = os.path.join(cache_dir, key + '.npz')
+		temp = path + '.' + str(os.getpid()) + '.tmp'
+		f = open(temp, 'wb')
+		try:
+			np.savez(f, **arrays)
+		finally:
+			f.close()
+		os.rename(temp, path)
+		entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+			if name.endswith('.npz')]
+		entries.sort(key = os.path.getmtime, reverse = True)
+		for stale in entries[max(cache_entries, 1):]:
+			os.remove(stale)
+	except (IOError, OSError):
+		pass
+
 def create_inv_cov_mat_from_data(use_file, students, file_name):
 	'''
-		Creates inverse covariance matrix from the input file.
+		Creates inverse covariance matrix from the input file, along with the
+		matrix of Mahalanobis distances between all students.
+
+		The one-hot data, covariance matrix, inverse and distance matrix are
+		cached in cache_dir under a hash of the student data and order, so
+		that later runs on the same cohort load them instead.
+
+		With use_whitening, the covariance matrix is factored once with the
+		symmetric eigensolver, and the distances are Euclidean distances
+		between the whitened rows of the one-hot data.
+
+		Returns
+		-------
+		(inv_cov_mat, dict_key_vals, distance_matrix, whitened_data): the rows
+		and columns of distance_matrix and the rows of whitened_data are
+		indexed by Student.index. whitened_data is None without
+		use_whitening, or if no eigenvalue of the covariance matrix is
+		large enough to whiten by.
 	'''
-	quadruple = create_covariance_matrix(use_file, students, file_name)
-	cov_mat = quadruple[2]
-	dict_key_vals = quadruple[3]
-	inv_cov_mat = inverse_matrix(cov_mat)
-	return (inv_cov_mat, dict_key_vals)
+	ordered_students = sorted(students, key = lambda s: s.index)
+	if (not([s.index for s in ordered_students] == range(len(students)))):
+		raise DistanceError("Student indices must run from 0 to the number of students.")
+	data_array_tup = read_data(use_file, students, file_name)
+	key = cache_key(data_array_tup, [s.ID for s in ordered_students])
+	arrays = load_cached(key)
+	if (arrays is None):
+		quadruple = create_covariance_matrix(use_file, students, file_name,
+			data_array_tup = data_array_tup)
+		cov_mat = quadruple[2]
+		dict_key_vals = quadruple[3]
+		data = np.array([dict_key_vals[s.ID] for s in ordered_students])
+		if (use_whitening):
+			# Mahalanobis distances are Euclidean distances of the whitened data.
+			whitening = whitening_matrix(cov_mat)
+			inv_cov_mat = np.dot(whitening, whitening.T)
+			whitened_data = np.dot(data, whitening)
+			condensed = spatial.distance.pdist(whitened_data, 'euclidean')
+			distance_matrix = spatial.distance.squareform(condensed)
+		else:
+			inv_cov_mat = inverse_matrix(cov_mat)
+			whitened_data = np.zeros((len(students), 0))
+			distance_matrix = create_distance_matrix(data, inv_cov_mat)
+		arrays = {'one_hot_data': quadruple[1], 'covariance_matrix': cov_mat,
+			'inv_cov_mat': inv_cov_mat, 'distance_matrix': distance_matrix,
+			'whitened_data': whitened_data}
+		store_cached(key, arrays)
+
+	dict_key_vals = {}
+	for (ID, row) in zip(data_array_tup[1], arrays['one_hot_data']):
+		dict_key_vals[ID] = row
+	# The cache keeps missing whitened data as an array with no columns.
+	whitened_data = arrays['whitened_data']
+	if (whitened_data.shape[1] == 0):
+		whitened_data = None
+	return (arrays['inv_cov_mat'], dict_key_vals, arrays['distance_matrix'], whitened_data)
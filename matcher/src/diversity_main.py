@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 import util
+import classes
 import ConfigParser
 import perry_geo_annealing_diversity as pgd
 import perry_geo_test as test
@@ -42,15 +43,18 @@ if (__name__ == "__main__"):
 
 	try:
 		argv = sys.argv[1:]
-		opts, args = getopt.getopt(argv, "i:o:n:", ["input", "output", "numteams"])
+		opts, args = getopt.getopt(argv, "i:o:n:", ["input", "output", "numteams", "checkpoint=", "resume", "seed="])
 	except (getopt.GetoptError):
 		print "Unrecognized arguments."
-		print " usage: ./diversity_main.py -i <inputfile> [-o <outputfile>] -n <numteams>"
+		print " usage: ./diversity_main.py -i <inputfile> [-o <outputfile>] -n <numteams> [--checkpoint FILE [--resume]] [--seed N]"
 		sys.exit(2)
 
 	set_input_file = False
 	set_output_file = False
 	set_num_teams = False
+	checkpoint_file = None
+	resume = False
+	seed = None
 
 	for opt, arg in opts:
 		if (opt == "-i"):
@@ -62,39 +66,54 @@ if (__name__ == "__main__"):
 		elif (opt == "-n"):
 			num_teams = int(arg)
 			set_num_teams = True
+		elif (opt == "--checkpoint"):
+			checkpoint_file = arg
+		elif (opt == "--resume"):
+			resume = True
+		elif (opt == "--seed"):
+			seed = int(arg)
 
 	if (not(set_input_file)):
 		print "Please specify an input file."
-		print " usage: ./diversity_main.py -i <inputfile> [-o <outputfile>] -n <numteams>"
+		print " usage: ./diversity_main.py -i <inputfile> [-o <outputfile>] -n <numteams> [--checkpoint FILE [--resume]] [--seed N]"
 		sys.exit(2)
 
 	if (not(set_num_teams)):
 		print "Please specify the number of teams to create."
-		print " usage: ./diversity_main.py -i <inputfile> [-o <outputfile>] -n <numteams>"
+		print " usage: ./diversity_main.py -i <inputfile> [-o <outputfile>] -n <numteams> [--checkpoint FILE [--resume]] [--seed N]"
+		sys.exit(2)
+
+	if (resume and checkpoint_file is None):
+		print "Please specify the checkpoint file to resume from with --checkpoint."
+		sys.exit(2)
+
+	if (seed is not None and not(resume)):
+		# Every random choice comes from util.stream.
+		util.stream.seed(seed)
 
 	# Create config parser to get various fields.
 	configParser = ConfigParser.ConfigParser()
 	configFilePath = r'config.txt'
 	configParser.read(configFilePath)
 
-	project_id_mappings = configParser.get('files', 'project_id_mappings')
-	num_MBAs = configParser.getint('valid_values', 'num_MBAs')
-	num_MEngs = configParser.getint('valid_values', 'num_MEngs')
-	team_size = num_MBAs + num_MEngs
+	classes.init_classes(configFilePath)
 
 	# Creating the annealer with our energy and move functions.
-	annealer = Annealer(pgd.energy, pgd.move)
-	all_projects = util.generate_all_projects()
-	students = util.create_students_from_input(input_file)
+	annealer = Annealer(pgd.energy, pgd.move, util.undo_move,
+			    util.snapshot_solution, util.restore_solution,
+			    pack = util.pack_snapshot, unpack = util.unpack_snapshot,
+			    stream = util.stream)
+	all_projects = util.generate_all_projects(configFilePath)
+	students = util.create_students_from_input(input_file, configFilePath)
 
 	sol = initial_solution.random_initial_solution_for_diversity(students, all_projects, num_teams)	
 
 	use_diversity = True
 	use_file = False
-	if (set_output_file):
-		test.manual_schedule(use_file, students, sol, annealer, use_diversity, input_file, output_file)
-	else:
-		test.manual_schedule(use_file, students, sol, annealer, input_file, use_diversity)
+	if (not(set_output_file)):
+		output_file = "output.csv"
+	test.manual_schedule(use_file, students, sol, all_projects, annealer, use_diversity, input_file, output_file,
+			     checkpoint_file = checkpoint_file, resume = resume)
 
 	string =  "Program completed in " + str((time.time() - start_time)/60)
 	string += " minutes."
@@ -0,0 +1,278 @@
+import classes
+import initial_solution
+from classes import Assignment
+from classes import Student
+from classes import CompError
+
+import heapq
+import numpy as np
+
+class FlowNetwork(object):
+	'''
+		A directed graph with integer capacities and costs, for computing
+		minimum cost flows by successive shortest paths.
+
+		Edges are stored in parallel lists, and the residual edge of edge e
+		is edge e ^ 1.
+	'''
+	def __init__(self, num_nodes):
+		'''
+			Parameters
+			----------
+			num_nodes: number of nodes, numbered 0 to num_nodes - 1 (int).
+		'''
+		self.num_nodes = num_nodes
+		self.adjacent = [[] for v in range(num_nodes)]
+		self.to = []
+		self.cap = []
+		self.cost = []
+
+	def add_edge(self, u, v, cap, cost):
+		'''
+			Adds an edge from u to v with the given capacity and cost per unit
+			of flow (ints), and returns its index.
+		'''
+		e = len(self.to)
+		self.adjacent[u].append(e)
+		self.to.append(v)
+		self.cap.append(cap)
+		self.cost.append(cost)
+		self.adjacent[v].append(e + 1)
+		self.to.append(u)
+		self.cap.append(0)
+		self.cost.append(-cost)
+		return e
+
+	def get_flow(self, e):
+		'''
+			Returns the flow on edge e (int).
+		'''
+		return self.cap[e ^ 1]
+
+	def initial_potentials(self, source):
+		'''
+			Shortest path distances from source by Bellman-Ford (as a queue),
+			which allows for edges of negative cost.
+		'''
+		inf = float("inf")
+		dist = [inf] * self.num_nodes
+		dist[source] = 0
+		queue = [source]
+		in_queue = [False] * self.num_nodes
+		in_queue[source] = True
+		head = 0
+		while (head < len(queue)):
+			u = queue[head]
+			head += 1
+			in_queue[u] = False
+			for e in self.adjacent[u]:
+				if (self.cap[e] > 0 and dist[u] + self.cost[e] < dist[self.to[e]]):
+					v = self.to[e]
+					dist[v] = dist[u] + self.cost[e]
+					if (not(in_queue[v])):
+						in_queue[v] = True
+						queue.append(v)
+		return [0 if d == inf else d for d in dist]
+
+	def min_cost_flow(self, source, sink, max_flow):
+		'''
+			Sends up to max_flow units from source to sink at minimum cost,
+			augmenting along shortest paths (Dijkstra on costs reduced by
+			node potentials).
+
+			Returns
+			-------
+			(flow, cost): the amount of flow sent and its total cost (ints).
+			flow is less than max_flow if no more flow can reach the sink.
+		'''
+		potentials = self.initial_potentials(source)
+		inf = float("inf")
+		flow = 0
+		total_cost = 0
+		while (flow < max_flow):
+			dist = [inf] * self.num_nodes
+			previous = [-1] * self.num_nodes
+			dist[source] = 0
+			heap = [(0, source)]
+			while (len(heap) > 0):
+				(d, u) = heapq.heappop(heap)
+				if (d > dist[u]):
+					continue
+				pu = potentials[u]
+				for e in self.adjacent[u]:
+					if (self.cap[e] > 0):
+						v = self.to[e]
+						nd = d + self.cost[e] + pu - potentials[v]
+						if (nd < dist[v]):
+							dist[v] = nd
+							previous[v] = e
+							heapq.heappush(heap, (nd, v))
+			if (dist[sink] == inf):
+				break
+			for v in range(self.num_nodes):
+				if (dist[v] < inf):
+					potentials[v] += dist[v]
+
+			# Find the bottleneck of the path, then push flow along it.
+			amount = max_flow - flow
+			v = sink
+			while (v != source):
+				e = previous[v]
+				amount = min(amount, self.cap[e])
+				v = self.to[e ^ 1]
+			v = sink
+			while (v != source):
+				e = previous[v]
+				self.cap[e] -= amount
+				self.cap[e ^ 1] += amount
+				total_cost += amount * self.cost[e]
+				v = self.to[e ^ 1]
+			flow += amount
+		return (flow, total_cost)
+
+def solve_transport(table, projects, lower, upper, max_flow):
+	'''
+		Assigns students to projects at minimum total rank cost, as a
+		minimum cost flow: source -> student -> project -> sink.
+
+		Each student goes to a project they ranked at the cost in
+		table.cost_matrix, or to any project at the cost of an unranked
+		project (through a single overflow node, to keep the graph small).
+		Project k takes at most upper[k] students, and every unit of its
+		lower[k] is worth more than any assignment cost, so the lower bounds
+		are met whenever that is possible.
+
+		Parameters
+		----------
+		table: the students (StudentTable).
+		projects: the projects that students may go to (Project list).
+		lower: the minimum number of students of each project (int list).
+		upper: the maximum number of students of each project (int list).
+		max_flow: the number of students to assign (int).
+
+		Returns
+		-------
+		project_of: for every student index, the position in projects of
+		    the student's project, or -1 (numpy array of ints).
+	'''
+	num_students = len(table)
+	num_projects = len(projects)
+	unranked_cost = int(Student.get_cost_from_ranking(100))
+	big = num_students * unranked_cost + 1
+
+	source = 0
+	overflow = num_students + 1
+	first_project = num_students + 2
+	sink = first_project + num_projects
+	network = FlowNetwork(sink + 1)
+
+	unranked_edges = []
+	for i in range(num_students):
+		network.add_edge(source, 1 + i, 1, 0)
+		unranked_edges.append(network.add_edge(1 + i, overflow, 1, unranked_cost))
+	student_edges = []
+	overflow_edges = []
+	for (k, p) in enumerate(projects):
+		(interested, ranks) = table.get_interested(p.ID)
+		for i in interested:
+			e = network.add_edge(1 + i, first_project + k, 1, int(table.cost_matrix[i, p.ID]))
+			student_edges.append((e, i, k))
+		overflow_edges.append(network.add_edge(overflow, first_project + k, upper[k], 0))
+		if (lower[k] > 0):
+			network.add_edge(first_project + k, sink, lower[k], -big)
+		if (upper[k] > lower[k]):
+			network.add_edge(first_project + k, sink, upper[k] - lower[k], 0)
+	network.min_cost_flow(source, sink, max_flow)
+
+	project_of = np.empty(num_students, dtype = np.int64)
+	project_of.fill(-1)
+	for (e, i, k) in student_edges:
+		if (network.get_flow(e) > 0):
+			project_of[i] = k
+	# Students that went through the overflow node are on unranked projects;
+	# which of them goes to which of those projects does not change the cost.
+	overflowed = [i for i in range(num_students) if network.get_flow(unranked_edges[i]) > 0]
+	for (k, e) in enumerate(overflow_edges):
+		for unit in range(network.get_flow(e)):
+			project_of[overflowed.pop()] = k
+	return project_of
+
+def flow_assignment(students, feasible_projects, capacity, capacity_w, match_all, seeds = None):
+	'''
+		Assigns students to teams by minimum cost flow on the rank costs.
+
+		num_students / capacity projects are opened. The search for which
+		ones starts from several choices: the projects that a first, relaxed
+		flow (every feasible project open, no minimum team size) fills the
+		most, the projects that initial_solution.hungarian_open_projects
+		opens, and the projects of every seed. For each, a second flow
+		assigns the students exactly: at minimum total rank cost, with every
+		team between capacity and capacity_w students (exactly capacity if
+		match_all is False, leaving the remaining students unmatched). Then
+		open projects are swapped for closed ones for as long as that lowers
+		the cost (see initial_solution.open_projects_search), and the
+		cheapest result is returned. It is optimal for the projects it
+		opens, and no single swap of the projects improves it, but it is
+		not guaranteed to be optimal over every choice of projects.
+
+		Parameters
+		----------
+		students: all students, indexed 0, 1, ... (Student list).
+		feasible_projects: the feasible projects (Project list).
+		capacity: the minimum number of students on a team (int).
+		capacity_w: the maximum number of students on a team (int).
+		match_all: indicates if every student has to be matched (bool).
+		seeds: other solutions to start the search from, such as the best
+		    greedy solutions (Assignment list). Seeds that do not have
+		    num_students / capacity teams on feasible projects are skipped.
+
+		Returns
+		-------
+		assignment: the teams (Assignment).
+	'''
+	table = students[0].table
+	num_students = len(table)
+	num_teams = min(num_students / capacity, len(feasible_projects))
+	if (num_teams == 0):
+		raise CompError("There are not enough students to form a team.")
+	if (match_all):
+		upper_size = capacity_w
+		max_flow = num_students
+		if (num_students > num_teams * capacity_w):
+			raise CompError("There are not enough feasible projects to match every student.")
+	else:
+		upper_size = capacity
+		max_flow = num_teams * capacity
+
+	# Relaxed flow: which projects do the students want most?
+	relaxed = solve_transport(table, feasible_projects, [0] * len(feasible_projects),
+		[upper_size] * len(feasible_projects), max_flow)
+	counts = np.bincount(relaxed[relaxed >= 0], minlength = len(feasible_projects))
+	demand = [table.get_num_ranked(p.ID) for p in feasible_projects]
+	order = sorted(range(len(feasible_projects)), key = lambda k: (-counts[k], -demand[k]))
+	candidates = [sorted(order[:num_teams])]
+	(hungarian_open, hungarian_of) = initial_solution.hungarian_open_projects(table, feasible_projects, match_all)
+	candidates.append(hungarian_open)
+	position_of = dict((p.ID, k) for (k, p) in enumerate(feasible_projects))
+	for seed in (seeds or []):
+		IDs = list(seed.team_IDs)
+		if (len(IDs) == num_teams and all(ID in position_of for ID in IDs)):
+			candidates.append(sorted(position_of[ID] for ID in IDs))
+
+	# Exact flow over the open projects of each candidate, then swaps.
+	costs = table.cost_matrix[:, [p.ID for p in feasible_projects]]
+	best = None
+	tried = []
+	for positions in candidates:
+		if (positions in tried):
+			continue
+		tried.append(positions)
+		open_projects = [feasible_projects[k] for k in positions]
+		project_of = solve_transport(table, open_projects, [capacity] * num_teams,
+			[upper_size] * num_teams, max_flow)
+		(positions, project_of, cost) = initial_solution.open_projects_search(costs, positions, project_of,
+			capacity, upper_size, num_students - max_flow)
+		if (best is None or cost < best_cost):
+			best = Assignment(project_of, [feasible_projects[k].ID for k in positions])
+			best_cost = cost
+	return best
@@ -1,10 +1,11 @@
 import util
 
 import classes
-import random
 from classes import CompError
 from classes import FieldError
+from classes import ProjectIndex
 import numpy as np
+from scipy.optimize import linear_sum_assignment
 
 student_ids = []
 
@@ -83,9 +84,15 @@ def random_initial_solution_for_diversity(students, projects, num_teams):
 
 	return projects
 	
-def greedy_initial_solution(original_students, original_feasible_projects, verbose = False):
+def greedy_initial_solution(original_students, original_feasible_projects, verbose = False, project_index = None):
+	'''
+		project_index: an index of original_feasible_projects (ProjectIndex).
+		    Built here if not given; pass it in when calling this many times.
+	'''
 	students = original_students[:]
 	feasible_projects = original_feasible_projects[:]
+	if (project_index is None):
+		project_index = ProjectIndex(feasible_projects)
 
 	if (verbose):
 		print "Feasible projects are:"
@@ -95,10 +102,10 @@ def greedy_initial_solution(original_students, original_feasible_projects, verbo
 	ranking_spot = 0
 
 	# The IDs of the projects whose students were already removed from unmatched_students.
-	matched_projects = []
+	matched_projects = set()
 	# The IDs of the students were already removed from unmatched_students.
-	matched_students = []
-	random.shuffle(students)
+	matched_students = set()
+	util.stream.shuffle(students)
 
 	while (ranking_spot < classes.alg_number_project_rankings):
 		for cur_student in students:
@@ -112,7 +119,7 @@ def greedy_initial_solution(original_students, original_feasible_projects, verbo
 
 				# Try to get the project, assuming it's feasible.
 				try:
-					cur_project = util.get_project_from_ID(cur_project_ID, feasible_projects)
+					cur_project = util.get_project_from_ID(cur_project_ID, project_index)
 					if (verbose):
 						print "     Student not matched (" + str(cur_student.ID) + ")"
 						print "     Rank " + str(ranking_spot) + " is project " + str(cur_project_ID)
@@ -146,9 +153,9 @@ def greedy_initial_solution(original_students, original_feasible_projects, verbo
 
 							# Remove students from unmatched_students
 							for student in cur_project.students:
-								matched_students.append(student.ID)
+								matched_students.add(student.ID)
 
-							matched_projects.append(cur_project.ID)
+							matched_projects.add(cur_project.ID)
 						else:
 							pass
 
@@ -175,42 +182,384 @@ def greedy_initial_solution(original_students, original_feasible_projects, verbo
 
 	return (feasible_projects, unmatched_students)
 
-def greedy_initial_solution_team_first(original_students, original_feasible_projects, offset, verbose = False):
-        ''' 
-                Greedily matches students to projects in a team-first strategy, where
-                lower-popularity projects are filled first to minimize the chance that a student is
-                unmatched to a project on his/her ranking list
-        '''
-        students = original_students[:]
-        feasible_projects = original_feasible_projects[:]
-        if (verbose):
-                print "Feasible projects are:"
-		print [f.ID for f in feasible_projects]
-        # The IDs of the projects whose students were already removed from unmatched_students.
-	matched_projects = []
-	# The IDs of the students were already removed from unmatched_students.
-	matched_students = []
-        num_required_teams = len(students)/feasible_projects[0].capacity
-        print num_required_teams
-        #iterate in reverse popularity order
-        for project in reversed(feasible_projects[num_required_teams + offset + 1:] + feasible_projects[:num_required_teams + offset]):
-                #get all the students interested in this project who have yet to be matched
-                unmatched_interested =  [s for s in filter(lambda s: project.ID in s.project_rankings and not s.ID in matched_students, students)]
-                if len(unmatched_interested) >= project.capacity:
-                        unmatched_interested.sort(key = project.inv_get_ranking)
-                        #get the students who want this project most and put them on this project
-                        selected_unmatched = unmatched_interested[:5]
-                        for s in selected_unmatched:
-                                project.add_student(s, False)
-                        remove_students_from_projects(project.students, feasible_projects, project.ID)
-                        # Remove students from unmatched_students
-                        for student in project.students:
-                                matched_students.append(student.ID)
-                        matched_projects.append(project.ID)
-                else:
-                        pass
-        unmatched_students = [s for s in students if not(s.ID in matched_students)]
-        return (feasible_projects, unmatched_students)
+def hungarian_assignment(table, open_projects, match_all):
+	'''
+		Assigns students to slots of the open projects at minimum total rank
+		cost with the Hungarian algorithm.
+
+		Every open project has capacity slots that must be filled, plus
+		capacity_w - capacity optional slots if everyone has to be matched.
+		Unranked projects cost more than any total of ranked costs, and each
+		required slot is worth more than anything else, so the solver (which
+		works in floats) stays exact: it first fills every required slot, then
+		minimizes the number of students on unranked projects, then the
+		total rank cost.
+
+		Returns
+		-------
+		(project_of, cost): the position in open_projects of the project of
+		every student index, or -1, and the total cost in the scale above.
+	'''
+	num_students = len(table)
+	num_open = len(open_projects)
+	capacity = open_projects[0].capacity
+	wiggle = (open_projects[0].capacity_w - capacity) if match_all else 0
+	costs = ranked_costs(table, [p.ID for p in open_projects])
+	required_bonus = num_students * costs.max() + 1
+
+	slot_costs = np.repeat(costs, capacity, axis = 1) - required_bonus
+	if (wiggle > 0):
+		slot_costs = np.hstack((slot_costs, np.repeat(costs, wiggle, axis = 1)))
+	(rows, columns) = linear_sum_assignment(slot_costs)
+
+	project_of = np.empty(num_students, dtype = np.int64)
+	project_of.fill(-1)
+	required = num_open * capacity
+	project_of[rows] = np.where(columns < required, columns // capacity,
+		(columns - required) // max(wiggle, 1))
+	return (project_of, slot_costs[rows, columns].sum())
+
+def ranked_costs(table, IDs):
+	'''
+		The costs that hungarian_assignment minimizes: the rank cost of every
+		student on every project in IDs, or, for a project that the student
+		did not rank, more than any total of ranked costs.
+
+		Returns
+		-------
+		costs: one row per student index and one column per ID (2d numpy
+		array of ints).
+	'''
+	max_ranked_cost = classes.Student.get_cost_from_ranking(table.project_rankings.shape[1])
+	unranked_cost = len(table) * max_ranked_cost + 1
+	return np.where(table.rank_matrix[:, IDs] < 100, table.cost_matrix[:, IDs], unranked_cost)
+
+def hungarian_initial_solution(original_students, original_feasible_projects, match_all, verbose = False):
+	'''
+		Matches students to projects in one pass, as an assignment problem
+		(see hungarian_assignment), instead of many greedy restarts.
+
+		num_students / capacity projects are opened. Which ones is chosen by
+		starting from the best of the projects with the most rankings and
+		the projects with the highest Borda score (a ranking is worth
+		number_project_rankings + 1 - rank points), then swapping an open
+		project for a closed one for as long as some swap lowers the cost
+		(see open_projects_search).
+
+		Returns the teams (Project list), taken from original_feasible_projects.
+	'''
+	students = original_students[:]
+	feasible_projects = original_feasible_projects[:]
+	(best_open, best_of) = hungarian_open_projects(students[0].table, feasible_projects, match_all, verbose)
+
+	solution = []
+	for (team, k) in enumerate(best_open):
+		p = feasible_projects[k]
+		members = [s for s in students if best_of[s.index] == team]
+		p.force_students(members, max(p.capacity - len(members), 0))
+		solution.append(p)
+	if (verbose):
+		print_students(solution)
+	return solution
+
+def hungarian_open_projects(table, feasible_projects, match_all, verbose = False):
+	'''
+		Chooses the projects to open for hungarian_initial_solution, as it
+		describes.
+
+		Returns
+		-------
+		(open_positions, project_of): the positions in feasible_projects of
+		the open projects (sorted int list), and the position in the open
+		projects of the project of every student index, or -1 (numpy
+		array of ints), as assigned by hungarian_assignment.
+	'''
+	num_students = len(table)
+	capacity = feasible_projects[0].capacity
+	num_teams = min(num_students / capacity, len(feasible_projects))
+	if (num_teams == 0):
+		raise CompError("There are not enough students to form a team.")
+	if (match_all and num_students > num_teams * feasible_projects[0].capacity_w):
+		raise CompError("There are not enough feasible projects to match every student.")
+
+	num_rankings = table.project_rankings.shape[1]
+	demand = [table.get_num_ranked(p.ID) for p in feasible_projects]
+	borda = [np.sum(num_rankings + 1 - table.get_interested(p.ID)[1]) for p in feasible_projects]
+	def top(scores):
+		order = sorted(range(len(feasible_projects)), key = lambda k: -scores[k])
+		return sorted(order[:num_teams])
+	def solve(open_positions):
+		open_projects = [feasible_projects[k] for k in open_positions]
+		return hungarian_assignment(table, open_projects, match_all)
+
+	best_open = None
+	for candidate in [top(demand), top(borda)]:
+		(project_of, cost) = solve(candidate)
+		if (best_open is None or cost < best_cost):
+			(best_open, best_of, best_cost) = (candidate, project_of, cost)
+
+	costs = ranked_costs(table, [p.ID for p in feasible_projects])
+	if (match_all):
+		(upper, num_unmatched) = (feasible_projects[0].capacity_w, 0)
+	else:
+		(upper, num_unmatched) = (capacity, num_students - num_teams * capacity)
+	(best_open, best_of, best_cost) = open_projects_search(costs, best_open, best_of,
+		capacity, upper, num_unmatched, verbose)
+	return (best_open, best_of)
+
+def open_projects_search(costs, open_positions, project_of, lower, upper, num_unmatched, verbose = False):
+	'''
+		Local search over which projects to open: swaps an open project for
+		a closed one, and reassigns the students optimally for the new open
+		projects (see reoptimize_assignment), for as long as some swap
+		lowers the total cost.
+
+		Every swap is tried, but most are ruled out without reassigning the
+		students, by a lower bound on the cost after the swap (see
+		swap_bounds). The others are tried lowest bound first, and the first
+		one that lowers the cost is made.
+
+		Parameters
+		----------
+		costs: the cost of every student on every project that can be
+		    opened (2d numpy array of ints, one row per student).
+		open_positions: the columns of costs of the open projects (int list).
+		project_of: the position in open_positions of the project of every
+		    student, or -1 (numpy array of ints). It has to respect the
+		    bounds below.
+		lower: the minimum number of students of an open project (int).
+		upper: the maximum number of students of an open project (int).
+		num_unmatched: the number of students left off every team (int).
+		verbose: indicates if every swap made is printed (bool).
+
+		Returns
+		-------
+		(open_positions, project_of, cost): the open projects after the
+		search (sorted int list), the position among them of the project of
+		every student, or -1, and the total cost of the assignment (int).
+	'''
+	num_open = len(open_positions)
+	columns = list(open_positions)
+	project_of = np.where(project_of >= 0, project_of, num_open)
+	lowers = np.array([lower] * num_open + [num_unmatched], dtype = np.int64)
+	uppers = np.array([upper] * num_open + [num_unmatched], dtype = np.int64)
+	# Unmatched students are on a last, free project that cannot be closed.
+	current = np.hstack((costs[:, columns], np.zeros((len(costs), 1), dtype = costs.dtype)))
+	if (num_unmatched == 0):
+		(current, lowers, uppers) = (current[:, :num_open], lowers[:num_open], uppers[:num_open])
+	(cost, prices) = reoptimize_assignment(current, project_of, lowers, uppers)
+
+	improved = True
+	while (improved):
+		improved = False
+		closed = sorted(set(range(costs.shape[1])) - set(columns))
+		(bounds, margins) = swap_bounds(costs[:, closed], current, prices, num_open, lowers, uppers)
+		candidates = np.argwhere(bounds < cost + margins)
+		order = np.argsort(bounds[candidates[:, 0], candidates[:, 1]], kind = 'mergesort')
+		for (slot, k) in candidates[order]:
+			swapped = current.copy()
+			swapped[:, slot] = costs[:, closed[k]]
+			swapped_of = project_of.copy()
+			(swapped_cost, swapped_prices) = reoptimize_assignment(swapped, swapped_of, lowers, uppers)
+			if (swapped_cost < cost):
+				if (verbose):
+					print "Opened column " + str(closed[k]) + " in place of " + str(columns[slot]) + ", cost is now " + str(swapped_cost)
+				columns[slot] = closed[k]
+				(current, project_of, cost, prices) = (swapped, swapped_of, swapped_cost, swapped_prices)
+				improved = True
+				break
+
+	# Renumber the open projects in sorted order.
+	order = np.argsort(columns)
+	renumber = np.empty(num_open + 1, dtype = np.int64)
+	renumber[order] = np.arange(num_open)
+	renumber[num_open] = -1
+	return ([columns[k] for k in order], renumber[project_of], cost)
+
+def reoptimize_assignment(costs, project_of, lower, upper):
+	'''
+		Moves students between projects until the total cost of the
+		assignment is minimal.
+
+		The assignment is minimal when no cycle of moves lowers the cost: a
+		student of project a goes to b, one of b goes to c, and so on back
+		to a, or, through the spare room of the projects, from a project
+		with more than its minimum to one with less than its maximum. Such
+		cycles are found by the Bellman-Ford algorithm on a graph of the
+		projects (see project_graph), and moved along until there are none
+		left. Starting from a good assignment, this takes few cycles.
+
+		Parameters
+		----------
+		costs: the cost of every student on every project (2d numpy array
+		    of ints, one row per student).
+		project_of: the project of every student (numpy array of ints),
+		    changed in place. Project k has to have between lower[k] and
+		    upper[k] students.
+		lower: the minimum number of students of every project (numpy
+		    array of ints).
+		upper: the maximum number of students of every project (numpy
+		    array of ints).
+
+		Returns
+		-------
+		(cost, prices): the total cost (int), and a price for every project
+		(numpy array of ints) such that every student is on a project of
+		the lowest cost plus price. These are the prices of the dual linear
+		program, which swap_bounds uses.
+	'''
+	num_projects = costs.shape[1]
+	while (True):
+		(graph, order, starts, differences) = project_graph(costs, project_of, lower, upper)
+		# Bellman-Ford from a virtual node with an edge to every node.
+		distances = np.zeros(num_projects + 1, dtype = np.int64)
+		previous = np.empty(num_projects + 1, dtype = np.int64)
+		previous.fill(-1)
+		cycle = None
+		for iteration in range(num_projects + 2):
+			through = distances[:, np.newaxis] + graph
+			best = through.argmin(axis = 0)
+			shortest = through[best, np.arange(num_projects + 1)]
+			shorter = shortest < distances
+			if (not(shorter.any())):
+				break
+			distances[shorter] = shortest[shorter]
+			previous[shorter] = best[shorter]
+			cycle = find_cycle(previous)
+			if (cycle is not None):
+				break
+		if (cycle is None):
+			total = costs[np.arange(len(costs)), project_of].sum()
+			return (total, distances[num_projects] - distances[:num_projects])
+
+		# Edges to and from the last node only change the counts.
+		moves = []
+		for b in cycle:
+			a = previous[b]
+			if (a < num_projects and b < num_projects):
+				members = order[starts[a]:starts[a + 1]]
+				moves.append((members[np.argmin(differences[starts[a]:starts[a + 1], b])], b))
+		for (i, b) in moves:
+			project_of[i] = b
+
+def project_graph(costs, project_of, lower, upper):
+	'''
+		The graph that reoptimize_assignment looks for cycles in. Node k <
+		num_projects is project k, and the edge from a to b costs as much
+		as the cheapest move of a student of a to b. The last node stands
+		for the spare room of the projects: there is an edge of cost 0 to
+		it from every project with less than its maximum, and from it to
+		every project with more than its minimum.
+
+		Returns
+		-------
+		(graph, order, starts, differences): the costs of the edges, with
+		2**62 for no edge (2d numpy array of ints), the student indices
+		ordered by project, where the students of project k start in order
+		(numpy arrays of ints), and the change in cost of moving each
+		student of order to each project (2d numpy array of ints).
+	'''
+	num_projects = costs.shape[1]
+	counts = np.bincount(project_of, minlength = num_projects)
+	order = np.argsort(project_of, kind = 'mergesort')
+	starts = np.concatenate(([0], np.cumsum(counts)))
+	differences = costs[order] - costs[order, project_of[order]][:, np.newaxis]
+
+	graph = np.empty((num_projects + 1, num_projects + 1), dtype = np.int64)
+	graph.fill(2 ** 62)
+	nonempty = counts > 0
+	graph[np.flatnonzero(nonempty), :num_projects] = np.minimum.reduceat(differences, starts[:-1][nonempty], axis = 0)
+	np.fill_diagonal(graph, 2 ** 62)
+	graph[:num_projects, num_projects][counts < upper] = 0
+	graph[num_projects, :num_projects][counts > lower] = 0
+	return (graph, order, starts, differences)
+
+def find_cycle(previous):
+	'''
+		Returns the nodes of a cycle of the edges from previous[k] to k
+		(int list), or None if there is none.
+	'''
+	# Following previous len(previous) times from any node ends on a cycle,
+	# if there is one on the way. Node n (past the end) stands for no node.
+	n = len(previous)
+	jump = np.append(np.where(previous >= 0, previous, n), n)
+	steps = 1
+	while (steps < n):
+		jump = jump[jump]
+		steps *= 2
+	on_cycle = jump[:n][jump[:n] < n]
+	if (len(on_cycle) == 0):
+		return None
+	cycle = [on_cycle[0]]
+	k = previous[on_cycle[0]]
+	while (k != on_cycle[0]):
+		cycle.append(k)
+		k = previous[k]
+	return cycle
+
+def swap_bounds(closed_costs, current, prices, num_open, lower, upper):
+	'''
+		Lower bounds on the total cost after swapping an open project for a
+		closed one, by Lagrangian relaxation: with a price on every project,
+		the cost of the best project plus price of every student, less the
+		most that the prices can add up to over the allowed numbers of
+		students, is at most the cost of any assignment. The prices of the
+		projects that stay open are kept, and the best price for the
+		opened one is found for each swap.
+
+		Parameters
+		----------
+		closed_costs: the cost of every student on every closed project
+		    (2d numpy array of ints).
+		current: the cost of every student on every open project, the
+		    num_open that can be swapped first (2d numpy array of ints).
+		prices: the prices of the open projects, as returned by
+		    reoptimize_assignment (numpy array of ints).
+		num_open: the number of open projects that can be swapped (int).
+		lower: the minimum number of students of every open project (numpy
+		    array of ints).
+		upper: the maximum number of students of every open project (numpy
+		    array of ints).
+
+		Returns
+		-------
+		(bounds, margins): the bound for swapping open project k for
+		closed project c at [k, c], and the rounding error that it may
+		have (2d numpy arrays of floats).
+	'''
+	(num_students, num_projects) = current.shape
+	bounds = np.empty((num_open, closed_costs.shape[1]))
+	margins = np.zeros((num_open, closed_costs.shape[1]))
+	if (num_projects < 2):
+		bounds.fill(-np.inf)
+		return (bounds, margins)
+	priced = (current + prices).astype(float)
+	def room(price, low, high):
+		# The most that price can add up to over low to high students.
+		return np.where(price > 0, price * high, price * low)
+	cheapest = np.argsort(priced, axis = 1)[:, :2]
+	rows = np.arange(num_students)
+	(first, second) = (priced[rows, cheapest[:, 0]], priced[rows, cheapest[:, 1]])
+	rooms = room(prices, lower, upper)
+	for k in range(num_open):
+		# The best of the projects that stay open, for every student.
+		best = np.where(cheapest[:, 0] == k, second, first)
+		# Opening project c at price p saves max(0, gain - p) per student.
+		gains = best[:, np.newaxis] - closed_costs
+		ordered = -np.sort(-gains, axis = 0)
+		low = lower[k]
+		high = upper[k]
+		opened = None
+		for price in [np.zeros(len(ordered[0])), np.maximum(ordered[high - 1], 0), np.minimum(ordered[low - 1], 0)]:
+			value = -np.maximum(0, gains - price).sum(axis = 0) - room(price, low, high)
+			opened = value if (opened is None) else np.maximum(opened, value)
+		bounds[k] = best.sum() - (rooms.sum() - rooms[k]) + opened
+		# A sum of floats is off by at most its number of terms times the
+		# machine epsilon times the sum of the sizes of its terms.
+		sizes = np.abs(best).sum() + np.abs(rooms).sum() + (num_students + high) * \
+			np.maximum(np.abs(ordered[high - 1]), np.abs(ordered[low - 1]))
+		margins[k] = 4 * (num_students + num_projects) * np.finfo(float).eps * sizes
+	return (bounds, margins)
 
 def randomly_add_unmatched_students((original_feasible_projects, original_unmatched_students), verbose = False):
 	'''
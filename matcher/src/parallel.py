@@ -0,0 +1,237 @@
+import util
+import initial_solution
+import perry_geo_test as test
+from classes import ProjectIndex
+
+import time
+import multiprocessing
+
+# The problem data of a worker process. It is set once per process by
+# init_worker, so the tasks only carry seeds and assignments.
+worker_data = {}
+
+def init_worker(students, feasible_projects, inv_cov_mat_tup, mode, match_all):
+	'''
+		Parameters
+		----------
+		students: the students (Student list).
+		feasible_projects: the feasible projects (Project list).
+		inv_cov_mat_tup: the tuple returned by
+		    distance.create_inv_cov_mat_from_data (tuple).
+		mode: the algorithm mode, "cc" or "co" (string).
+		match_all: indicates if every student has to be matched (bool).
+
+		Returns
+		-------
+		Nothing. Stores the problem data and an annealer in worker_data.
+
+	'''
+	worker_data['students'] = students
+	worker_data['feasible_projects'] = feasible_projects
+	worker_data['inv_cov_mat_tup'] = inv_cov_mat_tup
+	worker_data['project_index'] = ProjectIndex(feasible_projects)
+	worker_data['match_all'] = match_all
+	worker_data['annealer'] = test.create_annealer(mode)
+
+def run_chain(task):
+	'''
+		Parameters
+		----------
+		task: (chain, seed, assignment, schedule, time_budget) where
+		    assignment is the starting Assignment, or None to start from a
+		    randomized greedy solution, and schedule and time_budget are as
+		    in perry_geo_test.run_schedule (tuple).
+
+		Returns
+		-------
+		(chain, seed, final energy, final Assignment, stop reason) (tuple).
+
+	'''
+	(chain, seed, assignment, schedule, time_budget) = task
+	util.stream.seed(seed)
+
+	students = worker_data['students']
+	feasible_projects = worker_data['feasible_projects']
+	for p in feasible_projects:
+		p.reset()
+	if (assignment is None):
+		sol = test.greedy_solution(students, feasible_projects, worker_data['match_all'],
+			project_index = worker_data['project_index'])
+	else:
+		sol = util.assignment_to_projects(assignment, students, feasible_projects)
+
+	state = (sol, worker_data['inv_cov_mat_tup'], feasible_projects, students, {})
+	annealer = worker_data['annealer']
+	state, e = test.run_schedule(annealer, state, schedule, time_budget = time_budget)
+	return (chain, seed, e, util.projects_to_assignment(state[0], students), annealer.stop_reason)
+
+def run_chains(students, feasible_projects, inv_cov_mat_tup, mode, match_all, starts, schedule, workers, restarts, time_budget = None):
+	'''
+		Parameters
+		----------
+		students: the students (Student list).
+		feasible_projects: the feasible projects (Project list).
+		inv_cov_mat_tup: the tuple returned by
+		    distance.create_inv_cov_mat_from_data (tuple).
+		mode: the algorithm mode, "cc" or "co" (string).
+		match_all: indicates if every student has to be matched (bool).
+		starts: the starting solutions of the first chains (Assignment list).
+		    The other chains start from randomized greedy solutions.
+		schedule: the schedule of every chain, as in
+		    perry_geo_test.run_schedule (tuple).
+		workers: the number of processes (int).
+		restarts: the number of chains (int).
+		time_budget: the number of seconds every chain anneals for (float),
+		    or None.
+
+		Returns
+		-------
+		A list of (chain, seed, final energy, final Assignment, stop reason),
+		one per chain, in chain order.
+
+	'''
+	seeds = util.stream.seeds(restarts)
+	tasks = []
+	for chain in range(0, restarts):
+		assignment = starts[chain] if (chain < len(starts)) else None
+		tasks.append((chain, seeds[chain], assignment, schedule, time_budget))
+
+	pool = multiprocessing.Pool(workers, init_worker,
+		(students, feasible_projects, inv_cov_mat_tup, mode, match_all))
+	try:
+		results = pool.map(run_chain, tasks, chunksize = 1)
+	finally:
+		pool.close()
+		pool.join()
+	return results
+
+def init_seeder(students, feasible_projects, match_all):
+	'''
+		Parameters
+		----------
+		students: the students (Student list).
+		feasible_projects: the feasible projects (Project list).
+		match_all: indicates if every student has to be matched (bool).
+
+		Returns
+		-------
+		Nothing. Stores the problem data, and an index of the feasible
+		projects, in worker_data.
+
+	'''
+	worker_data['students'] = students
+	worker_data['feasible_projects'] = feasible_projects
+	worker_data['project_index'] = ProjectIndex(feasible_projects)
+	worker_data['match_all'] = match_all
+
+def greedy_batch(task):
+	'''
+		Parameters
+		----------
+		task: (seed, count, keep, deadline) where count is the number of
+		    randomized greedy solutions to run, keep the number of distinct
+		    solutions to return, and deadline the time.time() after which no
+		    more runs are started, or None (tuple).
+
+		Returns
+		-------
+		(number of runs made, keys of all the distinct solutions found,
+		list of (average rank cost, key, Assignment)) where the list holds
+		the keep best distinct solutions (tuple).
+
+	'''
+	(seed, count, keep, deadline) = task
+	util.stream.seed(seed)
+
+	students = worker_data['students']
+	feasible_projects = worker_data['feasible_projects']
+	table = students[0].table
+	found = {}
+	runs = 0
+	for run in range(0, count):
+		if (deadline is not None and time.time() > deadline):
+			break
+		for p in feasible_projects:
+			p.reset()
+		sol = test.greedy_solution(students, feasible_projects, worker_data['match_all'],
+			worker_data['project_index'])
+		runs += 1
+		if (len(sol) == 0):
+			continue
+		assignment = util.projects_to_assignment(sol, students)
+		key = assignment.get_student_project_IDs().tostring()
+		if (not(key in found)):
+			found[key] = (util.average_rank_cost(assignment, table), key, assignment)
+	return (runs, found.keys(), sorted(found.values(), key = lambda result: result[0])[:keep])
+
+def greedy_seeds(students, feasible_projects, match_all, num_times, time_budget, keep, workers, batch_size = 50):
+	'''
+		Runs randomized greedy solutions across a pool of processes, and one
+		solution of initial_solution.hungarian_initial_solution in this one.
+
+		Parameters
+		----------
+		students: the students (Student list).
+		feasible_projects: the feasible projects (Project list).
+		match_all: indicates if every student has to be matched (bool).
+		num_times: the number of randomized greedy solutions (int), or None
+		    to keep going until the time budget runs out.
+		time_budget: the number of seconds to spend (float), or None.
+		keep: the number of distinct solutions to return (int).
+		workers: the number of processes (int).
+		batch_size: the number of greedy runs per task (int).
+
+		Returns
+		-------
+		A list of (average rank cost, Assignment) of the keep best distinct
+		solutions, best first.
+
+	'''
+	if (num_times is None and time_budget is None):
+		raise test.CompError("The greedy solutions need a number of restarts or a time budget.")
+	deadline = None if (time_budget is None) else time.time() + time_budget
+	def next_batch(b):
+		if (num_times is None):
+			return batch_size
+		remaining = num_times - b * batch_size
+		return min(batch_size, remaining) if (remaining > 0) else None
+
+	pool = multiprocessing.Pool(workers, init_seeder, (students, feasible_projects, match_all))
+	found = {}
+	seen = set()
+	runs = 0
+	try:
+		pending = []
+		b = 0
+		while True:
+			while (len(pending) < 2 * workers and (deadline is None or time.time() < deadline)):
+				count = next_batch(b)
+				if (count is None):
+					break
+				seed = util.stream.seeds(1)[0]
+				pending.append(pool.apply_async(greedy_batch, ((seed, count, keep, deadline),)))
+				b += 1
+			if (len(pending) == 0):
+				break
+			(done, keys, results) = pending.pop(0).get()
+			runs += done
+			seen.update(keys)
+			for (cost, key, assignment) in results:
+				if (not(key in found)):
+					found[key] = (cost, assignment)
+	finally:
+		pool.close()
+		pool.join()
+
+	print "Tried " + str(runs) + " greedy solutions, " + str(len(seen)) + " of them distinct."
+
+	for p in feasible_projects:
+		p.reset()
+	sol = initial_solution.hungarian_initial_solution(students, feasible_projects, match_all)
+	assignment = util.projects_to_assignment(sol, students)
+	cost = util.average_rank_cost(assignment, students[0].table)
+	print "The Hungarian solution has an avg rank cost of " + str(cost)
+	found[assignment.get_student_project_IDs().tostring()] = (cost, assignment)
+
+	ranked = sorted(found.values(), key = lambda result: result[0])
+	return ranked[:keep]
@@ -0,0 +1,171 @@
+'''
+	The team composition rules, and the penalties that the energy of
+	perry_geo_annealing adds for the teams that break them.
+
+	Each rule bounds the number of students on a team whose numerical
+	property (see StudentTable.numerical_properties) takes one of a set of
+	values. Whether each student meets each rule is worked out once per
+	StudentTable, as a bitmask per student, so that the rules a team breaks
+	follow from per-rule counts of its members, and a swap of two students
+	only adds and subtracts their rows of those counts.
+
+	The rules come from the [constraints] section of the config (see
+	classes.parse_constraint), or are default_rules if it has none.
+'''
+
+import classes
+import numpy as np
+
+# Columns of StudentTable.numerical_properties that the rules can test.
+columns = {"degree" : 0, "business" : 1, "coding" : 2, "work_experience" : 3}
+
+class CompositionRule(object):
+	'''
+		A team breaks the rule if fewer than min_count, or more than
+		max_count, of its students have a value of values in column. Each
+		broken rule adds weight to the energy.
+	'''
+	__slots__ = ['description', 'column', 'values', 'weight', 'min_count', 'max_count']
+
+	def __init__(self, description, column, values, weight = 1000, min_count = 1, max_count = None):
+		'''
+			Parameters
+			----------
+			description: what is wrong with a team that breaks the rule,
+			    as printed by util.list_penalties (string).
+			column: the property to test, a key of columns (string).
+			values: the values that meet the rule (int list).
+			weight: the penalty for breaking the rule (float).
+			min_count: the fewest students a team needs (int).
+			max_count: the most students a team may have (int), or None
+			    for no maximum.
+		'''
+		self.description = description
+		self.column = columns[column]
+		self.values = list(values)
+		self.weight = weight
+		self.min_count = min_count
+		self.max_count = max_count
+
+	def is_met_by(self, numerical_properties):
+		'''
+			Returns whether each row of numerical_properties meets the rule
+			(numpy array of bools).
+		'''
+		return np.in1d(numerical_properties[:, self.column], self.values)
+
+# The rules of the company challenges.
+default_rules = [
+	CompositionRule("has no MBA students", "degree", [0]),
+	CompositionRule("has no CS in MEng students", "degree", [1]),
+	CompositionRule("has no members who rated themselves at least 3 in coding ability.", "coding", [3, 4]),
+	CompositionRule("has no members who rated themselves at least a 3 in business ability.", "business", [3, 4]),
+	CompositionRule("has no members who have at least a 3 in work experience.", "work_experience", [3, 4]),
+]
+
+def constraint_rules(constraints):
+	'''
+		Returns the rules of the constraints parsed by
+		classes.parse_constraint (CompositionRule list).
+	'''
+	rules = []
+	for (name, column, values, min_count, max_count, weight) in constraints:
+		bounds = "at least " + str(min_count)
+		if (max_count is not None):
+			bounds += " and at most " + str(max_count)
+		description = ("breaks " + name + ": needs " + bounds + " members with "
+		               + column + " in " + str(values) + ".")
+		rules.append(CompositionRule(description, column, values, weight, min_count, max_count))
+	return rules
+
+class PenaltyEngine(object):
+	'''
+		Evaluates a list of rules for the students of one StudentTable.
+
+		meets[i, r] is 1 if the student with index i meets rule r, and
+		masks[i] packs the row into bits. The counts of a team are the
+		per-rule sums of its students' rows of meets, and it breaks the rules
+		whose counts fall outside [min_counts, max_counts].
+	'''
+
+	def __init__(self, table, rules = None):
+		'''
+			Parameters
+			----------
+			table: the students (StudentTable).
+			rules: the rules (CompositionRule list). Defaults to the rules
+			    of classes.constraints.
+		'''
+		if (rules is None):
+			rules = default_rules if (classes.constraints is None) else constraint_rules(classes.constraints)
+		self.rules = list(rules)
+		numerics = table.numerical_properties
+		self.meets = np.zeros((len(numerics), len(self.rules)), dtype = np.int64)
+		for (r, rule) in enumerate(self.rules):
+			self.meets[:, r] = rule.is_met_by(numerics)
+		self.masks = np.dot(self.meets, 2 ** np.arange(len(self.rules), dtype = np.int64))
+		self.weights = np.array([rule.weight for rule in self.rules], dtype = np.float64)
+		# Integer bounds, like the counts, so that comparing them needs no casts.
+		no_max = np.iinfo(np.int64).max
+		self.min_counts = np.array([rule.min_count for rule in self.rules], dtype = np.int64)
+		self.max_counts = np.array([no_max if (rule.max_count is None) else rule.max_count
+		                            for rule in self.rules], dtype = np.int64)
+		self.has_max = any(rule.max_count is not None for rule in self.rules)
+		self.ones = np.ones(len(self.rules))
+
+	def team_counts(self, indices):
+		'''
+			Returns the number of students of a team (given by index) that
+			meet each rule (numpy array of ints).
+		'''
+		return self.meets[indices].sum(axis = 0)
+
+	def swap_counts(self, counts, student_in, student_out):
+		'''
+			Returns the counts of a team after the student with index
+			student_out was replaced by the one with index student_in. If
+			both meet the same rules, counts itself is returned.
+		'''
+		if (self.masks[student_in] == self.masks[student_out]):
+			return counts
+		return counts + (self.meets[student_in] - self.meets[student_out])
+
+	def penalty(self, counts):
+		'''
+			Returns the penalty of a team with the given counts (float), or
+			of every team, for an array of counts with one row per team.
+		'''
+		return (self.broken(counts) * self.weights).sum(axis = -1)
+
+	def broken(self, counts):
+		'''
+			Returns whether a team with the given counts breaks each rule
+			(numpy array of bools), or every team, as for penalty.
+		'''
+		if (not(self.has_max)):
+			return counts < self.min_counts
+		return (counts < self.min_counts) | (counts > self.max_counts)
+
+	def num_broken(self, counts):
+		'''
+			Returns the number of rules that a team with the given counts
+			breaks (float), or every team, as for penalty.
+		'''
+		return np.dot(self.broken(counts), self.ones)
+
+	def broken_rules(self, counts):
+		'''
+			Returns the rules that a team with the given counts breaks
+			(CompositionRule list).
+		'''
+		return [rule for (rule, broken) in zip(self.rules, self.broken(counts)) if broken]
+
+def get_engine(table):
+	'''
+		Returns the PenaltyEngine of a student table, made on first use.
+	'''
+	engine = getattr(table, 'penalty_engine', None)
+	if (engine is None):
+		engine = PenaltyEngine(table)
+		table.penalty_engine = engine
+	return engine
@@ -1,90 +1,370 @@
 import numpy as np
 import util
+import classes
+import penalties as composition
 from classes import CompError
-from numpy import random
 import pdb
 
+def tracks_sums(inv_cov_mat_tup):
+        '''
+                Indicates if the team cache keeps the team_sums of every team, so
+                that delta_energy can update squared Mahalanobis diversities in O(d).
+        '''
+        return classes.diversity_metric == "squared_mahalanobis" and inv_cov_mat_tup[3] is not None
+
+def team_terms(project, inv_cov_mat_tup, penalize = True, sums = None, counts = None):
+        '''
+                Calculates one team's contribution to the energy.
+
+                Parameters
+                ----------
+                project: the team (Project).
+                inv_cov_mat_tup: the diversity data, as passed to calculate_diversity.
+                penalize: indicates if the team composition penalties apply (bool).
+                sums: the team_sums of the team, to take the diversity from
+                    (see classes.squared_diversity), or None.
+                counts: the rule counts of the team (see
+                    penalties.PenaltyEngine.team_counts), or None.
+
+                Returns
+                -------
+                (avg_project_cost, project_diversity, penalties): the average ranking
+                cost of the team's students, the team's diversity and the team's
+                composition penalties (0 if penalize is False).
+        '''
+        penalties = 0
+        if sums is None:
+                project_diversity = project.calculate_diversity(inv_cov_mat_tup)
+        else:
+                project_diversity = classes.squared_diversity(sums)
+        # Work on the students' rows of the student table.
+        table = project.students[0].table
+        indices = [student.index for student in project.students]
+        avg_project_cost = np.mean(table.cost_matrix[indices, project.ID])
+        if penalize:
+                engine = composition.get_engine(table)
+                if counts is None:
+                        counts = engine.team_counts(indices)
+                penalties = engine.penalty(counts)
+        return (avg_project_cost, project_diversity, penalties)
+
+def team_cost(state, penalize):
+        '''
+                Calculates the energy of a state from the terms of every team.
+
+                If the state carries a team cache (state[4], a dict), the terms are
+                stored there so that delta_energy can update them one move at a time,
+                along with the rule counts of every team (if penalize) and their
+                team_sums (see tracks_sums).
+        '''
+        projects = state[0]
+        inv_cov_mat_tup = state[1]
+        terms = {}
+        for project in projects:
+                terms[project] = team_terms(project, inv_cov_mat_tup, penalize)
+        if (len(state) > 4):
+                cache = state[4]
+                cache['terms'] = terms
+                cache['pending'] = []
+                cache['penalize'] = penalize
+                cache['pending_tracked'] = []
+                for name in ['sums', 'counts', 'layout']:
+                        cache.pop(name, None)
+                if tracks_sums(inv_cov_mat_tup):
+                        whitened = inv_cov_mat_tup[3]
+                        cache['sums'] = dict((project, classes.team_sums(whitened,
+                                [s.index for s in project.students])) for project in projects)
+                if penalize and len(projects) > 0:
+                        engine = composition.get_engine(projects[0].students[0].table)
+                        cache['counts'] = dict((project, engine.team_counts(
+                                [s.index for s in project.students])) for project in projects)
+        project_costs = [terms[p][0] for p in projects]
+        diversities = [terms[p][1] for p in projects]
+        penalties = sum([terms[p][2] for p in projects])
+        avg_diversity = np.mean(diversities)
+        ranking_cost = np.mean(project_costs)
+        return 2*(ranking_cost) - (0.5 * avg_diversity) + penalties
+
 def energy(state):
 	'''
 		Calculates the energy of a given state.
 	'''
-	projects = state[0]
-	inv_cov_mat_tup = state[1]
+        return team_cost(state, True)
 
-	def team_cost():
-		diversities = []
-                project_costs = []
-                penalties = 0
-		for project in projects:
-                        costs = []
-			project_diversity = project.calculate_diversity(inv_cov_mat_tup)
-			diversities.append(project_diversity)
-                        numerics = []
-                        for student in project.students:
-                                rank = student.get_ranking(project.ID)
-                                cost = student.get_cost_from_ranking(rank)
-                                costs.append(cost)
-                                numerics.append(student.get_numerical_student_properties())
-                        avg_project_cost = np.mean(costs)
-                        project_costs.append(avg_project_cost)
-                        programs = [x[0] for x in numerics]
-                        b_abilities = [x[1] for x in numerics]
-                        c_abilities = [x[2] for x in numerics]
-                        w_exp = [x[3] for x in numerics]
-                        #penalty for no MBAs
-                        if 0 not in programs:
-                                penalties += 1000
-                        #penalty for no MEngs
-                        if 1 not in programs:
-                                penalties += 1000
-                        #penalty for lack of coding experience (i.e. no one who rated their own coding ability as 3 or more)
-                        if 3 not in c_abilities and 4 not in c_abilities:
-                                penalties += 1000
-                        #penalty for a lack of business ability
-                        if 3 not in b_abilities and 4 not in b_abilities:
-                                penalties += 1000
-                        #penalty for lack of work experience
-                        if 3 not in w_exp and 4 not in w_exp:
-                                penalties += 1000
-		avg_diversity = np.mean(diversities)
-                ranking_cost = np.mean(project_costs)
-		return 2*(ranking_cost) - (0.5 * avg_diversity) + penalties
-
-	return team_cost()
-
-def move(state, verbose = False, super_verbose = False):
+def batch_energy(student_project_IDs, table, distance_matrix, penalize = True, chunk_size = 64):
+        '''
+                Calculates the energy of many states at once, as energy (or
+                energy_co, if penalize is False) would for each one.
+
+                Parameters
+                ----------
+                student_project_IDs: the project ID of every student's team in
+                    every state, or -1 for students not on a team (2d numpy array
+                    of ints, one row per state, one column per Student.index, as
+                    returned by Assignment.get_student_project_IDs).
+                table: the student table (StudentTable).
+                distance_matrix: the Mahalanobis distances between all students,
+                    indexed by Student.index (2d numpy array of floats).
+                penalize: indicates if the team composition penalties apply (bool).
+                chunk_size: the number of states to work on at a time; the pairs
+                    of teammates of a chunk are a boolean mask of chunk_size *
+                    (number of students)**2 bytes, 64 MB for 1000 students.
+
+                Returns
+                -------
+                energies: the energy of every state (numpy array of floats).
+        '''
+        IDs = np.asarray(student_project_IDs, dtype = np.int64)
+        (num_states, num_students) = IDs.shape
+        num_columns = table.cost_matrix.shape[1]
+        engine = composition.get_engine(table)
+        if classes.diversity_metric == "squared_mahalanobis":
+                distance_matrix = distance_matrix ** 2
+        energies = np.empty(num_states)
+        for first in range(0, num_states, chunk_size):
+                chunk = IDs[first:first + chunk_size]
+                n = len(chunk)
+                matched = chunk >= 0
+                # One bin per (state, project) pair of the chunk.
+                bins = (np.arange(n)[:, np.newaxis] * num_columns + chunk)[matched]
+                num_bins = n * num_columns
+                counts = np.bincount(bins, minlength = num_bins).reshape(n, num_columns)
+                teams = counts > 0
+                num_teams = teams.sum(axis = 1)
+
+                students = np.nonzero(matched)[1]
+                costs = table.cost_matrix[students, chunk[matched]]
+                cost_sums = np.bincount(bins, costs, num_bins).reshape(n, num_columns)
+                avg_costs = np.where(teams, cost_sums / np.maximum(counts, 1), 0.0)
+                ranking_costs = avg_costs.sum(axis = 1) / num_teams
+
+                # Each pair of teammates appears twice in the rows of the distance matrix.
+                together = chunk[:, :, np.newaxis] == chunk[:, np.newaxis, :]
+                together &= matched[:, :, np.newaxis]
+                # einsum casts the mask in small buffers, not into a float copy of it.
+                own_distances = np.einsum('sij,ij->si', together, distance_matrix)
+                diversities = own_distances.sum(axis = 1) / 2.0 / num_teams
+
+                penalties = np.zeros(n)
+                if penalize:
+                        # The rule counts of every team, as in team_terms.
+                        met = np.column_stack([np.bincount(bins, engine.meets[students, rule], num_bins)
+                                               for rule in range(len(engine.rules))])
+                        team_penalties = engine.penalty(met.reshape(n, num_columns, -1))
+                        penalties = np.where(teams, team_penalties, 0.0).sum(axis = 1)
+                energies[first:first + n] = 2*(ranking_costs) - (0.5 * diversities) + penalties
+        return energies
+
+def team_changes(record):
+        '''
+                Describes how the move that returned record changed the members
+                of the teams it touched, as a list of (project, before, student_in,
+                student_out): project now holds the students that before held, with
+                the student of index student_out replaced by the one of index
+                student_in (both None if the students are the same).
+        '''
+        kind = record[0]
+        if kind == 'swap':
+                (kind, first_team, i, second_team, j) = record
+                student_in = first_team.students[i].index
+                student_out = second_team.students[j].index
+                return [(first_team, first_team, student_in, student_out),
+                        (second_team, second_team, student_out, student_in)]
+        elif kind == 'replace':
+                (kind, project, i, old_student) = record
+                return [(project, project, project.students[i].index, old_student.index)]
+        else:
+                # The new project took over the students of the old one.
+                return [(record[3], record[2], None, None)]
+
+def update_tracked(cache, name, changes, swap):
+        '''
+                Updates the per-team values cache[name] (team_sums or rule counts)
+                for a move, with swap(value, student_in, student_out) giving the
+                value of a team after one of its students was replaced. The old
+                values are kept in cache['pending_tracked'] for undo.
+
+                Returns
+                -------
+                new_values: the new value of every touched team (dict).
+        '''
+        values = cache[name]
+        pending = cache['pending_tracked']
+        new_values = {}
+        for (project, before, student_in, student_out) in changes:
+                if student_in is None:
+                        new_values[project] = values[before]
+                else:
+                        new_values[project] = swap(values[before], student_in, student_out)
+        for (project, before, student_in, student_out) in changes:
+                pending.append((name, before, values.pop(before)))
+                if not(project is before):
+                        pending.append((name, project, None))
+        values.update(new_values)
+        return new_values
+
+def delta_energy(state, record):
+        '''
+                Calculates the change in energy caused by the move that returned
+                record, by recomputing only the teams that the move touched.
+
+                Requires the team cache in state[4], filled in by a call to energy
+                (or energy_co) on the state before the move. The cache is updated
+                to the state after the move; undo puts it back if the move is rejected.
+                The rule counts and (with a squared_mahalanobis diversity) the
+                team_sums of the touched teams are updated from the students that
+                were swapped, so their penalties and diversities take O(1) and O(d).
+
+                Returns
+                -------
+                dE: the energy after the move minus the energy before it (float).
+        '''
+        projects = state[0]
+        inv_cov_mat_tup = state[1]
+        cache = state[4]
+        terms = cache['terms']
+        penalize = cache['penalize']
+        pending = []
+        cache['pending'] = pending
+        cache['pending_tracked'] = []
+        if record is None:
+                return 0.0
+
+        kind = record[0]
+        if kind == 'swap':
+                removed = [record[1], record[3]]
+                added = [record[1], record[3]]
+        elif kind == 'replace':
+                removed = [record[1]]
+                added = [record[1]]
+        elif kind == 'exchange':
+                removed = [record[2]]
+                added = [record[3]]
+        else:
+                raise util.FunctionError("Unknown undo record " + str(kind) + ".")
+
+        changes = team_changes(record)
+        new_sums, new_counts = {}, {}
+        if 'sums' in cache:
+                whitened = inv_cov_mat_tup[3]
+                new_sums = update_tracked(cache, 'sums', changes,
+                        lambda sums, s_in, s_out: classes.swap_team_sums(sums, whitened[s_in], whitened[s_out]))
+        if 'counts' in cache:
+                engine = composition.get_engine(projects[0].students[0].table)
+                new_counts = update_tracked(cache, 'counts', changes, engine.swap_counts)
+
+        d_cost, d_diversity, d_penalties = 0.0, 0.0, 0
+        for project in removed:
+                old = terms.pop(project)
+                pending.append((project, old))
+                d_cost -= old[0]
+                d_diversity -= old[1]
+                d_penalties -= old[2]
+        for project in added:
+                if project not in removed:
+                        pending.append((project, None))
+                new = team_terms(project, inv_cov_mat_tup, penalize, new_sums.get(project),
+                                 new_counts.get(project))
+                terms[project] = new
+                d_cost += new[0]
+                d_diversity += new[1]
+                d_penalties += new[2]
+        num_teams = len(projects)
+        return 2*(d_cost / num_teams) - (0.5 * d_diversity / num_teams) + d_penalties
+
+def undo(state, record):
+        '''
+                Reverts a move (see util.undo_move), along with the team cache
+                entries that delta_energy updated for it.
+        '''
+        util.undo_move(state, record)
+        if (len(state) > 4):
+                update_layout(state[4], record)
+        if (len(state) > 4 and 'terms' in state[4]):
+                cache = state[4]
+                terms = cache['terms']
+                for (project, old) in cache['pending']:
+                        if old is None:
+                                del terms[project]
+                        else:
+                                terms[project] = old
+                cache['pending'] = []
+                for (name, project, old) in reversed(cache.get('pending_tracked', [])):
+                        if old is None:
+                                del cache[name][project]
+                        else:
+                                cache[name][project] = old
+                cache['pending_tracked'] = []
+
+def restore(state, snapshot):
+        '''
+                Restores a snapshot (see util.restore_solution) and refills the team
+                cache for the restored assignment.
+        '''
+        util.restore_solution(state, snapshot)
+        if (len(state) > 4):
+                state[4].pop('layout', None)
+        if (len(state) > 4 and 'terms' in state[4]):
+                team_cost(state, state[4]['penalize'])
+        return state
+
+def move(state, verbose = False, super_verbose = False, targeted_swap_probability = None):
 	'''
 		Makes a random change to a state.
 		
 		Picks two random teams, picks two random members, and performs
-		a swap of these members across the teams.
+		a swap of these members across the teams. A share of the swaps
+		(targeted_swap_probability, by default classes.targeted_swap_probability)
+		is drawn by targeted_swap instead, towards unhappy students and
+		broken composition rules.
+
+		Targeted swaps are not proposed symmetrically, and no Hastings
+		correction is made for them: the chain is biased towards the
+		states that they favour, instead of sampling exp(-E / T). That is
+		fine for annealing, which only looks for low energies, but set
+		the probability to 0 for an unbiased chain.
 
                 With some small probability, change a project to a completely different project instead.
 		NOTE: there should be no teams of size 0 before calling the function.	
+
+                Returns an undo record for util.undo_move.
 	'''
         project_exchange_probability = 0.01
+        if (targeted_swap_probability is None):
+                targeted_swap_probability = classes.targeted_swap_probability
+        record = None
 
 	projects = state[0]
 	inv_cov_mat_tup = state[1]
         feasibles = state[2]
 
-        if random.random() < project_exchange_probability:
+        if util.stream.random() < project_exchange_probability:
                 project_to_swap = util.random_project(projects, [], True)
-                feasible_IDs = [p.ID for p in feasibles]
-                reasonable_project_IDs = list(set().union(*[set(s.project_rankings) for s in project_to_swap.students]))
-                reasonable_projects = filter(lambda p:p.ID in reasonable_project_IDs, feasibles)
-                def popularity(p):
-                        return len(filter(lambda s:s.get_ranking(p.ID) < 100,project_to_swap.students))
-                reasonable_projects.sort(key=popularity, reverse = True)
+                # The feasible projects ranked by any member of the team, most
+                # popular within the team first, from the columns of the rank matrix.
+                table = project_to_swap.students[0].table
+                indices = [st.index for st in project_to_swap.students]
+                popularity = (table.rank_matrix[indices] < 100).sum(axis = 0)
+                feasible_popularity = popularity[[p.ID for p in feasibles]]
+                order = np.argsort(-feasible_popularity, kind = 'mergesort')
+                reasonable_projects = [feasibles[k] for k in order if feasible_popularity[k] > 0]
                 most_likely_popular = reasonable_projects[:max(10, 2*len(projects))]
                 other = util.random_project(most_likely_popular, projects, False)
                 if other == None:
                         pass
                 else :
-                        tmp = project_to_swap.ID
-                        projects.remove(project_to_swap)
-                        projects.append(other)
+                        index = projects.index(project_to_swap)
+                        record = ('exchange', index, project_to_swap, other,
+                                  project_to_swap.students[:], project_to_swap.remaining_spots,
+                                  other.students[:], other.remaining_spots)
+                        projects[index] = other
                         util.safe_project_swap(project_to_swap, other)
+        elif targeted_swap_probability > 0 and util.stream.random() < targeted_swap_probability:
+                (first_team, i, second_team, j) = targeted_swap(projects, state[4] if (len(state) > 4) else None)
+                student_one = first_team.students[i]
+                first_team.students[i] = second_team.students[j]
+                second_team.students[j] = student_one
+                record = ('swap', first_team, i, second_team, j)
         else: 
                 project_one = util.random_project(projects, [], True)
                 project_two = util.random_project(projects, [], True)
@@ -116,8 +396,10 @@ def move(state, verbose = False, super_verbose = False):
 
                 # Pick a student from the first team, and this student will be swapped.
 
-                student_one = util.random_student(first_team)
-                student_two = util.random_student(second_team)
+                i = util.random_index(len(first_team.students))
+                j = util.random_index(len(second_team.students))
+                student_one = first_team.students[i]
+                student_two = second_team.students[j]
 
                 # NOTE: this is problematic if teams aren't full.
                 # 38
@@ -125,22 +407,12 @@ def move(state, verbose = False, super_verbose = False):
                 # while (not (student_one.degree_pursuing == student_two.degree_pursuing)):
                 #	student_two = util.random_student(second_team)
 
-                # Remove the students from their respective teams
-                first_team.students.remove(student_one)
-                if (not(student_two in second_team.students)):
-                        if (super_verbose):
-                                print "Second team students is " + str([s.ID for s in second_team.students])
-                        error = "Student two ("
-                        error += str(student_two.ID)
-                        error += ") is not in second_team.students ("
-                        error += str(second_team.ID)
-                        error += ") "
-
-                        raise CompError(error)
-                second_team.students.remove(student_two)
-
-                first_team.students.append(student_two)
-                second_team.students.append(student_one)
+                # Swap the students in place, so that the swap can be undone by index.
+                first_team.students[i] = student_two
+                second_team.students[j] = student_one
+                record = ('swap', first_team, i, second_team, j)
+        if (len(state) > 4):
+                update_layout(state[4], record)
 
 	if (verbose):
 		print "AFTER MOVE:"
@@ -151,50 +423,169 @@ def move(state, verbose = False, super_verbose = False):
 
 	#print energy(state_after_change)
 
-	return projects
+	return record
 
 def energy_co(state):
-        projects = state[0]
-	inv_cov_mat_tup = state[1]
+        '''
+                Calculates the energy of a given state, without the team
+                composition penalties.
+        '''
+        return team_cost(state, False)
 
-	def team_cost():
-		diversities = []
-                project_costs = []
-                penalties = 0
-		for project in projects:
-                        costs = []
-			project_diversity = project.calculate_diversity(inv_cov_mat_tup)
-			diversities.append(project_diversity)
-                        for student in project.students:
-                                rank = student.get_ranking(project.ID)
-                                cost = student.get_cost_from_ranking(rank)
-                                costs.append(cost)
-                        avg_project_cost = np.mean(costs)
-                        project_costs.append(avg_project_cost)
-                avg_diversity = np.mean(diversities)
-                ranking_cost = np.mean(project_costs)
-		return 2*(ranking_cost) - (0.5 * avg_diversity) + penalties
-
-	return team_cost()
 
+def swap_layout(projects, cache = None):
+        '''
+                Lays the students of every team out in one array, team by team,
+                for targeted_swap. move and undo keep it up to date for swaps
+                (see update_layout), in the team cache as cache['layout']. The
+                rule counts of the teams are taken from the cache if it has them.
+
+                Returns
+                -------
+                layout: a dict of the teams ('projects', a Project list), the
+                position of every team in it ('position', a dict), where the
+                students of every team start ('starts'), and the index, team
+                position, team project ID and rank of that project of every
+                student ('indices', 'team_of', 'project_IDs' and 'ranks'; numpy
+                arrays of ints), the rows of penalties.PenaltyEngine.meets of
+                the students ('meets') and the rule counts of the teams
+                ('counts'; numpy arrays of ints, one row per student or team).
+        '''
+        table = projects[0].students[0].table
+        engine = composition.get_engine(table)
+        sizes = [len(p.students) for p in projects]
+        starts = np.cumsum([0] + sizes)
+        team_of = np.repeat(np.arange(len(projects)), sizes)
+        indices = np.array([s.index for p in projects for s in p.students])
+        project_IDs = np.array([p.ID for p in projects])[team_of]
+        meets = engine.meets[indices]
+        if (cache is not None and 'counts' in cache):
+                counts = np.array([cache['counts'][p] for p in projects])
+        else:
+                counts = np.add.reduceat(meets, starts[:-1])
+        return {'projects' : projects[:],
+                'position' : dict((p, t) for (t, p) in enumerate(projects)),
+                'starts' : starts,
+                'indices' : indices,
+                'team_of' : team_of,
+                'project_IDs' : project_IDs,
+                'ranks' : table.rank_matrix[indices, project_IDs],
+                'meets' : meets,
+                'counts' : counts}
+
+def update_layout(cache, record):
+        '''
+                Brings cache['layout'] (see swap_layout) up to date after the move
+                (or the undo of the move) that returned record. A swap only
+                rewrites the two students that it moved; any other move drops
+                the layout, for targeted_swap to lay out again.
+        '''
+        layout = cache.get('layout')
+        if (layout is None or record is None):
+                return
+        if (record[0] != 'swap'):
+                del cache['layout']
+                return
+        (kind, first_team, i, second_team, j) = record
+        table = first_team.students[i].table
+        engine = composition.get_engine(table)
+        (first, second) = (layout['position'][first_team], layout['position'][second_team])
+        a = layout['starts'][first] + i
+        b = layout['starts'][second] + j
+        (index_a, index_b) = (first_team.students[i].index, second_team.students[j].index)
+        indices = layout['indices']
+        if (engine.masks[index_a] != engine.masks[indices[a]]):
+                (meets_a, meets_b) = (engine.meets[index_a], engine.meets[index_b])
+                change = meets_a - meets_b
+                layout['counts'][first] += change
+                layout['counts'][second] -= change
+                layout['meets'][a] = meets_a
+                layout['meets'][b] = meets_b
+        (indices[a], indices[b]) = (index_a, index_b)
+        ranks = layout['ranks']
+        (ranks[a], ranks[b]) = (table.rank_matrix[index_a, first_team.ID], table.rank_matrix[index_b, second_team.ID])
+
+def targeted_swap(projects, cache = None, rule_gain = 10):
+        '''
+                Picks two students on different teams to swap, favouring swaps
+                that the energy is likely to accept.
+
+                The first student is drawn with weight the rank that they gave
+                their team's project (100 if unranked), times one more than the
+                number of composition rules that their team breaks. The second is
+                drawn from the other teams with weight exp(gain / 2), where gain
+                is the drop in the two students' summed ranks that the swap would
+                bring, plus rule_gain for every rule that it would fix on the two
+                teams (net of those that it would break), clipped to [-20, 20].
+
+                Parameters
+                ----------
+                projects: the teams (Project list), at least two of them.
+                cache: the team cache (state[4]), or None. The layout of the
+                    students (see swap_layout) is kept there.
+                rule_gain: the gain of fixing one rule, in ranks (float).
+
+                Returns
+                -------
+                (first_team, i, second_team, j): the two teams, and the indices
+                of the students to swap in their student lists.
+        '''
+        table = projects[0].students[0].table
+        engine = composition.get_engine(table)
+        layout = None if (cache is None) else cache.get('layout')
+        if (layout is None):
+                layout = swap_layout(projects, cache)
+                if (cache is not None):
+                        cache['layout'] = layout
+        layout_projects = layout['projects']
+        starts = layout['starts']
+        indices = layout['indices']
+        team_of = layout['team_of']
+        ranks = layout['ranks']
+        meets = layout['meets']
+        counts = layout['counts']
+
+        # The number of rules that every team breaks.
+        num_broken = engine.num_broken(counts)
+
+        first = util.random_weighted_index(ranks * (1 + num_broken[team_of]))
+        team = team_of[first]
+
+        # Every other student, as the second one: the ranks of both students
+        # after the swap, and the rules broken on the two teams after the swap.
+        rank_drop = (ranks[first] + ranks - table.rank_matrix[indices[first], layout['project_IDs']]
+                     - table.rank_matrix[indices, layout_projects[team].ID])
+        num_fixed = (num_broken[team] + num_broken[team_of]
+                     - engine.num_broken((counts[team] - meets[first]) + meets)
+                     - engine.num_broken((counts[team_of] - meets) + meets[first]))
+        weights = np.exp(np.clip(rank_drop + rule_gain * num_fixed, -20, 20) / 2.0)
+        weights[starts[team]:starts[team + 1]] = 0
+        second = util.random_weighted_index(weights)
+
+        return (layout_projects[team], first - starts[team],
+                layout_projects[team_of[second]], second - starts[team_of[second]])
 
 def move_co(state, verbose = False, super_verbose = False):
         '''
                 A move for conversations in the studio. There are exactly classes.number_project_rankings
                 groups, so it does not make any sense to allow projects to change identity. In its place,
                 this move type will swap a student that is matched with a student that is unmatched.
+
+                Returns an undo record for util.undo_move.
         '''
 
         student_exchange_probability = 0.01
+        record = None
 
 	projects = state[0]
 	inv_cov_mat_tup = state[1]
         feasibles = state[2]
         students = state[3]
 
-        if random.random() < student_exchange_probability:
+        if util.stream.random() < student_exchange_probability:
                 project_to_choose_from = util.random_project(projects, [], True)
-                student_to_swap = util.random_student(project_to_choose_from)
+                i = util.random_index(len(project_to_choose_from.students))
+                student_to_swap = project_to_choose_from.students[i]
                 matched_students = []
                 for p in projects:
                         matched_students.extend(p.students)
@@ -202,8 +593,8 @@ def move_co(state, verbose = False, super_verbose = False):
                 if other == None:
                         pass
                 else :
-                        project_to_choose_from.students.remove(student_to_swap)
-                        project_to_choose_from.students.append(other)
+                        project_to_choose_from.students[i] = other
+                        record = ('replace', project_to_choose_from, i, student_to_swap)
         else: 
                 project_one = util.random_project(projects, [], True)
                 project_two = util.random_project(projects, [], True)
@@ -235,8 +626,10 @@ def move_co(state, verbose = False, super_verbose = False):
 
                 # Pick a student from the first team, and this student will be swapped.
 
-                student_one = util.random_student(first_team)
-                student_two = util.random_student(second_team)
+                i = util.random_index(len(first_team.students))
+                j = util.random_index(len(second_team.students))
+                student_one = first_team.students[i]
+                student_two = second_team.students[j]
 
                 # NOTE: this is problematic if teams aren't full.
                 # 38
@@ -244,22 +637,10 @@ def move_co(state, verbose = False, super_verbose = False):
                 # while (not (student_one.degree_pursuing == student_two.degree_pursuing)):
                 #	student_two = util.random_student(second_team)
 
-                # Remove the students from their respective teams
-                first_team.students.remove(student_one)
-                if (not(student_two in second_team.students)):
-                        if (super_verbose):
-                                print "Second team students is " + str([s.ID for s in second_team.students])
-                        error = "Student two ("
-                        error += str(student_two.ID)
-                        error += ") is not in second_team.students ("
-                        error += str(second_team.ID)
-                        error += ") "
-
-                        raise CompError(error)
-                second_team.students.remove(student_two)
-
-                first_team.students.append(student_two)
-                second_team.students.append(student_one)
+                # Swap the students in place, so that the swap can be undone by index.
+                first_team.students[i] = student_two
+                second_team.students[j] = student_one
+                record = ('swap', first_team, i, second_team, j)
 
 	if (verbose):
 		print "AFTER MOVE:"
@@ -270,4 +651,4 @@ def move_co(state, verbose = False, super_verbose = False):
 
 	#print energy(state_after_change)
 
-	return projects
+	return record
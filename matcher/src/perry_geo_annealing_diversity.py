@@ -23,79 +23,53 @@ def move(state, verbose = True, super_verbose = False):
 	'''
 		Makes a random change to a state.
 		
-		Picks two random teams, picks two random members, and performs
-		a swap of these members across the teams.
+		Picks a random team and a random member, and swaps them with a
+		random member of the same degree on another team.
 		
 		NOTE: there should be no teams of size 0 before calling the function.	
+
+		Returns an undo record for util.undo_move, or None if no other
+		team has a student of the same degree.
 	'''
 	projects = state[0]
-	inv_cov_mat_tup = state[1]
-
-	project_one = util.random_project(projects, [], True)
-	project_two = util.random_project(projects, [], True)
-
-
-	# Guarantee that the projects are not the same.
-	# Continue to swap project two until it is diff from project one.
-	while (project_one.ID == project_two.ID):
-		project_two = util.random_project(projects, [], True)
-		if (super_verbose):
-			print "Project one and project two are the same."
-
-	if (super_verbose):
-		print "Found two different projects."
-
-		print "First team students are " + str([s.ID for s in project_one.students])
-		print "Second team students are " + str([s.ID for s in project_two.students])
-
-		print "CLEAR: made it to pick_team"
-
-	# Team to pick first students from 
-	pick_team = util.random_two_choice()
-
-	if (pick_team == 0):
-		first_team = project_one
-		second_team = project_two
-	else:
-		first_team = project_two
-		second_team = project_one
 
 	# Pick a student from the first team, and this student will be swapped.
+	first_team = util.random_project(projects, [], True)
+	i = util.random_index(len(first_team.students))
+	student_one = first_team.students[i]
+
+	# Guarantee that the students are of the same type, by drawing the
+	# second one from the other teams' buckets of students of that degree.
+	buckets = []
+	for project in projects:
+		if (project.ID == first_team.ID):
+			continue
+		bucket = [k for (k, s) in enumerate(project.students)
+		          if s.degree_pursuing == student_one.degree_pursuing]
+		if (len(bucket) > 0):
+			buckets.append((project, bucket))
+	if (len(buckets) == 0):
+		if (super_verbose):
+			print "No other team has a student of the same degree."
+		return None
 
-	student_one = util.random_student(first_team)
-	student_two = util.random_student(second_team)
-
-	# NOTE: this is problematic if teams aren't full.
-	# Guarantee that the students are of the same type.
-	while (not (student_one.degree_pursuing == student_two.degree_pursuing)):
-		student_two = util.random_student(second_team)
+	(second_team, bucket) = buckets[util.random_index(len(buckets))]
+	j = bucket[util.random_index(len(bucket))]
+	student_two = second_team.students[j]
 
-	# Remove the students from their respective teams
-	first_team.students.remove(student_one)
-	if (not(student_two in second_team.students)):
-		if (super_verbose):
-			print "Second team students is " + str([s.ID for s in second_team.students])
-		error = "Student two ("
-		error += str(student_two.ID)
-		error += ") is not in second_team.students ("
-		error += str(second_team.ID)
-		error += ") "
-		
-		raise CompError(error)
-	second_team.students.remove(student_two)
+	if (super_verbose):
+		print "First team students are " + str([s.ID for s in first_team.students])
+		print "Second team students are " + str([s.ID for s in second_team.students])
 
-	first_team.students.append(student_two)
-	second_team.students.append(student_one)
+	# Swap the students in place, so that the swap can be undone by index.
+	first_team.students[i] = student_two
+	second_team.students[j] = student_one
 
 	if (verbose):
 		print "AFTER MOVE:"
 		for p in projects:
 		 	print str(p.ID) + ": " + str([s.ID for s in p.students])
 
-	state_after_change = (projects, inv_cov_mat_tup)
-
-	print energy(state_after_change)
-
-	return projects
+	return ('swap', first_team, i, second_team, j)
 
 
@@ -1,12 +1,18 @@
 import util
 import initial_solution
 import perry_geo_annealing as pg
-import perry_geo_annealing_diversity as diversity
+import parallel
+import tempering
+import flow
 
 import distance
 import numpy as np
 import copy
 import ConfigParser
+import multiprocessing
+
+from anneal import Annealer
+from classes import FieldError
 
 class CompError(Exception):
 	def __init__(self, value):
@@ -14,13 +20,83 @@ class CompError(Exception):
 	def __str__(self):
 		return repr(self.val)
 
-def manual_schedule(use_file, students, sol, feasible_projects,  annealer, use_diversity, filename, output_file = "output.csv"):
+# The manually set annealing schedule: (Tmax, Tmin, steps).
+annealing_schedule = (10000, 0.01, 54000)
+
+# The adaptive annealing schedule: (Tmax, Tmin, maximum steps, keyword
+# arguments of Annealer.adaptive_anneal).
+adaptive_schedule = (10000, 0.01, 54000, {'window': 500, 'accept_start': 0.5,
+	'accept_end': 0.001, 'reheat_after': 5400, 'stop_after': 20000})
+
+# The parallel tempering schedule: (Tmin, Tmax, exchanges, steps between
+# exchanges). Every replica makes as many moves as annealing_schedule.
+tempering_schedule = (0.01, 10000, 540, 100)
+
+def create_annealer(mode):
+	'''
+		Parameters
+		----------
+		mode: the algorithm mode, "cc" or "co" (string).
+
+		Returns
+		-------
+		An Annealer with the energy and move functions for that mode (Annealer).
+
+	'''
+	if (mode == "cc"):
+		return Annealer(pg.energy, pg.move, pg.undo, util.snapshot_solution,
+				pg.restore, pg.delta_energy, util.pack_snapshot, util.unpack_snapshot,
+				util.stream)
+	elif (mode == "co"):
+		return Annealer(pg.energy_co, pg.move_co, pg.undo, util.snapshot_solution,
+				pg.restore, pg.delta_energy, util.pack_snapshot, util.unpack_snapshot,
+				util.stream)
+	else:
+		raise FieldError("Unknown algorithm mode")
+
+def run_schedule(annealer, state, schedule, updates = 0, time_budget = None, checkpoint_file = None, resume = False):
+	'''
+		Parameters
+		----------
+		annealer: the Annealer object (Annealer).
+		state: the initial state (tuple).
+		schedule: (Tmax, Tmin, steps) for a fixed schedule, or (Tmax, Tmin,
+		    steps, keyword arguments) for an adaptive one (tuple).
+		updates: the number of updates to print (int).
+		time_budget: the number of seconds to anneal for (float), or None.
+		    It replaces the number of steps of a fixed schedule, and caps
+		    the time of an adaptive one.
+		checkpoint_file: a file to write checkpoints of a fixed schedule to
+		    (string), or None.
+		resume: indicates if the run saved in checkpoint_file should be
+		    continued (bool).
+
+		Returns
+		-------
+		The best state and energy found (tuple). The reason the annealer
+		stopped is left in annealer.stop_reason.
+
+	'''
+	if (len(schedule) > 3):
+		if (checkpoint_file is not None):
+			raise CompError("Checkpoints are only supported with the fixed annealing schedule.")
+		(Tmax, Tmin, steps, options) = schedule
+		return annealer.adaptive_anneal(state, Tmax, Tmin, steps, updates = updates,
+			time_budget_seconds = time_budget, **options)
+	(Tmax, Tmin, steps) = schedule
+	if (time_budget is not None):
+		steps = None
+	return annealer.anneal(state, Tmax, Tmin, steps, updates = updates,
+		time_budget_seconds = time_budget, checkpoint_file = checkpoint_file,
+		resume = resume)
+
+def manual_schedule(use_file, students, sol, feasible_projects,  annealer, use_diversity, filename, output_file = "output.csv", adaptive = False, time_budget = None, checkpoint_file = None, resume = False):
 	'''
 		Parameters
 		----------
 		use_file: indicates if we want to use the data from the file or not (bool).
 		students: student attributes (2d numpy array of ints).
-		sol: a solution (a Project list).
+		sol: a solution (a Project list). Ignored when resuming.
 		annealer: the Annealer object (Annealer).
 		use_diversity: indicates which energy function we want to use (bool).
 		    If use_diversity is True, then we use the energy function from
@@ -29,6 +105,12 @@ def manual_schedule(use_file, students, sol, feasible_projects,  annealer, use_d
 		    perry_geo_annealing.py.
 		filename: file that the input should come from (string).
 		output_file: file that the output should go to (string).
+		adaptive: indicates if the adaptive annealing schedule should be
+		    used instead of the fixed one (bool).
+		time_budget: the number of seconds to anneal for (float), or None.
+		checkpoint_file: a file to write checkpoints to (string), or None.
+		resume: indicates if the run saved in checkpoint_file should be
+		    continued instead of starting from sol (bool).
 
 		Returns
 		-------
@@ -39,22 +121,221 @@ def manual_schedule(use_file, students, sol, feasible_projects,  annealer, use_d
 	'''
 
 	inv_cov_mat_tup = distance.create_inv_cov_mat_from_data(use_file, students, filename)
-	if (len(sol) < 2):
+	if (resume):
+		# The teams are read from the checkpoint.
+		sol = []
+		for p in feasible_projects:
+			p.reset()
+	elif (len(sol) < 2):
 		error = "There is only one team, so we cannot perform simulated annealing."
 		raise CompError(error)
 
-	state = (sol, inv_cov_mat_tup, feasible_projects, students)
-	print "Initial energy is " + str(pg.energy(state))
-	# Manually set the annealing schedule.
-        state, e = annealer.anneal(state, 10000, 0.01, 54000, updates=20000)
+	# The last element is the team cache used by perry_geo_annealing.delta_energy.
+	state = (sol, inv_cov_mat_tup, feasible_projects, students, {})
+	if (not(resume)):
+		print "Initial energy is " + str(annealer.energy(state))
+	if (adaptive):
+		state, e = run_schedule(annealer, state, adaptive_schedule, 20, time_budget,
+			checkpoint_file, resume)
+	else:
+		# Manually set the annealing schedule.
+		state, e = run_schedule(annealer, state, annealing_schedule, 20000, time_budget,
+			checkpoint_file, resume)
+	print "Annealing stopped (" + annealer.stop_reason + ") after " + str(annealer.steps_taken) + " steps."
 
         #auto = annealer.auto(state, 90)
         #print auto
+	report_solution(state, e, annealer.energy, use_diversity, output_file)
+
+def multi_start_schedule(use_file, students, sol, feasible_projects, mode, use_diversity, filename, match_all, workers = None, restarts = None, output_file = "output.csv", seeds = None, adaptive = False, time_budget = None):
+	'''
+		Runs independent annealing chains across a pool of processes and
+		keeps the best one. The first chains start from sol and the other
+		greedy seeds, the rest from their own randomized greedy solutions.
+
+		Parameters
+		----------
+		use_file: indicates if we want to use the data from the file or not (bool).
+		students: the students (Student list).
+		sol: a solution (a Project list).
+		feasible_projects: the feasible projects (Project list).
+		mode: the algorithm mode, "cc" or "co" (string).
+		use_diversity: indicates which energy function we want to use (bool).
+		filename: file that the input should come from (string).
+		match_all: indicates if every student has to be matched (bool).
+		workers: the number of processes (int). Defaults to the number of CPUs.
+		restarts: the number of chains (int). Defaults to workers.
+		output_file: file that the output should go to (string).
+		seeds: the distinct greedy solutions, best first (Assignment list).
+		    The first one should be sol.
+		adaptive: indicates if the chains should use the adaptive annealing
+		    schedule instead of the fixed one (bool).
+		time_budget: the number of seconds to anneal for (float), or None.
+		    It is split between the chains that share a process.
+
+		Returns
+		-------
+		Nothing. Writes to the output file and prints the final energy
+		of every chain and the best solution to console.
+
+	'''
+	if (workers is None):
+		workers = multiprocessing.cpu_count()
+	if (restarts is None):
+		restarts = workers
+	if (workers < 1 or restarts < 1):
+		raise CompError("The number of workers and restarts must be positive.")
+
+	inv_cov_mat_tup = distance.create_inv_cov_mat_from_data(use_file, students, filename)
+	if (len(sol) < 2):
+		error = "There is only one team, so we cannot perform simulated annealing."
+		raise CompError(error)
+
+	starts = [util.projects_to_assignment(sol, students)]
+	if (seeds is not None):
+		starts += seeds[1:]
+	schedule = adaptive_schedule if (adaptive) else annealing_schedule
+	chain_budget = None
+	if (time_budget is not None):
+		rounds = (restarts + workers - 1) / workers
+		chain_budget = float(time_budget) / rounds
+	results = parallel.run_chains(students, feasible_projects, inv_cov_mat_tup, mode,
+		match_all, starts, schedule, workers, restarts, chain_budget)
+
+	energies = [e for (chain, seed, e, assignment, reason) in results]
+	for (chain, seed, e, assignment, reason) in results:
+		print "Chain " + str(chain) + " (seed " + str(seed) + ") final energy is " + str(e) + \
+			" (stopped: " + reason + ")"
+	print "Final energies: min " + str(np.min(energies)) + ", median " + str(np.median(energies)) + \
+		", max " + str(np.max(energies)) + ", std " + str(np.std(energies))
+
+	(chain, seed, e, assignment, reason) = min(results, key = lambda result: result[2])
+	print "Best chain is " + str(chain)
+	for p in feasible_projects:
+		p.reset()
+	best = util.assignment_to_projects(assignment, students, feasible_projects)
+	state = (best, inv_cov_mat_tup, feasible_projects, students, {})
+	report_solution(state, e, create_annealer(mode).energy, use_diversity, output_file)
+
+def parallel_tempering_schedule(use_file, students, sol, feasible_projects, mode, use_diversity, filename, replicas, workers = None, output_file = "output.csv", time_budget = None):
+	'''
+		Runs parallel tempering with replicas replicas, all starting from sol,
+		on a geometric temperature ladder.
+
+		Parameters
+		----------
+		use_file: indicates if we want to use the data from the file or not (bool).
+		students: the students (Student list).
+		sol: a solution (a Project list).
+		feasible_projects: the feasible projects (Project list).
+		mode: the algorithm mode, "cc" or "co" (string).
+		use_diversity: indicates which energy function we want to use (bool).
+		filename: file that the input should come from (string).
+		replicas: the number of replicas (int).
+		workers: the number of processes (int). Defaults to the number of CPUs.
+		output_file: file that the output should go to (string).
+		time_budget: the number of seconds to temper for (float), or None.
+
+		Returns
+		-------
+		Nothing. Writes to the output file and prints the swap acceptance
+		rate of every pair of neighbouring temperatures and the solution
+		to console.
+
+	'''
+	if (replicas < 2):
+		raise CompError("Parallel tempering needs at least two replicas.")
+
+	inv_cov_mat_tup = distance.create_inv_cov_mat_from_data(use_file, students, filename)
+	if (len(sol) < 2):
+		error = "There is only one team, so we cannot perform simulated annealing."
+		raise CompError(error)
+
+	# Every replica gets its own projects, but shares the problem data. The
+	# students are shared too, so that the teams of a replica hold the same
+	# Student objects as its state[3] (see util.random_student_lst).
+	state = (sol, inv_cov_mat_tup, feasible_projects, students, {})
+	shared = dict((id(x), x) for x in [inv_cov_mat_tup, students] + list(students))
+	states = [copy.deepcopy(state, dict(shared)) for i in range(0, replicas)]
+	for s in states:
+		util.check_unique_students(s[0])
+	print "Initial energy is " + str(pg.energy(state))
+
+	annealer = create_annealer(mode)
+	engine = tempering.ParallelTempering(annealer.energy, annealer.move, annealer.undo,
+		annealer.snapshot, annealer.restore, annealer.delta, annealer.stream)
+	(Tmin, Tmax, exchanges, steps) = tempering_schedule
+	state, e, rates = engine.temper(states, Tmin, Tmax, exchanges, steps, workers, updates = 20,
+		time_budget_seconds = time_budget)
+	print "Tempering stopped (" + engine.stop_reason + ") after " + str(engine.exchanges_made) + " exchanges."
+	util.check_unique_students(state[0])
+
+	ladder = tempering.geometric_ladder(Tmin, Tmax, replicas)
+	for k in range(0, replicas - 1):
+		print "Swap acceptance between T = %.4g and T = %.4g is %.2f%%" % (ladder[k], ladder[k + 1], 100.0 * rates[k])
+	report_solution(state, e, annealer.energy, use_diversity, output_file)
+
+def flow_schedule(use_file, students, feasible_projects, capacity, capacity_w, match_all, filename, project_id_mappings, config, output_file = "output.csv", workers = None):
+	'''
+		Assigns the students by min-cost flow on the rank costs (see
+		flow.flow_assignment) instead of annealing. The best greedy
+		solutions, as set in the [greedy] section of the config file, are
+		among the starting points of the flow's search.
+
+		Parameters
+		----------
+		use_file: indicates if we want to use the data from the file or not (bool).
+		students: the students (Student list).
+		feasible_projects: the feasible projects (Project list).
+		capacity: the minimum number of students on a team (int).
+		capacity_w: the maximum number of students on a team (int).
+		match_all: indicates if every student has to be matched (bool).
+		filename: file that the input should come from (string).
+		project_id_mappings: file with the project IDs and names (string).
+		config: the config file (string).
+		output_file: file that the output should go to (string).
+		workers: the number of processes for the greedy solutions (int).
+		    Defaults to the number of CPUs.
+
+		Returns
+		-------
+		Nothing. Writes to the output file and prints the solution to console.
+
+	'''
+	util.input_checks(students, feasible_projects, capacity, capacity_w, project_id_mappings, sorted = False)
+	configParser = ConfigParser.ConfigParser()
+	configParser.read(config.encode('string-escape'))
+	(num_times, time_budget, keep, flow_seed) = read_greedy_options(configParser)
+	seeds = greedy_solutions_and_goodness(students, feasible_projects, match_all, num_times, time_budget, keep, workers)
+
+	assignment = flow.flow_assignment(students, feasible_projects, capacity, capacity_w, match_all,
+		[assignment for (cost, assignment) in seeds])
+	print "The flow solution has an avg rank cost of " + str(util.average_rank_cost(assignment, students[0].table))
+	for p in feasible_projects:
+		p.reset()
+	sol = util.assignment_to_projects(assignment, students, feasible_projects)
+
+	inv_cov_mat_tup = distance.create_inv_cov_mat_from_data(use_file, students, filename)
+	state = (sol, inv_cov_mat_tup, feasible_projects, students, {})
+	report_solution(state, pg.energy_co(state), pg.energy_co, False, output_file)
+
+def report_solution(state, e, energy, use_diversity, output_file = "output.csv"):
+	'''
+		Parameters
+		----------
+		state: the final state (tuple).
+		e: the final energy reported by the annealer (float).
+		energy: the energy function that e comes from, to recompute it with.
+		use_diversity: indicates which energy function we want to use (bool).
+		output_file: file that the output should go to (string).
+
+		Returns
+		-------
+		Nothing. Writes to the output file and prints the solution to console.
+
+	'''
 	print "Final energy is " + str(e)
-	if (use_diversity):
-		print "Calculated final energy is " + str(diversity.energy(state))
-	else:
-		print "Calculated final energy is " + str(pg.energy(state))
+	print "Calculated final energy is " + str(energy(state))
 
 	util.print_final_solution(state, use_diversity, output_file)
         util.list_penalties(state)
@@ -63,79 +344,88 @@ def manual_schedule(use_file, students, sol, feasible_projects,  annealer, use_d
 		util.list_unranked_students(state)
 		util.list_low_interest_students(state)
 
-def greedy_solutions_and_goodness(students, feasible_projects, match_all, num_times = 1000):
+def greedy_solutions_and_goodness(students, feasible_projects, match_all, num_times = 1000, time_budget = None, keep = 1, workers = None):
 		'''
 			Optimizes the initial solution energy, not including diversity.
 			Then, annealing will optimize a function of the two.
-			Returns a list of projects.
+
+			Runs num_times randomized greedy solutions across workers
+			processes (default: the number of CPUs), stopping early once
+			time_budget seconds have passed, alongside one solution of
+			initial_solution.hungarian_initial_solution. Solutions are
+			compared by their average rank cost.
+
+			Returns a list of the keep best distinct solutions, best first,
+			as (average rank cost, Assignment).
 		'''
-		min_rank = float("inf")
-		min_sol = None
-
-		def avg_ranking_cost(solution, verbose = True):
-				avgs = []
-				for p in solution:
-					if (verbose):
-						print str(p.ID) + ":" + str([s.ID for s in p.students])
-						print "Ranks:",
-					rankings_costs = [s.get_cost_from_ranking(s.get_ranking(p.ID)) for s in p.students]
-					if (verbose):
-						print rankings_costs
-					avg_rank_costs = np.mean(rankings_costs)
-					if (verbose):
-						print "Average rank costs: " + str(avg_rank_costs)
-					avgs.append(avg_rank_costs)
-				overall_average_rank = np.mean(avgs)
-				return overall_average_rank
-
-		for i in range (0, num_times):
-			#Reset the feasible projects.
-			for project in feasible_projects:
-				project.reset()
-                                
-			cur_sol = initial_solution.greedy_initial_solution(students, feasible_projects)
-                        if match_all:
-                                cur_sol = initial_solution.randomly_add_unmatched_students(cur_sol)
-                        else :
-                                cur_sol = filter(lambda project: len(project.students) == project.capacity, cur_sol[0])
-			print "Greedy solution " + str(i) + ":"
-
-			cur_avg_rank = avg_ranking_cost(cur_sol)
-			
-			print "Solution " + str(i) + " average rank: " + str(cur_avg_rank)
-
-			# Compare the average ranks.
-			if (cur_avg_rank < min_rank):
-				min_rank = cur_avg_rank
-				min_sol = copy.deepcopy(cur_sol)
-                for i in range (0, len(feasible_projects)):
-                        for project in feasible_projects:
-                                project.reset()
-
-                        print "Greedy solution " + str(num_times + i) + ":"
-
-                        cur_sol = initial_solution.greedy_initial_solution_team_first(students, feasible_projects, i)
-                        if match_all:
-                                cur_sol = initial_solution.randomly_add_unmatched_students(cur_sol)
-                        else:
-                                cur_sol = filter(lambda project: len(project.students) == project.capacity, cur_sol[0])
-                        cur_avg_rank = avg_ranking_cost(cur_sol)
-
-                        print "Solution " + str(num_times + i) + " average rank: " + str(cur_avg_rank)
-                        if (cur_avg_rank < min_rank):
-                                min_rank = cur_avg_rank
-                                min_sol = copy.deepcopy(cur_sol)
-		print "The minimum avg rank is " + str(min_rank)
-		min_sol_projects = [p for p in min_sol if len(p.students) > 0]
-		print "The returned solution has an avg rank cost of " + str(avg_ranking_cost(min_sol_projects, verbose = False))
-		return min_sol_projects
-
-def do_greedy_initial_solutions(students, all_projects, annealer, project_id_mappings, config, verbose = False):
+		if (workers is None):
+			workers = multiprocessing.cpu_count()
+		seeds = parallel.greedy_seeds(students, feasible_projects, match_all, num_times, time_budget, keep, workers)
+		if (len(seeds) == 0):
+			raise CompError("No greedy solution was found within the time budget.")
+		print "The minimum avg rank is " + str(seeds[0][0])
+		return seeds
+
+def greedy_solution(students, feasible_projects, match_all, project_index = None):
+	'''
+		Parameters
+		----------
+		students: the students (Student list).
+		feasible_projects: the feasible projects, already reset (Project list).
+		match_all: indicates if every student has to be matched (bool).
+		project_index: an index of feasible_projects (ProjectIndex).
+
+		Returns
+		-------
+		One randomized greedy solution (Project list).
+
+	'''
+	sol = initial_solution.greedy_initial_solution(students, feasible_projects, project_index = project_index)
+	if match_all:
+		sol = initial_solution.randomly_add_unmatched_students(sol)
+	else:
+		sol = filter(lambda project: len(project.students) == project.capacity, sol[0])
+	return [p for p in sol if len(p.students) > 0]
+
+def read_greedy_options(configParser):
+	'''
+		Reads the optional [greedy] section of the config file.
+
+		Returns
+		-------
+		(num_times, time_budget, keep, flow_seed): the number of greedy
+		solutions (int), the number of seconds to spend on them (float, or
+		None for no limit), the number of distinct solutions to keep (int),
+		and whether the min-cost flow solution competes with them (bool).
+	'''
+	num_times = 1000
+	time_budget = None
+	keep = 1
+	flow_seed = False
+	if (configParser.has_section('greedy')):
+		if (configParser.has_option('greedy', 'restarts')):
+			num_times = configParser.getint('greedy', 'restarts')
+		if (configParser.has_option('greedy', 'time_budget')):
+			time_budget = configParser.getfloat('greedy', 'time_budget')
+			# A time budget of 0 means no limit.
+			if (time_budget <= 0):
+				time_budget = None
+		if (configParser.has_option('greedy', 'keep')):
+			keep = configParser.getint('greedy', 'keep')
+		if (configParser.has_option('greedy', 'flow_seed')):
+			flow_seed = configParser.getboolean('greedy', 'flow_seed')
+	return (num_times, time_budget, keep, flow_seed)
+
+def do_greedy_initial_solutions(students, all_projects, annealer, project_id_mappings, config, verbose = False, workers = None):
 		'''
 			Creates the feasible projects, and iterates 1000 (default number) of greedy 
 			solutions, randomizing the order in which students get their "first pick."
+			The number of solutions, a time budget and the number of distinct
+			solutions to keep can be set in the [greedy] section of the config file.
 
-			Returns the solution with the lowest initial energy.
+			Returns the solution with the lowest initial energy (Project list),
+			and the best distinct solutions by average rank cost, ordered by
+			their energy, best first (Assignment list).
 			Result is usually very good.
 		'''
 
@@ -150,6 +440,26 @@ def do_greedy_initial_solutions(students, all_projects, annealer, project_id_map
 		feasible_projects = util.create_feasible_projects(students, all_projects, verbose)
 		util.input_checks(students, feasible_projects, capacity, capacity_w, project_id_mappings, sorted = False) 
                 match_all= configParser.getboolean('valid_values', 'match_all')
-		sol = greedy_solutions_and_goodness(students, feasible_projects, match_all)
+
+		(num_times, time_budget, keep, flow_seed) = read_greedy_options(configParser)
+		seeds = greedy_solutions_and_goodness(students, feasible_projects, match_all, num_times, time_budget, keep, workers)
+		if (flow_seed):
+			# The min-cost flow solution, searched from the greedy ones, competes with them.
+			assignment = flow.flow_assignment(students, feasible_projects, capacity, capacity_w, match_all,
+				[assignment for (cost, assignment) in seeds])
+			cost = util.average_rank_cost(assignment, students[0].table)
+			print "The flow solution has an avg rank cost of " + str(cost)
+			seeds = sorted(seeds + [(cost, assignment)], key = lambda seed: seed[0])[:keep]
+		if (len(seeds) > 1):
+			# Rank the kept solutions by their full energy, diversity included.
+			inv_cov_mat_tup = distance.create_inv_cov_mat_from_data(False, students, None)
+			IDs = np.array([assignment.get_student_project_IDs() for (cost, assignment) in seeds])
+			energies = pg.batch_energy(IDs, students[0].table, inv_cov_mat_tup[2],
+				annealer.energy != pg.energy_co)
+			seeds = [seeds[k] for k in np.argsort(energies, kind = 'mergesort')]
+			print "The lowest initial energy is " + str(energies.min())
+		for p in feasible_projects:
+			p.reset()
+		sol = util.assignment_to_projects(seeds[0][1], students, feasible_projects)
 		print [p.ID for p in sol]
-		return sol
+		return sol, [assignment for (cost, assignment) in seeds]
@@ -2,15 +2,12 @@
 
 import util
 import classes
-import perry_geo_annealing as pg
 import ConfigParser
 import perry_geo_test as test
 import time
 
 import sys, getopt
 
-from anneal import Annealer
-
 if (__name__ == "__main__"):
 	'''
 		A format for describing the state of the system:
@@ -43,16 +40,24 @@ if (__name__ == "__main__"):
 
 	try:
 		argv = sys.argv[1:]
-		opts, args = getopt.getopt(argv, "i:o:m:c:", ["input", "output", "mode", "config"])
+		opts, args = getopt.getopt(argv, "i:o:m:c:", ["input", "output", "mode", "config", "workers=", "restarts=", "replicas=", "adaptive", "time-budget=", "checkpoint=", "resume", "seed="])
 	except (getopt.GetoptError):
 		print "Unrecognized arguments."
-		print " usage: ./ranked_teams_main.py -i <inputfile> [-o <outputfile>] -m [cc|co] -c <configfile>"
+		print " usage: ./ranked_teams_main.py -i <inputfile> [-o <outputfile>] -m [cc|co|flow] -c <configfile> [--workers N] [--restarts K] [--replicas R] [--adaptive] [--time-budget SECONDS] [--checkpoint FILE [--resume]] [--seed N]"
 		sys.exit(2)
 
 	set_input_file = False
 	set_output_file = False
         set_mode = False
         set_config = False
+        workers = None
+        restarts = None
+        replicas = None
+        adaptive = False
+        time_budget = None
+        checkpoint_file = None
+        resume = False
+        seed = None
 
 	for opt, arg in opts:
 		if (opt == "-i"):
@@ -67,17 +72,42 @@ if (__name__ == "__main__"):
                 elif (opt == "-c"):
                         config = arg
                         set_config = True
+                elif (opt == "--workers"):
+                        workers = int(arg)
+                elif (opt == "--restarts"):
+                        restarts = int(arg)
+                elif (opt == "--replicas"):
+                        replicas = int(arg)
+                elif (opt == "--adaptive"):
+                        adaptive = True
+                elif (opt == "--time-budget"):
+                        time_budget = float(arg)
+                elif (opt == "--checkpoint"):
+                        checkpoint_file = arg
+                elif (opt == "--resume"):
+                        resume = True
+                elif (opt == "--seed"):
+                        seed = int(arg)
 	if (not(set_input_file)):
 		print "Please specify an input file."
-		print " usage: ./ranked_teams_main.py -i <inputfile> [-o <outputfile>] -m [cc|co] -c <configfile>"
+		print " usage: ./ranked_teams_main.py -i <inputfile> [-o <outputfile>] -m [cc|co|flow] -c <configfile> [--workers N] [--restarts K] [--replicas R] [--adaptive] [--time-budget SECONDS] [--checkpoint FILE [--resume]] [--seed N]"
 		sys.exit(2)
         if (not(set_mode)):
                 print "Please specify a mode."
-                print " usage: ./ranked_teams_main.py -i <inputfile> [-o <outputfile>] -m [cc|co] -c <configfile>"
+                print " usage: ./ranked_teams_main.py -i <inputfile> [-o <outputfile>] -m [cc|co|flow] -c <configfile> [--workers N] [--restarts K] [--replicas R] [--adaptive] [--time-budget SECONDS] [--checkpoint FILE [--resume]] [--seed N]"
                 sys.exit(2)
         if (not(set_config)):
                 print "Please specify a config file."
                 sys.exit(2)
+        if (resume and checkpoint_file is None):
+                print "Please specify the checkpoint file to resume from with --checkpoint."
+                sys.exit(2)
+        if (checkpoint_file is not None and (adaptive or workers is not None or restarts is not None or replicas is not None)):
+                print "Checkpoints are only supported for a single chain with the fixed annealing schedule."
+                sys.exit(2)
+        if (seed is not None and not(resume)):
+                # Every random choice, in every process, comes from util.stream.
+                util.stream.seed(seed)
 	# Create a ConfigParser to get various fields from the config file.
 	configParser = ConfigParser.ConfigParser()
 	configFilePath = config
@@ -87,27 +117,43 @@ if (__name__ == "__main__"):
         project_id_mappings = configParser.get('files', 'project_id_mappings')
         capacity = configParser.getint('valid_values', 'capacity')
         capacity_w = configParser.getint('valid_values', 'capacity_w')
+        match_all = configParser.getboolean('valid_values', 'match_all')
         team_size = capacity
 
-        # Creating the annealer with our energy and move functions.
-        if mode == "cc":
-                annealer = Annealer(pg.energy, pg.move)
-        elif mode == "co":
-                annealer = Annealer(pg.energy_co, pg.move_co)
-        else:
-                raise FieldError("Unknown algorithm mode")
         all_projects = util.generate_all_projects(config)
 
         students = util.create_students_from_input(input_file, config)
         feasibles = util.create_feasible_projects(students, all_projects)
 
-        sol = test.do_greedy_initial_solutions(students, all_projects, annealer, project_id_mappings, config)
         use_file = False
         use_diversity = False
-        if (set_output_file):
-                test.manual_schedule(use_file, students, sol, feasibles,  annealer, use_diversity, input_file, output_file)
+        if (not(set_output_file)):
+                output_file = "output.csv"
+        if (mode == "flow"):
+                # Solve the ranking objective by min-cost flow, searched from the greedy solutions, without annealing.
+                test.flow_schedule(use_file, students, feasibles, capacity, capacity_w, match_all, input_file,
+                                   project_id_mappings, config, output_file, workers)
+                print "Program completed in " + str((time.time() - start_time)/60) + " minutes."
+                sys.exit(0)
+
+        # Creating the annealer with our energy and move functions.
+        annealer = test.create_annealer(mode)
+        if (resume):
+                # The teams come from the checkpoint, so skip the greedy solutions.
+                sol, seeds = None, None
+        else:
+                sol, seeds = test.do_greedy_initial_solutions(students, all_projects, annealer, project_id_mappings, config, workers = workers)
+        if (replicas is not None):
+                # Run parallel tempering on a ladder of replicas.
+                test.parallel_tempering_schedule(use_file, students, sol, feasibles, mode, use_diversity, input_file,
+                                               replicas, workers, output_file, time_budget)
+        elif (workers is not None or restarts is not None):
+                # Run independent chains across a process pool and keep the best.
+                test.multi_start_schedule(use_file, students, sol, feasibles, mode, use_diversity, input_file,
+                                          match_all, workers, restarts, output_file, seeds, adaptive, time_budget)
         else:
-                test.manual_schedule(use_file, students, sol, feasibles,  annealer, use_diversity, input_file)
+                test.manual_schedule(use_file, students, sol, feasibles,  annealer, use_diversity, input_file, output_file, adaptive, time_budget,
+                                     checkpoint_file, resume)
 
         string =  "Program completed in " + str((time.time() - start_time)/60)
         string += " minutes."
@@ -0,0 +1,204 @@
+"""
+This module performs parallel tempering (replica exchange) to find a state
+of a system that minimizes its energy.
+
+N replicas of the system are run at the temperatures of a geometric ladder
+from Tmin to Tmax. Every replica makes a fixed number of Metropolis moves at
+its own temperature, after which neighbouring rungs of the ladder propose to
+exchange their replicas. Hot replicas explore, and good states found there
+can drift down the ladder to be refined by the cold ones.
+
+The replicas are spread across worker processes, and each one stays in the
+process it started in: an exchange swaps the temperatures of two replicas
+rather than shipping their states between processes.
+
+It uses the same energy, move, undo, snapshot, restore and delta functions
+as anneal.Annealer.
+"""
+
+import math, time
+import multiprocessing
+
+from anneal import Annealer, time_string, STOP_STEPS, STOP_TIME
+
+def geometric_ladder(Tmin, Tmax, replicas):
+    """Returns replicas temperatures from Tmin to Tmax in geometric
+    progression, coldest first."""
+    if replicas < 2:
+        return [float(Tmin)]
+    ratio = (float(Tmax) / Tmin) ** (1.0 / (replicas - 1))
+    return [Tmin * ratio ** k for k in range(replicas)]
+
+def metropolis(annealer, replica, T, steps):
+    """Makes steps Metropolis moves on a replica at constant temperature T.
+
+    replica is a dict holding the state, its energy, and the best state and
+    energy seen so far; it is updated in place."""
+    state = replica['state']
+    prevEnergy = replica['energy']
+    exponentials = annealer.stream.exponentials(steps)
+    for step in range(steps):
+        record, E = annealer.move_energy(state, prevEnergy)
+        dE = E - prevEnergy
+        if dE > T * exponentials[step]:
+            annealer.undo(state, record)
+        else:
+            E = annealer.accepted_energy(state, E, dE)
+            prevEnergy = E
+            if E < replica['bestEnergy']:
+                replica['bestState'] = annealer.save_state(state)
+                replica['bestEnergy'] = E
+    replica['energy'] = prevEnergy
+
+def replica_worker(conn, annealer, states, seed):
+    """Runs the replicas given by states (a dict of replica index to state)
+    in a worker process, answering the commands sent down conn:
+
+    ('run', [(index, T), ...], steps) -- runs every replica at its
+        temperature and sends back [(index, energy, best energy), ...]
+    ('best', index) -- sends back (best state, best energy) of a replica
+    ('stop',) -- ends the process"""
+    annealer.stream.seed(seed)
+    replicas = {}
+    for index, state in states.items():
+        E = annealer.energy(state)
+        replicas[index] = {'state': state, 'energy': E,
+                           'bestState': annealer.save_state(state),
+                           'bestEnergy': E}
+    while True:
+        command = conn.recv()
+        if command[0] == 'run':
+            energies = []
+            for index, T in command[1]:
+                metropolis(annealer, replicas[index], T, command[2])
+                energies.append((index, replicas[index]['energy'],
+                                 replicas[index]['bestEnergy']))
+            conn.send(energies)
+        elif command[0] == 'best':
+            replica = replicas[command[1]]
+            state = annealer.load_state(replica['state'], replica['bestState'])
+            conn.send((state, replica['bestEnergy']))
+        else:
+            break
+    conn.close()
+
+class ParallelTempering:
+    """Performs parallel tempering by calling functions to calculate
+    energy and make moves on a state.
+
+    The functions and the stream are those of anneal.Annealer, except that
+    undo is required: replicas are never deep-copied."""
+    def __init__(self, energy, move, undo, snapshot=None, restore=None,
+                 delta=None, stream=None):
+        self.annealer = Annealer(energy, move, undo, snapshot, restore, delta,
+                                 stream=stream)
+        self.stop_reason = None   # why the last run stopped (a STOP_ constant)
+        self.exchanges_made = 0   # the number of rounds of exchanges made
+
+    def temper(self, states, Tmin, Tmax, exchanges, steps, workers=None,
+               updates=0, time_budget_seconds=None):
+        """Minimizes the energy of a system by parallel tempering.
+
+        Keyword arguments:
+        states -- one initial state per replica; replicas must not share
+            any mutable part of their states
+        Tmin -- temperature of the coldest replica (greater than zero)
+        Tmax -- temperature of the hottest replica
+        exchanges -- the number of rounds of exchanges between neighbours
+        steps -- the number of moves every replica makes between exchanges
+        workers -- the number of processes (defaults to the number of CPUs)
+        updates -- the number of updates to print during tempering
+        time_budget_seconds -- stop after the round of exchanges during
+            which this many seconds have passed (None for no limit)
+
+        Returns the best state and energy found, and the swap acceptance
+        rate of every pair of neighbouring temperatures, coldest first.
+        Why the run stopped is left in stop_reason, and the number of
+        rounds of exchanges made in exchanges_made."""
+        if Tmin <= 0.0:
+            raise ValueError('Parallel tempering requires a minimum temperature greater than zero.')
+        n = len(states)
+        ladder = geometric_ladder(Tmin, Tmax, n)
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        workers = max(1, min(workers, n))
+
+        # Replica index at every rung of the ladder, and the process of
+        # every replica.
+        rungs = range(n)
+        owner = [index % workers for index in range(n)]
+
+        conns, processes = [], []
+        seeds = self.annealer.stream.seeds(workers)
+        for w in range(workers):
+            parent, child = multiprocessing.Pipe()
+            own = dict((index, states[index]) for index in range(n) if owner[index] == w)
+            process = multiprocessing.Process(target=replica_worker,
+                args=(child, self.annealer, own, seeds[w]))
+            process.daemon = True
+            process.start()
+            # Only the worker keeps the child end, so that its death shows
+            # up here as an EOFError instead of a hang.
+            child.close()
+            conns.append(parent)
+            processes.append(process)
+
+        attempts = [0] * (n - 1)
+        accepts = [0] * (n - 1)
+        energies = [None] * n
+        bests = [None] * n
+        start = time.time()
+        deadline = None if time_budget_seconds is None else start + time_budget_seconds
+        self.stop_reason = STOP_STEPS
+        self.exchanges_made = 0
+        if updates > 0:
+            print 'Exchange   Cold energy   Best energy     Elapsed'
+        try:
+            for exchange in range(exchanges):
+                jobs = [[] for w in range(workers)]
+                for k in range(n):
+                    jobs[owner[rungs[k]]].append((rungs[k], ladder[k]))
+                for w in range(workers):
+                    conns[w].send(('run', jobs[w], steps))
+                for w in range(workers):
+                    for index, E, bestE in conns[w].recv():
+                        energies[index] = E
+                        bests[index] = bestE
+
+                # Alternate between the even and the odd pairs of rungs.
+                for k in range(exchange % 2, n - 1, 2):
+                    a, b = rungs[k], rungs[k + 1]
+                    x = (1.0/ladder[k] - 1.0/ladder[k + 1]) * (energies[a] - energies[b])
+                    attempts[k] += 1
+                    if x >= 0.0 or math.exp(x) > self.annealer.stream.random():
+                        rungs[k], rungs[k + 1] = b, a
+                        accepts[k] += 1
+
+                if updates > 0 and (exchange + 1) % max(1, exchanges // updates) == 0:
+                    print '%8i  %12.2f  %12.2f  %s' % (exchange + 1,
+                        energies[rungs[0]], min(bests),
+                        time_string(time.time() - start))
+
+                self.exchanges_made = exchange + 1
+                if deadline is not None and time.time() > deadline:
+                    self.stop_reason = STOP_TIME
+                    break
+
+            best = min(range(n), key=lambda index: bests[index])
+            conns[owner[best]].send(('best', best))
+            state, bestEnergy = conns[owner[best]].recv()
+        finally:
+            for conn, process in zip(conns, processes):
+                # Sending to a worker that died fails, and would hide the
+                # error that it died of.
+                if process.is_alive():
+                    try:
+                        conn.send(('stop',))
+                    except (IOError, EOFError):
+                        pass
+            for process in processes:
+                process.join()
+
+        rates = [float(accepts[k]) / attempts[k] if attempts[k] else 0.0
+                 for k in range(n - 1)]
+        return state, bestEnergy, rates
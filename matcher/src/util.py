@@ -1,17 +1,26 @@
-import random
 
 import classes
 from classes import Project
 from classes import FieldError
 from classes import CompError
-from classes import Student
+from classes import StudentTable
+from classes import Assignment
+from classes import ProjectIndex
+from classes import StudentIndex
+import penalties
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import ConfigParser
+from anneal import RandomStream
 
 student_ids = []
 
+# The random numbers of the moves, shared with the annealers that
+# perry_geo_test.create_annealer makes, so that checkpoints and seeding
+# cover both.
+stream = RandomStream()
+
 class InputError(Exception):
 	def __init__(self, value):
 		self.val = value
@@ -27,9 +36,8 @@ class FunctionError(Exception):
 # Functions for randomness
 def random_index(lst_length):
 	'''
-		Generate a random index for a list of length lst_length.
-		Handles the case that the list length is 1, which can be
-		problematic if using random.randint.
+		Generate a random index for a list of length lst_length, from
+		the uniform draws of stream.
 		Fails on empty lists.
 
 		Parameters:
@@ -43,11 +51,27 @@ def random_index(lst_length):
 	'''
 	if (lst_length == 0):
 		raise FunctionError("List has length of 0.")
-	elif (lst_length == 1):
-		r = 0
-	else:
-		r = random.randint(0, lst_length - 1)
-	return r
+	return stream.index(lst_length)
+
+def random_weighted_index(weights):
+	'''
+		Generate a random index of weights, picking each index with
+		probability proportional to its weight, from the uniform draws of
+		stream. Fails if no weight is positive.
+
+		Parameters:
+		-----------
+		weights: the non-negative weights (numpy array of floats).
+
+		Returns:
+		--------
+		r: a random index in the range [0, len(weights) - 1] (int).
+
+	'''
+	cumulative = np.cumsum(weights)
+	if (not (cumulative[-1] > 0)):
+		raise FunctionError("No weight is positive.")
+	return int(np.searchsorted(cumulative, stream.random() * cumulative[-1], side = 'right'))
 
 def random_project(projects, already_picked, reuse, verbose = False):
 	'''
@@ -146,7 +170,7 @@ def random_two_choice():
 		-------
 		number: either 0 or 1 (int).
 	'''
-	non_int = random.random()
+	non_int = stream.random()
 	if (non_int > 0.5):
 		return 1
 	else:
@@ -183,25 +207,17 @@ def get_student_from_ID(ID, students):
 		Parameters:
 		-----------
 		ID: ID for the student to search for (int).
-		students: list of students (Student list).
+		students: list of students (Student list), or an index of them
+		    (StudentIndex). Build a StudentIndex once when looking up
+		    many IDs in the same list.
 
 		Returns:
 		--------
 		student: object whose ID is ID (Student).
 	'''
-	matching_ID_lst = filter(lambda x: x.ID == ID, students)
-	# No matching IDs
-	if (len(matching_ID_lst) == 0):
-		error = "ID " + str(ID) + " does not match to a valid project."
-		raise FieldError(error)
-	# Multiple matching IDs
-	elif (len(matching_ID_lst) > 1):
-		error = "There is more than one matching project. Problem!"
-		raise FieldError(error)
-	# Otherwise, there is one element in the list and it matches our desired ID.
-	else:
-		return matching_ID_lst[0]
-
+	if (not(isinstance(students, StudentIndex))):
+		students = StudentIndex(students)
+	return students.get(ID)
 
 def get_project_from_ID(ID, projects):
 	'''
@@ -211,24 +227,17 @@ def get_project_from_ID(ID, projects):
 		Parameters:
 		-----------
 		ID: ID for the project to search for (int).
-		projects: list of projects (Project list).
+		projects: list of projects (Project list), or an index of them
+		    (ProjectIndex). Build a ProjectIndex once when looking up
+		    many IDs in the same list.
 
 		Returns:
 		--------
 		project: object whose ID is ID (Project).
 	'''
-	matching_ID_lst = filter(lambda x: x.ID == ID, projects)
-	# No matching IDs
-	if (len(matching_ID_lst) == 0):
-		error = "ID " + str(ID) + " does not match to a valid project."
-		raise FieldError(error)
-	# Multiple matching IDs
-	elif (len(matching_ID_lst) > 1):
-		error = "There is more than one matching project. Problem!"
-		raise FieldError(error)
-	# Otherwise, there is one element in the list and it matches our desired ID.
-	else:
-		return matching_ID_lst[0]
+	if (not(isinstance(projects, ProjectIndex))):
+		projects = ProjectIndex(projects)
+	return projects.get(ID)
 
 # Filter out projects with insufficient rankings to get matched.
 # Returns a list of projects which passed the test.
@@ -236,31 +245,30 @@ def create_feasible_projects(students, projects, verbose = False):
 	'''
 		Filters our the projects with insufficient rankings to get matched.
 
+		students: all students, indexed 0, 1, ... (Student list).
+		The counts come from the inverted index of the student table.
 	'''
+	table = students[0].table
 	insufficient_IDs = []
         feasible_IDs_tups = []
 	for p in projects:
-		matched = filter(lambda s: p.ID in s.project_rankings, students)
+		(MBA_count, MEng_count, HT_count, CM_count) = table.degree_counts[p.ID]
+                num_ranked = MBA_count + MEng_count + HT_count + CM_count
 		if (verbose):
+			(matched, ranks) = table.get_interested(p.ID)
+			matched = np.sort(matched)
+			degrees = table.degrees[matched]
 			print "For project " + str(p.ID) + ":"
-			print [s.ID for s in matched]
-		MBAs_ranked = [s for s in matched if s.degree_pursuing == "MBA" 
-		  or s.degree_pursuing == 0]
-		MEngs_ranked = [s for s in matched if s.degree_pursuing == "MEng" 
-		  or s.degree_pursuing == 1]
-                HT_ranked = [s for s in matched if s.degree_pursuing =="HT" or s.degree_pursuing == 2]
-                CM_ranked = [s for s in matched if s.degree_pursuing == "CM" or s.degree_pursuing == 3]
-                num_ranked = len(MBAs_ranked) + len(MEngs_ranked) + len(HT_ranked) + len(CM_ranked)
-		if (verbose):
-			print "MBAs" + str([s.ID for s in MBAs_ranked])
-			print "MEngs" + str([s.ID for s in MEngs_ranked])
-                        print "HTs" + str([s.ID for s in HT_ranked])
-                        print "CMs" + str([s.ID for s in CM_ranked])
-			print str(len(MBAs_ranked)) + " MBAs ranked this project."
-			print str(len(MEngs_ranked)) + " MEngs ranked this project."
-                        print str(len(HT_ranked)) + "HTs ranked this project."
-                        print str(len(CM_ranked)) + "CMs ranked this project."
-	 	if (len(MBAs_ranked) + len(MEngs_ranked) + len(HT_ranked) + len(CM_ranked) < p.capacity):
+			print list(table.IDs[matched])
+			print "MBAs" + str(list(table.IDs[matched[degrees == 0]]))
+			print "MEngs" + str(list(table.IDs[matched[degrees == 1]]))
+                        print "HTs" + str(list(table.IDs[matched[degrees == 2]]))
+                        print "CMs" + str(list(table.IDs[matched[degrees == 3]]))
+			print str(MBA_count) + " MBAs ranked this project."
+			print str(MEng_count) + " MEngs ranked this project."
+                        print str(HT_count) + "HTs ranked this project."
+                        print str(CM_count) + "CMs ranked this project."
+	 	if (num_ranked < p.capacity):
 	 		if (verbose):
 	 			string = "Not enough students ranked project "
 	 			string += str(p.ID)
@@ -272,14 +280,15 @@ def create_feasible_projects(students, projects, verbose = False):
         def popularity (p):
                 return p[1]
         feasible_IDs_tups.sort(key = popularity, reverse = True)
-	return [get_project_from_ID(x[0],projects) for x in feasible_IDs_tups]
+	project_index = ProjectIndex(projects)
+	return [get_project_from_ID(x[0], project_index) for x in feasible_IDs_tups]
 
 def get_num_ranked(p, students):
 	'''
 		Get the number of students who ranked this project in their top 10.
+		students: all students, indexed 0, 1, ... (Student list).
 	'''
-	matched = filter(lambda s: p.ID in s.project_rankings, students)
-	return len(matched)
+	return students[0].table.get_num_ranked(p.ID)
 
 def sort_projects_by_demand(students, projects, tup = False):
 	'''
@@ -307,6 +316,197 @@ def safe_project_swap(p1, p2):
                 p2.add_student(s, True)
         p1.reset()
 
+def undo_move(state, record):
+	'''
+		Reverts a move made by one of the annealing move functions.
+
+		Parameters:
+		-----------
+		state: the state that the move was applied to.
+		record: the undo record returned by the move (tuple or None).
+		    ('swap', first_team, i, second_team, j): the students at index i
+		        of first_team and index j of second_team were exchanged.
+		    ('replace', project, i, old_student): old_student was replaced
+		        at index i of project.
+		    ('exchange', index, old_project, new_project, old_students,
+		        old_spots, new_students, new_spots): new_project took the place
+		        of old_project at position index of the project list.
+		    None: the move did not change the state.
+
+		Returns:
+		--------
+		Nothing. Modifies state in place.
+
+	'''
+	if (record is None):
+		return
+	projects = state[0]
+	kind = record[0]
+	if (kind == 'swap'):
+		(kind, first_team, i, second_team, j) = record
+		first_students = first_team.students
+		second_students = second_team.students
+		first_students[i], second_students[j] = second_students[j], first_students[i]
+	elif (kind == 'replace'):
+		(kind, project, i, old_student) = record
+		project.students[i] = old_student
+	elif (kind == 'exchange'):
+		(kind, index, old_project, new_project, old_students, old_spots, new_students, new_spots) = record
+		projects[index] = old_project
+		old_project.force_students(old_students, old_spots)
+		new_project.force_students(new_students, new_spots)
+	else:
+		raise FunctionError("Unknown undo record " + str(kind) + ".")
+
+def snapshot_solution(state):
+	'''
+		Takes a compact snapshot of the assignment in state: the projects in
+		order, along with a copy of each project's student list.
+		Students and projects themselves are shared, not copied.
+
+		Returns:
+		--------
+		snapshot: a list of (project, students, remaining_spots) tuples.
+	'''
+	return [(p, p.students[:], p.remaining_spots) for p in state[0]]
+
+def restore_solution(state, snapshot):
+	'''
+		Writes a snapshot taken by snapshot_solution back into state.
+		The snapshot can be restored more than once.
+
+		Returns:
+		--------
+		state: the same state, now holding the snapshotted assignment.
+	'''
+	projects = state[0]
+	projects[:] = [tup[0] for tup in snapshot]
+	for (p, students, remaining_spots) in snapshot:
+		p.force_students(students[:], remaining_spots)
+	return state
+
+def pack_snapshot(state, snapshot):
+	'''
+		Encodes a snapshot taken by snapshot_solution as numpy arrays, for
+		annealing checkpoints: its Assignment, the remaining spots of every
+		team, and the students of every team in their order on the team.
+
+		Returns:
+		--------
+		arrays: the arrays, by name (dict).
+	'''
+	students = state[3]
+	student_teams = np.empty(len(students), dtype = np.int64)
+	student_teams.fill(-1)
+	members = []
+	for (team, (p, team_students, remaining_spots)) in enumerate(snapshot):
+		for s in team_students:
+			student_teams[s.index] = team
+			members.append(s.index)
+	assignment = Assignment(student_teams, [tup[0].ID for tup in snapshot],
+		[len(tup[1]) for tup in snapshot])
+	return {'student_teams': assignment.student_teams,
+		'team_IDs': assignment.team_IDs,
+		'team_counts': assignment.team_counts,
+		'remaining_spots': np.array([tup[2] for tup in snapshot], dtype = np.int64),
+		'members': np.array(members, dtype = np.int64)}
+
+def unpack_snapshot(state, arrays):
+	'''
+		Decodes the arrays of pack_snapshot into a snapshot that
+		restore_solution can write into state. The projects are taken from
+		the feasible projects of state and the students from its students.
+
+		Returns:
+		--------
+		snapshot: a list of (project, students, remaining_spots) tuples.
+	'''
+	students = state[3]
+	if (len(arrays['student_teams']) != len(students)):
+		raise CompError("The checkpoint was taken with a different set of students.")
+	project_index = ProjectIndex(state[2])
+	snapshot = []
+	start = 0
+	for (ID, count, remaining_spots) in zip(arrays['team_IDs'], arrays['team_counts'], arrays['remaining_spots']):
+		team_students = [students[i] for i in arrays['members'][start:start + count]]
+		snapshot.append((project_index.get(int(ID)), team_students, int(remaining_spots)))
+		start += count
+	return snapshot
+
+def projects_to_assignment(projects, students):
+	'''
+		Encodes a list of projects as an Assignment.
+
+		Parameters:
+		-----------
+		projects: the teams, in slot order (Project list).
+		students: all students, indexed 0, 1, ... (Student list).
+		    Students that are not on any project are unmatched (-1).
+
+		Returns:
+		--------
+		assignment: the array encoding of the projects (Assignment).
+	'''
+	student_teams = np.empty(len(students), dtype = np.int64)
+	student_teams.fill(-1)
+	for (team, p) in enumerate(projects):
+		for s in p.students:
+			student_teams[s.index] = team
+	team_IDs = [p.ID for p in projects]
+	team_counts = [len(p.students) for p in projects]
+	return Assignment(student_teams, team_IDs, team_counts)
+
+def assignment_to_projects(assignment, students, projects):
+	'''
+		Decodes an Assignment into a list of projects, in slot order, as
+		expected by print_final_solution and the annealing functions.
+
+		Parameters:
+		-----------
+		assignment: the array encoding of the teams (Assignment).
+		students: all students, indexed 0, 1, ... (Student list).
+		projects: projects to take the Project objects from (Project list).
+		    Must contain a project for every ID in assignment.team_IDs.
+		    The students of the chosen projects are overwritten.
+
+		Returns:
+		--------
+		solution: the teams (Project list).
+	'''
+	project_index = ProjectIndex(projects)
+	members = [[] for team in range(assignment.num_teams)]
+	for s in students:
+		team = assignment.student_teams[s.index]
+		if (team >= 0):
+			members[team].append(s)
+	solution = []
+	for (team, ID) in enumerate(assignment.team_IDs):
+		p = project_index.get(ID)
+		p.force_students(members[team], max(p.capacity - len(members[team]), 0))
+		solution.append(p)
+	return solution
+
+def average_rank_cost(assignment, table):
+	'''
+		The average over the teams of the average cost of the team members'
+		rankings of their project, looked up in the cost matrix.
+
+		Parameters:
+		-----------
+		assignment: the teams (Assignment).
+		table: the students (StudentTable).
+
+		Returns:
+		--------
+		cost: the average rank cost (float).
+	'''
+	matched = np.flatnonzero(assignment.student_teams >= 0)
+	teams = assignment.student_teams[matched]
+	costs = table.cost_matrix[matched, assignment.team_IDs[teams]]
+	sums = np.bincount(teams, weights = costs, minlength = assignment.num_teams)
+	nonempty = assignment.team_counts > 0
+	return np.mean(sums[nonempty] / assignment.team_counts[nonempty])
+
 def are_unique(l1, l2):
 	''' 
 		Checks if two given lists are unique.
@@ -322,6 +522,23 @@ def are_unique(l1, l2):
 	'''
 	return (set(l1).intersection(set(l2)) == set([]))
 
+def check_unique_students(projects):
+	'''
+		Checks that no student is on more than one team, or twice on
+		one, and raises a CompError otherwise.
+
+		Parameters
+		----------
+		projects: the teams (Project list).
+
+	'''
+	seen = set()
+	for p in projects:
+		for s in p.students:
+			if (s.ID in seen):
+				raise CompError("Student " + str(s.ID) + " is on more than one team.")
+			seen.add(s.ID)
+
 def create_students_from_input(file, config):
 	'''
 		There is a check for how many columns are in the student data input file.
@@ -344,7 +561,14 @@ def create_students_from_input(file, config):
 		shape = data_array.shape
 		num_rows = shape[0]
 
-		students_lst = []
+		IDs = []
+		names = []
+		degrees = []
+		business_abilities = []
+		coding_abilities = []
+		work_experiences = []
+		project_rankings = []
+		bin_fields = []
                 configParser = ConfigParser.ConfigParser()
                 configParser.read(config)
                 use_binary_raw = configParser.getboolean("valid_values", "use_binary")
@@ -352,7 +576,7 @@ def create_students_from_input(file, config):
                         use_binary = 1
                 else :
                         use_binary = 0
-		# Extract rows and create students
+		# Extract rows into columns for the student table.
 		for i in range(0, num_rows):
 			student = data_array[i,:]
 			if (not(len(student) == classes.number_project_rankings + 7 + use_binary)):
@@ -375,14 +599,22 @@ def create_students_from_input(file, config):
 			first_name = student[5 + classes.number_project_rankings]
 			last_name = student[5 + classes.number_project_rankings + 1]
                         name = first_name + " " + last_name
-			a = Student(name, ID, degree_pursuing, business_ability, coding_ability, 
-				num_yrs_work_exp, rankings)
                         if (use_binary_raw):
                                 bin_field = student[5 + classes.number_project_rankings + 2]
-                                a.set_bin_field(bin_field)
-			students_lst.append(a)
-
-		return students_lst
+                        else:
+                                bin_field = 0
+			IDs.append(ID)
+			names.append(name)
+			degrees.append(degree_pursuing)
+			business_abilities.append(business_ability)
+			coding_abilities.append(coding_ability)
+			work_experiences.append(num_yrs_work_exp)
+			project_rankings.append(rankings)
+			bin_fields.append(bin_field)
+
+		table = StudentTable(IDs, names, degrees, business_abilities, coding_abilities,
+			work_experiences, project_rankings, bin_fields)
+		return table.create_students()
 
 	except(IOError):
 		if (len(file) == 0):
@@ -466,7 +698,7 @@ def print_final_solution(state, use_diversity, output_file):
 		dict_project_names = read_project_ids_and_names_from_input()
 		output = []
 		print "Final Solution:"
- 		(projects, inv_cov_mat_tup, feasibles, students) = state
+ 		(projects, inv_cov_mat_tup, feasibles, students) = state[:4]
                 rankings_list = []
  		all_avg_ranks = []
 		for p in projects:
@@ -546,7 +778,7 @@ def list_unranked_students(state):
 	print
 	print "The following students were assigned to projects that they did not rank:"
 	print "-------------------------------------------------------------------------"
-	(projects, inv_cov_mat_tup, feasibles, students) = state
+	(projects, inv_cov_mat_tup, feasibles, students) = state[:4]
 	for p in projects:
 		for student in p.students:
 			# Get the student's rank of this project.
@@ -572,37 +804,17 @@ def list_unranked_students(state):
 
 def list_penalties(state):
         dict_project_names = read_project_ids_and_names_from_input()
-        (projects, inv_cov_mat_tup, feasibles, students) = state
+        (projects, inv_cov_mat_tup, feasibles, students) = state[:4]
         for p in projects:
                 project_name = dict_project_names[p.ID % classes.num_valid_projects]
                 print project_name + ": " + str([s.ID for s in p.students]) + " has the following penalties"
                 print "------------------------------"
-                numerics = []
-                for student in p.students:
-                        numerics.append(student.get_numerical_student_properties())
-                programs = [x[0] for x in numerics]
-                b_abilities = [x[1] for x in numerics]
-                c_abilities = [x[2] for x in numerics]
-                no_penalties = True
-                w_exp = [x[3] for x in numerics]
-                if 0 not in programs:
-                        print project_name + " has no MBA students"
-                        no_penalties = False
-                if 1 not in programs:
-                        print project_name + " has no CS in MEng students"
-                        no_penalties = False
-                if 3 not in c_abilities and 4 not in c_abilities:
-                        print project_name + " has no members who rated themselves at least 3 in coding ability."
-                        no_penalties = False
-                #penalty for a lack of business ability
-                if 3 not in b_abilities and 4 not in b_abilities:
-                        print project_name + " has no members who rated themselves at least a 3 in business ability."
-                        no_penalties = False
-                #penalty for lack of work experience
-                if 3 not in w_exp and 4 not in w_exp:
-                        print project_name + " has no members who have at least a 3 in work experience."
-                        no_penalties = False
-                if no_penalties:
+                # The same rules as the penalties of perry_geo_annealing.energy.
+                engine = penalties.get_engine(p.students[0].table)
+                broken = engine.broken_rules(engine.team_counts([s.index for s in p.students]))
+                for rule in broken:
+                        print project_name + " " + rule.description
+                if len(broken) == 0:
                         print project_name + " has no penalties!"
                 print
                 print
@@ -619,7 +831,7 @@ def list_low_interest_students(state):
 	stars = "***************************************************"
 	stars += "**********************************"
 	print stars
-	(projects, inv_cov_mat_tup, feasibles, students) = state
+	(projects, inv_cov_mat_tup, feasibles, students) = state[:4]
 	for p in projects:
 		for student in p.students:
 			# Get the student's rank of this project.